@@ -0,0 +1,132 @@
+#! /usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# mesure du temps de démarrage de sysbus.py
+#
+# Chaque scénario lance le script dans un nouveau processus (comme un script de supervision),
+# plusieurs fois, et retient la médiane. La durée totale est affichée, et le surcoût comparé à la
+# limite: le démarrage de l'interpréteur seul (python3 -c pass) est retranché, ainsi que l'import
+# de requests pour les requêtes directes à la Livebox, qui en ont besoin. Le scénario "script"
+# lance ./sysbus.py comme l'indique le README: recompilé à chaque lancement, il est indicatif et
+# n'est pas comparé à la limite. Les requêtes sont servies par livebox_sim.py.
+#
+#   $ python3 bench/bench_startup.py
+#   $ python3 bench/bench_startup.py -repeat 20 -max 0.05 noauth daemon
+
+import sys
+import os
+import time
+import argparse
+import tempfile
+import subprocess
+import statistics
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+import livebox_sim
+import fixtures
+
+RACINE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+
+# modules qui ne doivent pas être chargés par "import sysbus"
+DIFFERES = [ "requests", "asyncio", "http.server", "sqlite3", "pprint", "subprocess", "configparser", "datetime" ]
+
+
+##
+# @brief durée médiane d'une commande
+#
+# @return secondes
+def duree(commande, env, essais):
+    durees = [ ]
+    for _ in range(essais):
+        debut = time.perf_counter()
+        subprocess.run(commande, env=env, cwd=RACINE, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, check=False)
+        durees.append(time.perf_counter() - debut)
+    return statistics.median(durees)
+
+
+##
+# @brief vérifie que les modules des commandes particulières ne sont pas chargés à l'import
+#
+# @return liste des modules chargés
+def modules_charges(env):
+    code = ("import sys, sysbus; print(' '.join(n for n in %r if n in sys.modules))"
+            % (DIFFERES, ))
+    r = subprocess.run([ sys.executable, "-c", code ], env=env, cwd=RACINE, capture_output=True, text=True)
+    return r.stdout.split()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="temps de démarrage de sysbus.py")
+    parser.add_argument("-repeat", help="nombre de lancements par scénario", type=int, default=10)
+    parser.add_argument("-max", help="surcoût maximal toléré par rapport à l'interpréteur seul (s)", type=float, default=0.1)
+    parser.add_argument("scenarios", help="scénarios à mesurer (tous par défaut)", nargs="*")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        rep = os.path.join(tmp, "fixtures")
+        fixtures.genere(rep, 0.05)
+        server, url = livebox_sim.demarre(rep, ouvert=True)
+
+        # fichier d'état, socket du démon et caches isolés de ceux de l'utilisateur
+        env = dict(os.environ, HOME=tmp, TMPDIR=tmp, PYTHONDONTWRITEBYTECODE="")
+        sysbus = [ sys.executable, "-m", "sysbus", "-url", url ]
+        cassette = os.path.join(tmp, "cassette")
+        # authentification: la session mémorisée sert au scénario "session", la cassette au scénario "replay"
+        subprocess.run(sysbus + [ "-record", cassette, "-password", "x", "Time:getTime" ], env=env, cwd=RACINE,
+                       stdout=subprocess.DEVNULL, check=True)
+
+        # (nom, avec le démon, référence, commande)
+        scenarios = [ ("aide",    False, "python",   [ sys.executable, "-m", "sysbus", "-h" ]),
+                      ("noauth",  False, "requests", sysbus + [ "-noauth", "Time:getTime" ]),
+                      ("session", False, "requests", sysbus + [ "Time:getTime" ]),
+                      ("replay",  False, "python",   sysbus + [ "-replay", cassette, "Time:getTime" ]),
+                      ("daemon",  True,  "python",   sysbus + [ "Time:getTime" ]),
+                      ("script",  False, "requests", [ os.path.join(RACINE, "sysbus.py"), "-url", url, "-noauth", "Time:getTime" ]) ]
+
+        # le premier lancement compile le bytecode de sysbus (__pycache__)
+        duree(sysbus + [ "-h" ], env, 1)
+        references = { "python": duree([ sys.executable, "-c", "pass" ], env, args.repeat),
+                       "requests": duree([ sys.executable, "-c", "import requests" ], env, args.repeat) }
+        print("interpréteur seul: %.1f ms, avec import requests: %.1f ms" % (references["python"] * 1000, references["requests"] * 1000))
+        print("%-10s %10s %10s  %s" % ("scénario", "total", "surcoût", "référence"))
+
+        echecs = 0
+        for nom, avec_demon, reference, commande in scenarios:
+            if args.scenarios and nom not in args.scenarios:
+                continue
+
+            demon = None
+            if avec_demon:
+                demon = subprocess.Popen(sysbus + [ "-daemon" ], env=env, cwd=RACINE, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL)
+                demon.stdout.readline()         # "démon à l'écoute..."
+            try:
+                d = duree(commande, env, args.repeat)
+            finally:
+                if demon is not None:
+                    subprocess.run(sysbus + [ "-daemon", "stop" ], env=env, cwd=RACINE, stdout=subprocess.DEVNULL)
+                    demon.wait()
+
+            surcout = d - references[reference]
+            ligne = "%-10s %7.1f ms %7.1f ms  %s" % (nom, d * 1000, surcout * 1000,
+                                                  "interpréteur" if reference == "python" else "interpréteur + requests")
+            # sysbus.py lancé directement est recompilé à chaque fois: indicatif seulement
+            if nom == "script":
+                ligne += "   (indicatif)"
+            elif surcout > args.max:
+                ligne += "   TROP LENT"
+                echecs += 1
+            print(ligne)
+            sys.stdout.flush()
+
+        charges = modules_charges(env)
+        if charges:
+            print("modules chargés par import sysbus: %s" % " ".join(charges))
+            echecs += 1
+
+        server.shutdown()
+
+    sys.exit(1 if echecs > 0 else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,199 @@
+#! /usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# banc de mesure des traitements de sysbus.py
+#
+# Les réponses de la Livebox (générées par fixtures.py ou enregistrées) sont servies par
+# livebox_sim.py, sans latence. Chaque étape est mesurée (meilleur temps sur plusieurs essais, débit,
+# pic mémoire avec tracemalloc) et comparée à une référence enregistrée par -save.
+#
+#   $ python3 bench/bench_sysbus.py -save          # enregistre la référence
+#   $ python3 bench/bench_sysbus.py                # compare à la référence
+
+import sys
+import os
+import json
+import time
+import argparse
+import tempfile
+import contextlib
+import tracemalloc
+import gc
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+import sysbus
+import livebox_sim
+import fixtures
+
+
+##
+# @brief étapes mesurées: (nom, préparation, exécution, unité)
+#
+# La préparation n'est pas mesurée. L'exécution retourne le nombre d'unités traitées.
+#
+# @return
+def etapes(rep):
+
+    devnull = open(os.devnull, "w")
+
+    def taille(nom):
+        return os.path.getsize(os.path.join(rep, nom))
+
+    with open(os.path.join(rep, "NeMo.Intf.lo:getMIBs.json")) as f:
+        interfaces = len(json.load(f)["result"]["status"].get("base", { }))
+
+    def model_decode():
+        return sysbus.requete("sysbus", get=True)
+
+    def noeuds(nodes):
+        return sum(1 for _ in sysbus.model_walk(nodes))
+
+    def decode_model(_):
+        sysbus.requete("sysbus", get=True)
+        return taille("model.json")
+
+    def decode_mibs(_):
+        sysbus.requete("NeMo.Intf.lo:getMIBs", { "traverse": "all" })
+        return taille("NeMo.Intf.lo:getMIBs.json")
+
+    def decode_hosts(_):
+        sysbus.requete("Hosts:getDevices")
+        return taille("Hosts:getDevices.json")
+
+    def model_text(nodes):
+        for i in nodes:
+            sysbus.model(i, file=devnull)
+        return noeuds(nodes)
+
+    def uml(nodes):
+        for i in nodes:
+            sysbus.uml_model(i, os.devnull)
+        return noeuds(nodes)
+
+    def mibs_table(html):
+        with contextlib.redirect_stdout(devnull):
+            sysbus.MIBs_table_cmd(html)
+        return interfaces
+
+    def topo_labels(devices):
+        n = 0
+        pile = list(devices)
+        while pile:
+            d = pile.pop()
+            sysbus.topo_label(d)
+            n += 1
+            pile.extend(d.get('Children', [ ]))
+        return n
+
+    def topology():
+        return sysbus.requete("Devices.Device.HGW:topology")['status']
+
+    return [ ("decode_model",   lambda: None,  decode_model, "o"),
+             ("decode_mibs",    lambda: None,  decode_mibs,  "o"),
+             ("decode_hosts",   lambda: None,  decode_hosts, "o"),
+             ("model",          model_decode,  model_text,   "objets"),
+             ("uml_model",      model_decode,  uml,          "objets"),
+             ("mibs_table",     lambda: False, mibs_table,   "intf"),
+             ("mibs_html",      lambda: True,  mibs_table,   "intf"),
+             ("topo_labels",    topology,      topo_labels,  "devices") ]
+
+
+##
+# @brief mesure une étape
+#
+# @return { time, throughput, unit, peak }
+def mesure(preparation, execution, unite, essais):
+    etat = preparation()
+    execution(etat)                 # mise en route (connexions, caches)
+
+    meilleur = float("inf")
+    for _ in range(essais):
+        debut = time.perf_counter()
+        n = execution(etat)
+        meilleur = min(meilleur, time.perf_counter() - debut)
+
+    tracemalloc.start()
+    execution(etat)
+    _, pic = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    return { "time": meilleur, "throughput": n / meilleur, "unit": unite, "peak": pic }
+
+
+def format_debit(v, unite):
+    if unite == "o":
+        return "%8.1f Mo/s" % (v / 1e6)
+    return "%8.0f %s/s" % (v, unite)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="banc de mesure de sysbus.py")
+    parser.add_argument("-fixtures", help="répertoire des réponses (générées si absentes)")
+    parser.add_argument("-scale", help="facteur de taille des réponses générées", type=float, default=1.0)
+    parser.add_argument("-repeat", help="nombre d'essais par étape", type=int, default=5)
+    parser.add_argument("-baseline", help="fichier de référence", default=os.path.join(os.path.dirname(os.path.abspath(__file__)), "baseline.json"))
+    parser.add_argument("-save", help="enregistre les mesures comme référence", action="store_true")
+    parser.add_argument("-tolerance", help="écart toléré par rapport à la référence", type=float, default=0.25)
+    parser.add_argument("etapes", help="étapes à mesurer (toutes par défaut)", nargs="*")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        rep = args.fixtures or tmp
+        if not os.path.exists(os.path.join(rep, "model.json")):
+            print("génération des réponses dans %s..." % rep, file=sys.stderr)
+            fixtures.genere(rep, args.scale)
+
+        server, sysbus.URL_LIVEBOX = livebox_sim.demarre(rep, ouvert=True)
+        # le datamodel chargé par le simulateur ne doit pas ralentir le ramasse-miettes des mesures
+        gc.freeze()
+        sysbus.noauth()
+
+        # les temps dépendent de la machine: la référence est enregistrée sur chacune avec -save
+        reference = { }
+        if not args.save:
+            if os.path.exists(args.baseline):
+                with open(args.baseline) as f:
+                    reference = json.load(f)
+            else:
+                print("*** pas de référence %s: aucune régression ne peut être détectée, enregistrez-la d'abord avec -save ***"
+                      % args.baseline, file=sys.stderr)
+
+        resultats = { }
+        regressions = 0
+        sans_reference = 0
+        print("%-14s %10s %16s %10s" % ("étape", "temps", "débit", "pic mémoire"))
+        for nom, preparation, execution, unite in etapes(rep):
+            if args.etapes and nom not in args.etapes:
+                continue
+
+            r = mesure(preparation, execution, unite, args.repeat)
+            resultats[nom] = r
+
+            ligne = "%-14s %8.1f ms %16s %8.1f Mo" % (nom, r["time"] * 1000, format_debit(r["throughput"], unite), r["peak"] / 1e6)
+            if nom in reference:
+                ref = reference[nom]
+                ligne += "   %+6.1f%% temps, %+6.1f%% mémoire" % ((r["time"] / ref["time"] - 1) * 100, (r["peak"] / max(ref["peak"], 1) - 1) * 100)
+                # les étapes de quelques millisecondes sont trop bruitées pour un écart relatif seul
+                if r["time"] - ref["time"] > max(ref["time"] * args.tolerance, 0.005) or r["peak"] > ref["peak"] * (1 + args.tolerance):
+                    ligne += "   RÉGRESSION"
+                    regressions += 1
+            elif not args.save:
+                ligne += "   SANS RÉFÉRENCE"
+                sans_reference += 1
+            print(ligne)
+            sys.stdout.flush()
+
+    if args.save:
+        with open(args.baseline, "w") as f:
+            json.dump(resultats, f, indent=2)
+        print("référence enregistrée dans %s" % args.baseline)
+
+    if sans_reference > 0:
+        print("*** %d étape(s) sans référence dans %s: relancez avec -save ***" % (sans_reference, args.baseline), file=sys.stderr)
+
+    # 1: régression, 2: mesures non comparées
+    sys.exit(1 if regressions > 0 else 2 if sans_reference > 0 else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,165 @@
+#! /usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# génère des réponses Livebox synthétiques pour bench_sysbus.py et livebox_sim.py
+#
+# Les fichiers reprennent le format des réponses de la Livebox:
+#   model.json                          GET sysbus?_restDepth=-1 (objet du datamodel)
+#   NeMo.Intf.lo:getMIBs.json           getMIBs traverse=all ({"result": ...})
+#   Hosts:getDevices.json
+#   Devices.Device.HGW:topology.json
+#
+# On peut les remplacer par des réponses enregistrées sur une vraie Livebox.
+
+import sys
+import os
+import json
+import random
+import argparse
+
+
+##
+# @brief génère un datamodel: arborescence d'objets avec fonctions, paramètres et instances
+#
+# @param objets nombre approximatif d'objets
+# @param rnd générateur aléatoire
+#
+# @return
+def genere_model(objets, rnd):
+
+    types = [ "string", "bool", "int32", "uint32", "date_time" ]
+    compte = [ 0 ]
+
+    def valeur(t):
+        if t == "bool": return rnd.random() < 0.5
+        if t in ("int32", "uint32"): return rnd.randint(0, 100000)
+        if t == "date_time": return "2016-02-14T22:08:32Z"
+        return "".join(rnd.choice("abcdefghijklmnopqrstuvwxyz") for _ in range(rnd.randint(0, 24)))
+
+    def node(keyPath, key, niveau, instance=False):
+        compte[0] += 1
+        path = (keyPath + "." + key) if keyPath else key
+
+        functions = [ ]
+        for i in range(rnd.randint(1, 8)):
+            arguments = [ { "name": "arg%d" % j, "type": rnd.choice(types),
+                            "attributes": { "in": True, "out": rnd.random() < 0.2, "mandatory": rnd.random() < 0.5 } }
+                          for j in range(rnd.randint(0, 4)) ]
+            functions.append({ "name": rnd.choice([ "get", "set", "list", "add", "delete", "reset" ]) + "Func%d" % i,
+                               "type": rnd.choice(types + [ "void", "variant" ]),
+                               "attributes": { "message": rnd.random() < 0.1, "variadic": False },
+                               "arguments": arguments })
+
+        parameters = [ ]
+        for i in range(rnd.randint(2, 15)):
+            t = rnd.choice(types)
+            parameters.append({ "name": "Param%d" % i, "type": t, "value": valeur(t),
+                                "attributes": { "persistent": rnd.random() < 0.5, "read_only": rnd.random() < 0.3, "volatile": False } })
+
+        n = { "objectInfo": { "keyPath": keyPath, "key": key, "name": key, "indexPath": keyPath, "state": "ready",
+                              "attributes": { "instance": instance } },
+              "functions": functions, "parameters": parameters, "children": [ ], "instances": [ ] }
+
+        if not instance and niveau < 5 and compte[0] < objets:
+            for i in range(rnd.randint(0, 6 if niveau < 2 else 4)):
+                if compte[0] >= objets: break
+                n["children"].append(node(path, "Obj%d" % i, niveau + 1))
+            if rnd.random() < 0.3:
+                for i in range(rnd.randint(1, 5)):
+                    n["instances"].append(node(path, str(i + 1), niveau + 1, instance=True))
+            if rnd.random() < 0.05:
+                n["errors"] = [ { "error": 13, "info": "Secret%d" % compte[0], "description": "Permission denied" } ]
+        return n
+
+    racine = node("", "", 0)
+    # garantit le nombre d'objets demandé en ajoutant des services à la racine
+    i = 0
+    while compte[0] < objets:
+        racine["children"].append(node("", "Service%d" % i, 1))
+        i += 1
+    return racine
+
+
+##
+# @brief génère la réponse de getMIBs traverse=all: { mib: { interface: valeurs } }
+#
+# @return
+def genere_mibs(intfs, mibs, rnd):
+    noms = [ "intf%d" % i for i in range(intfs) ]
+    status = { }
+    for m in range(mibs):
+        mib = { }
+        for i in noms:
+            if rnd.random() < 0.6:
+                mib[i] = { "Param%d" % j: rnd.choice([ True, 1500, "eth0", "" ]) for j in range(rnd.randint(0, 12)) }
+        status["mib%d" % m] = mib
+    status["base"] = { i: { "Name": i, "Enable": True, "Flags": "up", "LLIntf": { }, "ULIntf": { } } for i in noms }
+    return { "status": status }
+
+
+##
+# @brief génère la liste des hosts de Hosts:getDevices
+#
+# @return
+def genere_hosts(n, rnd):
+    hosts = [ ]
+    for i in range(n):
+        mac = "AA:BB:%02X:%02X:%02X:%02X" % (i >> 24 & 255, i >> 16 & 255, i >> 8 & 255, i & 255)
+        hosts.append({ "physAddress": mac, "clientID": "id%d" % i, "ipAddress": "10.%d.%d.%d" % (i >> 16 & 255, i >> 8 & 255, i & 255),
+                       "hostName": "host%d" % i, "layer2Interface": rnd.choice([ "eth1", "eth2", "wl0", "wl1" ]),
+                       "active": rnd.random() < 0.3, "addressSource": "DHCP", "leaseTimeRemaining": rnd.randint(-1, 86400),
+                       "vendorClassID": "", "interfaceType": "Ethernet",
+                       "IPv6Address": [ { "Address": "2a01::%x" % i, "Status": "reachable", "Scope": "global" } ] })
+    return { "status": hosts }
+
+
+##
+# @brief génère la topologie: la Livebox, des commutateurs et les hosts
+#
+# @return
+def genere_topology(hosts, rnd):
+
+    def device(key, nom, type):
+        return { "Key": key, "Name": nom, "DeviceType": type, "Active": rnd.random() < 0.5, "Index": rnd.randint(1, 9999),
+                 "LastConnection": "2016-02-14T22:08:32Z", "Tags": "lan edev mac physical", "DiscoverySource": "bridge",
+                 "IPAddress": "192.168.1.%d" % rnd.randint(2, 254), "Layer2Interface": "eth1", "SSID": "",
+                 "Names": [ { "Name": nom, "Source": "dhcp" } ], "VendorClassID": "", "Children": [ ] }
+
+    hgw = device("HGW", "Livebox", "SAH HGW")
+    switchs = [ device("SW%d" % i, "switch%d" % i, "Switch") for i in range(max(1, hosts // 50)) ]
+    hgw["Children"] = switchs
+    for i in range(hosts):
+        rnd.choice(switchs)["Children"].append(device("AA:BB:%06X" % i, "host%d" % i, "Computer"))
+    return { "status": [ hgw ] }
+
+
+##
+# @brief écrit les fixtures dans un répertoire
+#
+# @param rep
+# @param echelle facteur de taille (1: ~5000 objets, 200 interfaces, 1000 hosts)
+# @param seed
+#
+# @return
+def genere(rep, echelle=1.0, seed=1):
+    rnd = random.Random(seed)
+    if not os.path.isdir(rep):
+        os.makedirs(rep)
+
+    fixtures = { "model.json": genere_model(int(5000 * echelle), rnd),
+                 "NeMo.Intf.lo:getMIBs.json": { "result": genere_mibs(int(200 * echelle), 40, rnd) },
+                 "Hosts:getDevices.json": { "result": genere_hosts(int(1000 * echelle), rnd) },
+                 "Devices.Device.HGW:topology.json": { "result": genere_topology(int(1000 * echelle), rnd) } }
+
+    for nom, d in fixtures.items():
+        with open(os.path.join(rep, nom), "w") as f:
+            json.dump(d, f)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="génère des réponses Livebox synthétiques")
+    parser.add_argument("rep", help="répertoire de sortie")
+    parser.add_argument("-scale", help="facteur de taille", type=float, default=1.0)
+    parser.add_argument("-seed", type=int, default=1)
+    args = parser.parse_args()
+    genere(args.rep, args.scale, args.seed)
@@ -0,0 +1,623 @@
+#! /usr/bin/env python3
+# -*- coding: utf-8 -*-
+
+# simulateur de Livebox pour tester sysbus.py sans équipement
+#
+# Il répond à l'authentification (cookie + contextID), aux appels /ws, aux lectures du
+# datamodel (sysbus/<chemin>?_restDepth=N) et au canal d'événements, à partir d'un répertoire:
+#   model.json[.gz|.xz]          datamodel sauvegardé par: sysbus.py -modelraw -out model.json
+#   <Service>:<méthode>.json     réponses enregistrées, par exemple NeMo.Intf.lo:getMIBs.json
+#                                (contenu {"result": ...} ou directement le résultat, en json ou en pprint)
+#   mibs_all, status.txt         écrits par sysbus.py -dump: NeMo.Intf.lo:getMIBs et DeviceInfo:get
+#   scripts.js                   facultatif, pour -scan et -files
+#
+# Les appels non enregistrés sont simulés à partir du datamodel: get retourne les paramètres
+# de l'objet, set les modifie (et émet un événement), les autres méthodes réussissent.
+# Les redirections de ports (Firewall:*PortForwarding) et les baux DHCP statiques
+# (DHCPv4.Server.Pool.default:*StaticLease*) sont gardés dans des tables modifiables.
+#
+# Pour imiter une Livebox chargée: latence par appel (-latency, -call-latency), nombre de
+# requêtes traitées simultanément (-concurrency) et taux d'erreurs (-error-rate).
+#
+#   $ ./livebox_sim.py -port 8080 -latency lognormal:-2.5:0.6 -concurrency 2 -error-rate 0.02 dump/
+#   $ ./sysbus.py -url http://127.0.0.1:8080/ -password x -info
+
+import sys
+import os
+import re
+import ast
+import json
+import gzip
+import lzma
+import time
+import random
+import fnmatch
+import argparse
+import contextlib
+import threading
+import urllib.parse
+import http.server
+from collections import Counter
+
+
+##
+# @brief distribution de latence: s, const:s, uniform:min:max, normal:moy:écart, lognormal:mu:sigma, exp:moy
+#
+class latence:
+
+    def __init__(self, spec):
+        self.spec = spec
+        a = spec.split(':')
+        if len(a) == 1 and re.match(r'^[0-9.]+$', spec):
+            a = [ 'const', spec ]           # un nombre seul: latence constante
+        self.loi = a[0]
+        self.p = [ float(x) for x in a[1:] ]
+        n = { 'const': 1, 'uniform': 2, 'normal': 2, 'lognormal': 2, 'exp': 1 }.get(self.loi)
+        if n is None or len(self.p) != n:
+            raise ValueError("latence invalide: %s" % spec)
+
+    def tire(self, rnd):
+        if self.loi == 'const': return self.p[0]
+        if self.loi == 'uniform': return rnd.uniform(*self.p)
+        if self.loi == 'normal': return max(0, rnd.gauss(*self.p))
+        if self.loi == 'lognormal': return rnd.lognormvariate(*self.p)
+        return rnd.expovariate(1 / self.p[0]) if self.p[0] > 0 else 0
+
+
+##
+# @brief fichiers de sysbus.py -dump (sortie de pprint) et appels dont ils sont la réponse
+DUMP = {
+    "mibs_all": "NeMo.Intf.lo:getMIBs",
+    "status.txt": "DeviceInfo:get",
+}
+
+
+##
+# @brief réponses par défaut des appels utilisés par les commandes de sysbus.py (-info, -time...),
+# quand ni les réponses enregistrées ni le datamodel ne les fournissent
+DEFAUTS = {
+    "DeviceInfo:get": { 'status': { 'Manufacturer': "Sagemcom", 'ModelName': "Livebox simulée", 'SoftwareVersion': "SIM_1.0",
+                                    'UpTime': 3600, 'NumberOfReboots': 1, 'ExternalIPAddress': "192.0.2.1" } },
+    "NMC:getWANStatus": { 'status': True, 'data': { 'LinkType': "dsl", 'LinkState': "up", 'Protocol': "ppp", 'ConnectionState': "Bound",
+                                                   'IPAddress': "192.0.2.1", 'IPv6Address': "2001:db8::1", 'IPv6DelegatedPrefix': "2001:db8:1::/56" } },
+    "NMC.Wifi:getStats": { 'status': True, 'data': { 'RxBytes': 0, 'TxBytes': 0 } },
+    "Time:getTime": { 'status': True, 'data': { 'time': None } },
+    "Time:getLocalTimeZoneName": { 'status': True, 'data': { 'timezone': "Europe/Paris" } },
+    "VoiceService.VoiceApplication:listTrunks": { 'status': [ ] },
+    "VoiceService.VoiceApplication:getCallList": { 'status': [ ] },
+    "DHCPv4.Server.Pool.default:getStaticLeases": { 'status': [ ] },
+    "Hosts:getDevices": { 'status': [ ] },
+    "Devices.Device.HGW:topology": { 'status': [ ] },
+    "NeMo.Intf.lo:getMIBs": { 'status': { } },
+    "NeMo.Intf.lo:getIntfs": { 'status': [ ] },
+}
+
+
+##
+# @brief données et état de la Livebox simulée
+#
+class livebox:
+
+    def __init__(self, rep=None, password=None):
+        self.password = password
+        self.model = None
+        self.appels = { }
+        self.scripts = b'var x = "sysbus.NMC:getWANStatus";\n'
+        self.contextes = { }                # contextID -> cookie
+        self.lock = threading.Lock()
+        self.evenements = threading.Condition()
+        self.canaux = { }                   # channelid -> liste d'événements en attente
+        self.stats = Counter()
+        self.encodes = { }                  # réponses déjà encodées (datamodel, appels enregistrés)
+
+        if rep:
+            self.charge(rep)
+
+        # les tables modifiables partent des réponses enregistrées
+        # redirections de ports: "origine_id" -> règle de Firewall:getPortForwarding
+        self.redirections = dict(self.appels.pop("Firewall:getPortForwarding", { }).get('status') or { })
+        # baux DHCP statiques: MAC -> bail de getStaticLeases
+        self.baux = { l['MACAddress'].upper(): l for l in self.appels.pop("DHCPv4.Server.Pool.default:getStaticLeases", { }).get('status') or [ ] }
+
+
+    def charge(self, rep):
+        for nom in sorted(os.listdir(rep)):
+            fichier = os.path.join(rep, nom)
+            if re.match(r'model\.json(\.gz|\.xz)?$', nom):
+                self.model = lit_model(fichier)
+            elif nom == "scripts.js":
+                with open(fichier, "rb") as f:
+                    self.scripts = f.read()
+            elif (nom.endswith(".json") and ':' in nom) or nom in DUMP:
+                d = lit_reponse(fichier)
+                self.appels[DUMP.get(nom, nom[:-5])] = d['result'] if isinstance(d, dict) and 'result' in d else d
+
+
+    ##
+    # @brief cherche un objet du datamodel par son chemin ('NeMo.Intf.lo', '' pour la racine)
+    #
+    def objet(self, chemin):
+        if self.model is None:
+            return None
+        node = self.model
+        for k in [ k for k in chemin.split('.') if k ]:
+            suivant = None
+            for c in node.get('children', [ ]) + node.get('instances', [ ]):
+                if c['objectInfo']['key'] == k or c['objectInfo'].get('name') == k:
+                    suivant = c
+                    break
+            if suivant is None:
+                return None
+            node = suivant
+        return node
+
+
+    ##
+    # @brief réponse encodée d'un appel /ws
+    #
+    # @return bytes
+    def reponse_ws(self, service, methode, parametres):
+        k = service + ":" + methode
+        if k in self.appels and not parametres.get('mibs'):
+            self.stats[k] += 1
+            with self.lock:
+                if k not in self.encodes:
+                    self.encodes[k] = json.dumps({ 'result': self.appels[k] }).encode('utf-8')
+                return self.encodes[k]
+        return json.dumps({ 'result': self.appel(service, methode, parametres) }).encode('utf-8')
+
+
+    ##
+    # @brief répond à un appel /ws
+    #
+    # @return résultat ({"status": ...} ou {"status": null, "errors": [...]})
+    def appel(self, service, methode, parametres):
+        k = service + ":" + methode
+        self.stats[k] += 1
+
+        if service == "Firewall" and methode.endswith("PortForwarding"):
+            with self.lock:
+                return self.redirection(methode, parametres)
+
+        if service == "DHCPv4.Server.Pool.default" and "StaticLease" in methode:
+            with self.lock:
+                return self.bail(methode, parametres)
+
+        if k in self.appels:
+            r = self.appels[k]
+            # getMIBs: ne garde que les MIBs demandées
+            if methode == "getMIBs" and parametres.get('mibs') and isinstance(r.get('status'), dict):
+                mibs = set(re.split(r'[ ,]+', parametres['mibs']))
+                r = { 'status': { m: v for m, v in r['status'].items() if m in mibs } }
+            return r
+
+        node = self.objet(service)
+
+        if methode == "get":
+            if node is not None:
+                return { 'status': { p['name']: p.get('value') for p in node.get('parameters', [ ]) } }
+            # NeMo.Intf.xxx:get sans datamodel: la MIB base de getMIBs enregistré
+            m = re.match(r'NeMo\.Intf\.(.+)$', service)
+            base = self.appels.get("NeMo.Intf.lo:getMIBs", { }).get('status', { }).get('base', { })
+            if m and m.group(1) in base:
+                return { 'status': base[m.group(1)] }
+
+        elif methode == "set" and node is not None:
+            valeurs = parametres.get('parameters', parametres)
+            if isinstance(valeurs, str):
+                try:
+                    valeurs = json.loads(valeurs)
+                except ValueError:
+                    valeurs = { }
+            if not isinstance(valeurs, dict):
+                return { 'status': None, 'errors': [ { 'error': 196618, 'description': "invalid parameters", 'info': service } ] }
+            with self.lock:
+                for p in node.get('parameters', [ ]):
+                    if p['name'] in valeurs:
+                        p['value'] = valeurs[p['name']]
+                self.encodes = { k: v for k, v in self.encodes.items() if not k.startswith("GET ") }
+            self.emet("sysbus." + service, { 'reason': "changed", 'attributes': valeurs })
+            return { 'status': True }
+
+        elif node is not None or not re.match(r'get|list', methode):
+            return { 'status': True }
+
+        if k in DEFAUTS:
+            if k == "Time:getTime":
+                return { 'status': True, 'data': { 'time': time.strftime("%a, %d %b %Y %H:%M:%S GMT%z") } }
+            return DEFAUTS[k]
+
+        return { 'status': None, 'errors': [ { 'error': 196618, 'description': "Object or function not found", 'info': k } ] }
+
+
+    ##
+    # @brief table des redirections de ports: get, set et deletePortForwarding
+    #
+    # Comme la Livebox, l'identifiant retourné est préfixé par l'origine (webui_ssh) et
+    # persistent n'est pas retourné.
+    #
+    # @return résultat
+    def redirection(self, methode, p):
+        def erreur(info):
+            return { 'status': None, 'errors': [ { 'error': 196618, 'description': "Object or function not found", 'info': info } ] }
+
+        cle = "%s_%s" % (p.get('origin', "webui"), p.get('id'))
+
+        if methode == "getPortForwarding":
+            if p.get('id'):
+                return { 'status': { cle: self.redirections[cle] } } if cle in self.redirections else erreur(cle)
+            regles = self.redirections.items()
+            if p.get('origin'):
+                regles = [ (k, v) for k, v in regles if v['Origin'] == p['origin'] ]
+            return { 'status': dict(regles) }
+
+        if methode == "setPortForwarding":
+            if not p.get('id') or not p.get('destinationIPAddress') or not p.get('externalPort'):
+                return { 'status': None, 'errors': [ { 'error': 196619, 'description': "missing parameter", 'info': "setPortForwarding" } ] }
+            self.redirections[cle] = { 'Id': cle, 'Origin': p.get('origin', "webui"), 'Description': p.get('description', ""),
+                                       'Status': "Enabled" if p.get('enable', True) else "Disabled",
+                                       'SourceInterface': p.get('sourceInterface', "data"), 'Protocol': str(p.get('protocol', "6")),
+                                       'ExternalPort': str(p['externalPort']), 'InternalPort': str(p.get('internalPort', p['externalPort'])),
+                                       'SourcePrefix': p.get('sourcePrefix', ""), 'DestinationIPAddress': p['destinationIPAddress'],
+                                       'DestinationMACAddress': "", 'LeaseDuration': 0, 'HairpinNAT': True, 'SymmetricSNAT': False,
+                                       'UPnPV1Compat': False, 'Enable': bool(p.get('enable', True)) }
+            return { 'status': cle }
+
+        if methode == "deletePortForwarding":
+            if cle not in self.redirections:
+                return erreur(cle)
+            del self.redirections[cle]
+            return { 'status': True }
+
+        return erreur("Firewall:" + methode)
+
+
+    ##
+    # @brief table des baux DHCP statiques: getStaticLeases, addStaticLease et deleteStaticLease
+    #
+    # Comme la Livebox, l'ajout d'une MAC déjà présente ou d'une adresse déjà attribuée échoue.
+    #
+    # @return résultat
+    def bail(self, methode, p):
+        def erreur(description, info):
+            return { 'status': None, 'errors': [ { 'error': 196618, 'description': description, 'info': info } ] }
+
+        mac = str(p.get('MACAddress', "")).upper()
+
+        if methode == "getStaticLeases":
+            return { 'status': list(self.baux.values()) }
+
+        if methode == "addStaticLease":
+            if not mac or not p.get('IPAddress'):
+                return erreur("missing parameter", "addStaticLease")
+            if mac in self.baux:
+                return erreur("MAC address already exists", mac)
+            if any(l['IPAddress'] == p['IPAddress'] for l in self.baux.values()):
+                return erreur("IP address already used", p['IPAddress'])
+            n = max([ int(l.get('LeasePath', "0").rsplit('.', 1)[-1]) for l in self.baux.values() ] + [ 0 ]) + 1
+            self.baux[mac] = { 'IPAddress': p['IPAddress'], 'MACAddress': mac, 'LeasePath': "DHCPv4.Server.Pool.1.StaticAddress.%d" % n }
+            return { 'status': True }
+
+        if methode == "deleteStaticLease":
+            if mac not in self.baux:
+                return erreur("Object or function not found", mac)
+            del self.baux[mac]
+            return { 'status': True }
+
+        return erreur("Object or function not found", "DHCPv4.Server.Pool.default:" + methode)
+
+
+    ##
+    # @brief lecture du datamodel, tronqué à la profondeur demandée
+    #
+    # @return réponse encodée ou None
+    def lecture(self, chemin, prof):
+
+        def tronque(node, prof):
+            if prof < 0:
+                return node
+            n = dict(node)
+            if prof == 0:
+                n['children'] = [ ]
+                n['instances'] = [ ]
+            else:
+                n['children'] = [ tronque(c, prof - 1) for c in node.get('children', [ ]) ]
+                n['instances'] = [ tronque(c, prof - 1) for c in node.get('instances', [ ]) ]
+            return n
+
+        k = "GET %s %d" % (chemin, prof)
+        with self.lock:
+            if k not in self.encodes:
+                node = self.objet(chemin)
+                if node is None:
+                    return None
+                self.encodes[k] = json.dumps(tronque(node, prof)).encode('utf-8')
+            return self.encodes[k]
+
+
+    def emet(self, handler, objet):
+        with self.evenements:
+            for canal, (handlers, attente) in self.canaux.items():
+                if any(handler == h or handler.startswith(h + ".") for h in handlers):
+                    attente.append({ 'handler': handler, 'object': objet })
+            self.evenements.notify_all()
+
+
+    ##
+    # @brief requête longue du canal d'événements
+    #
+    # @return réponse
+    def attend_evenements(self, canal, handlers, delai):
+        with self.evenements:
+            if canal == 0 or canal not in self.canaux:
+                canal = max(self.canaux, default=0) + 1
+                self.canaux[canal] = (handlers, [ ])
+                return { 'channelid': canal, 'events': [ ] }
+
+            attente = self.canaux[canal][1]
+            self.evenements.wait_for(lambda: attente, timeout=delai)
+            events = [ { 'data': e } for e in attente ]
+            del attente[:]
+            return { 'channelid': canal, 'events': events }
+
+
+##
+# @brief lit une réponse enregistrée: json, ou sortie de pprint (fichiers de sysbus.py -dump)
+#
+def lit_reponse(fichier):
+    with open(fichier, encoding='utf-8') as f:
+        texte = f.read()
+    try:
+        return json.loads(texte)
+    except ValueError:
+        pass
+    try:
+        return ast.literal_eval(texte)
+    except (ValueError, SyntaxError) as e:
+        raise ValueError("%s: ni json ni pprint (%s)" % (fichier, e))
+
+
+##
+# @brief lit un datamodel sauvegardé (json, éventuellement compressé, un ou plusieurs objets)
+#
+def lit_model(fichier):
+    ouvre = gzip.open if fichier.endswith(".gz") else lzma.open if fichier.endswith(".xz") else open
+    with ouvre(fichier, "rt", encoding='utf-8') as f:
+        texte = f.read()
+
+    objets = [ ]
+    decoder = json.JSONDecoder()
+    i = 0
+    while True:
+        while i < len(texte) and texte[i] in " \t\r\n":
+            i += 1
+        if i >= len(texte):
+            break
+        o, i = decoder.raw_decode(texte, i)
+        objets.extend(o if isinstance(o, list) else [ o ])
+
+    # plusieurs objets (model -raw d'une liste de chemins): racine artificielle
+    if len(objets) == 1:
+        return objets[0]
+    return { 'objectInfo': { 'keyPath': "", 'key': "", 'name': "", 'indexPath': "", 'state': "ready" },
+             'functions': [ ], 'parameters': [ ], 'children': objets, 'instances': [ ] }
+
+
+##
+# @brief serveur HTTP de la Livebox simulée
+#
+class livebox_handler(http.server.BaseHTTPRequestHandler):
+
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        if self.server.verbeux:
+            sys.stderr.write("%s\n" % (format % args))
+
+
+    def reponse(self, code, corps, entetes={ }):
+        b = corps if isinstance(corps, bytes) else json.dumps(corps).encode('utf-8')
+        self.send_response(code)
+        self.send_header("Content-Type", "application/x-sah-ws-4-call+json")
+        self.send_header("Content-Length", str(len(b)))
+        for k, v in entetes.items():
+            self.send_header(k, v)
+        self.end_headers()
+        self.wfile.write(b)
+        self.server.lb.stats['octets'] += len(b)
+
+
+    ##
+    # @brief latence, limite de requêtes simultanées et injection d'erreurs, puis traitement
+    #
+    def traite(self, nom, traitement):
+        s = self.server
+        lb = s.lb
+        lb.stats['requetes'] += 1
+
+        with s.concurrence:
+            delai = s.latence.tire(s.rnd)
+            for motif, l in s.latences:
+                if fnmatch.fnmatchcase(nom, motif):
+                    delai = l.tire(s.rnd)
+                    break
+            time.sleep(delai)
+
+            if s.rnd.random() < s.taux_erreurs:
+                erreur = s.rnd.choice(s.erreurs)
+                lb.stats['erreur_' + erreur] += 1
+                if erreur == "reset":
+                    self.close_connection = True
+                    self.connection.close()
+                    return
+                if erreur == "slow":
+                    time.sleep(s.lent)
+                else:
+                    self.reponse(int(erreur), { 'error': "simulated error" })
+                    return
+
+            traitement()
+
+
+    def contexte_valide(self):
+        if self.server.ouvert:
+            return True
+        lb = self.server.lb
+        ctx = self.headers.get("X-Context")
+        cookie = self.headers.get("Cookie", "")
+        return ctx in lb.contextes and lb.contextes[ctx] in cookie
+
+
+    def do_POST(self):
+        lb = self.server.lb
+        u = urllib.parse.urlsplit(self.path)
+        corps = self.rfile.read(int(self.headers.get("Content-Length") or 0))
+
+        if u.path == "/authenticate":
+            def authentifie():
+                q = urllib.parse.parse_qs(u.query)
+                if lb.password is not None and q.get('password', [ "" ])[0] != lb.password:
+                    self.reponse(200, { 'status': 1, 'data': { } })
+                    return
+                ctx = "%032x" % random.getrandbits(128)
+                cookie = "%032x" % random.getrandbits(128)
+                with lb.lock:
+                    lb.contextes[ctx] = cookie
+                self.reponse(200, { 'status': 0, 'data': { 'contextID': ctx } },
+                             { 'Set-Cookie': "sim/sessid=%s; path=/" % cookie })
+            self.traite("authenticate", authentifie)
+            return
+
+        try:
+            d = json.loads(corps or b"{}")
+        except ValueError:
+            self.reponse(400, { 'error': "invalid json" })
+            return
+
+        if "sah-event" in self.headers.get("Content-Type", ""):
+            # la requête longue n'occupe pas la Livebox: hors de la limite de concurrence
+            if not self.contexte_valide():
+                self.reponse(401, { 'error': "permission denied" })
+                return
+            self.reponse(200, lb.attend_evenements(d.get('channelid', 0), d.get('events', [ ]), self.server.attente_evenements))
+            return
+
+        service = d.get('service', "")
+        methode = d.get('method', "")
+        if not service and ':' in u.path:
+            # ancienne API: POST sysbus/Service/Chemin:méthode {"parameters": ...}
+            service, methode = u.path[1:].replace('/', '.').split(':', 1)
+            service = re.sub(r'^sysbus\.', '', service)
+
+        def ws():
+            # sans authentification, seules quelques méthodes répondent (comme getWANStatus)
+            if not self.contexte_valide() and not (service + ":" + methode) in self.server.publiques:
+                self.reponse(200, { 'result': { 'status': None, 'errors': [ { 'error': 13, 'description': "Permission denied", 'info': service } ] } })
+                return
+            self.reponse(200, lb.reponse_ws(service, methode, d.get('parameters') or { }))
+
+        self.traite(service + ":" + methode, ws)
+
+
+    def do_GET(self):
+        lb = self.server.lb
+        u = urllib.parse.urlsplit(self.path)
+
+        if u.path.startswith("/sysbus"):
+            # sysbus.py demande la racine sous le nom sysbus/sysbus
+            chemin = re.sub(r'^(sysbus\.?)+', '', u.path[1:].replace('/', '.'))
+            q = urllib.parse.parse_qs(u.query)
+            prof = int(q.get('_restDepth', [ "-1" ])[0])
+
+            def lecture():
+                if not self.contexte_valide():
+                    self.reponse(401, { 'error': "permission denied" })
+                    return
+                node = lb.lecture(chemin, prof)
+                if node is None:
+                    self.reponse(404, { 'error': "object not found" })
+                else:
+                    self.reponse(200, node)
+            self.traite("GET " + chemin, lecture)
+            return
+
+        self.traite("GET " + u.path, lambda: self.reponse(200, lb.scripts))
+
+
+##
+# @brief serveur HTTP de la Livebox simulée (un thread par connexion)
+#
+class livebox_server(http.server.ThreadingHTTPServer):
+
+    daemon_threads = True
+
+    def __init__(self, adresse, lb, latence_defaut="const:0", latences=[ ], concurrence=0,
+                 taux_erreurs=0.0, erreurs=("500", "reset"), lent=30.0, attente_evenements=30.0, seed=None, verbeux=False,
+                 ouvert=False):
+        super().__init__(adresse, livebox_handler)
+        self.lb = lb
+        self.latence = latence(latence_defaut)
+        self.latences = [ (m, latence(l)) for m, l in latences ]
+        self.concurrence = threading.BoundedSemaphore(concurrence) if concurrence > 0 else contextlib.nullcontext()
+        self.taux_erreurs = taux_erreurs
+        self.erreurs = list(erreurs)
+        self.lent = lent
+        self.attente_evenements = attente_evenements
+        self.rnd = random.Random(seed)
+        self.publiques = { "NMC:getWANStatus", "DeviceInfo:get" }
+        self.ouvert = ouvert
+        self.verbeux = verbeux
+
+
+##
+# @brief démarre un simulateur dans un thread
+#
+# @return (serveur, url)
+def demarre(rep, port=0, **options):
+    server = livebox_server(("127.0.0.1", port), livebox(rep, options.pop('password', None)), **options)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, "http://127.0.0.1:%d/" % server.server_port
+
+
+def main():
+    parser = argparse.ArgumentParser(description="simulateur de Livebox pour sysbus.py")
+    parser.add_argument("rep", help="répertoire des données (model.json, Service:méthode.json, scripts.js)")
+    parser.add_argument("-port", type=int, default=8080)
+    parser.add_argument("-bind", default="127.0.0.1")
+    parser.add_argument("-password", help="mot de passe attendu (tous acceptés par défaut)")
+    parser.add_argument("-open", help="accepte les requêtes sans authentification", action="store_true")
+    parser.add_argument("-latency", help="latence des appels: s, const:s, uniform:min:max, normal:moy:écart, lognormal:mu:sigma, exp:moy", default="const:0")
+    parser.add_argument("-call-latency", help="latence d'appels particuliers: motif=loi (motif: 'NeMo.*:getMIBs', 'GET *'...)", action="append", default=[ ])
+    parser.add_argument("-concurrency", help="nombre de requêtes traitées simultanément (0: illimité)", type=int, default=0)
+    parser.add_argument("-error-rate", help="proportion de requêtes en erreur", type=float, default=0.0)
+    parser.add_argument("-errors", help="types d'erreurs injectées: codes HTTP, reset, slow", default="500,reset")
+    parser.add_argument("-slow", help="durée d'une réponse 'slow' (s)", type=float, default=30.0)
+    parser.add_argument("-seed", type=int)
+    parser.add_argument("-v", "--verbose", action="store_true")
+    args = parser.parse_args()
+
+    latences = [ ]
+    for i in args.call_latency:
+        motif, _, loi = i.rpartition('=')
+        latences.append((motif, loi))
+
+    server = livebox_server((args.bind, args.port), livebox(args.rep, args.password), args.latency, latences,
+                            args.concurrency, args.error_rate, args.errors.split(','), args.slow, seed=args.seed, verbeux=args.verbose,
+                            ouvert=args.open)
+    lb = server.lb
+    print("Livebox simulée sur http://%s:%d/ (%s, %d réponses enregistrées)" % (
+          args.bind, server.server_port, "datamodel chargé" if lb.model else "sans datamodel", len(lb.appels)))
+    sys.stdout.flush()
+
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        for k, v in sorted(lb.stats.items()):
+            print("%-50s %d" % (k, v))
+
+
+if __name__ == '__main__':
+    main()
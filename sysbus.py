@@ -9,16 +9,81 @@ import os
 import shutil
 import re
 import argparse
-import pickle
 import json
-import pprint
 from collections import *
 import functools
+import hashlib
+import codecs
 import tempfile
-import configparser
-import datetime
-import html
-import subprocess
+import time
+import threading
+import io
+import contextlib
+import urllib.parse
+import socket
+import socketserver
+import struct
+import array
+import bisect
+import zlib
+import random
+import atexit
+import math
+import importlib.util
+
+
+##
+# @brief module importé au premier accès à un de ses attributs
+#
+# Le script est lancé très souvent pour une seule requête: les modules dont seules certaines
+# commandes ont besoin ne doivent pas ralentir le démarrage. Le module n'est pas placé dans
+# sys.modules avant d'être réellement importé : un "import" explicite le charge complètement,
+# ce que font les commandes qui lancent des threads pour les modules qu'elles utilisent.
+#
+class module_differe:
+
+    verrou = threading.RLock()
+
+    def __init__(self, nom):
+        self._nom = nom
+        self._module = None
+
+    def __getattr__(self, attr):
+        if self._module is None:
+            with module_differe.verrou:
+                if self._module is None:
+                    self._module = importlib.import_module(self._nom)
+        v = getattr(self._module, attr)
+        setattr(self, attr, v)
+        return v
+
+
+##
+# @brief importe un module au premier accès à un de ses attributs
+#
+# @param nom nom du module
+#
+# @return le module s'il est déjà importé, sinon un module_differe
+def import_differe(nom):
+    if nom in sys.modules:
+        return sys.modules[nom]
+    if importlib.util.find_spec(nom) is None:
+        raise ImportError("No module named '%s'" % nom, name=nom)
+    return module_differe(nom)
+
+
+pickle = import_differe('pickle')
+pprint = import_differe('pprint')
+gzip = import_differe('gzip')
+lzma = import_differe('lzma')
+sqlite3 = import_differe('sqlite3')
+configparser = import_differe('configparser')
+datetime = import_differe('datetime')
+html = import_differe('html')
+subprocess = import_differe('subprocess')
+asyncio = import_differe('asyncio')
+calendar = import_differe('calendar')
+csv = import_differe('csv')
 
 
 ##
@@ -37,8 +102,7 @@ error = functools.partial(print, file=sys.stderr)
 # @brief requests n'est pas dans la distrib standard de Python3, d'où le traitement spécifique
 #        pour l'import de cette librairie
 try:
-    import requests
-    import requests.utils
+    requests = import_differe('requests')
 except ImportError as e:
     error("erreur:", e)
     error("Installez http://www.python-requests.org/ :")
@@ -56,6 +120,69 @@ USER_LIVEBOX = 'admin'
 PASSWORD_LIVEBOX = 'admin'
 MINECRAFT_PORT = 54520
 
+##
+# @brief nombre maximal de requêtes simultanées (requete_batch) et taille du pool de connexions
+BATCH_WORKERS = 8
+
+##
+# @brief taille des morceaux lus sur les réponses volumineuses
+CHUNK_SIZE = 256 * 1024
+
+##
+# @brief délai d'attente (s) d'une requête longue du canal d'événements
+EVENTS_TIMEOUT = 60
+
+##
+# @brief réglages du transport HTTP (section [transport] de ~/.sysbusrc)
+#  - pool: connexions gardées ouvertes vers la Livebox (au-delà, les requêtes attendent)
+#  - connect_timeout, timeout: délais de connexion et de lecture (s)
+#  - retries, backoff: nouvelles tentatives des requêtes de lecture (GET, get*, list*) après un délai aléatoire
+#    entre 0 et backoff × 2^n secondes
+#  - breaker_errors, breaker_pause: après breaker_errors échecs consécutifs, les requêtes échouent
+#    immédiatement pendant breaker_pause secondes
+TRANSPORT = { 'pool': BATCH_WORKERS, 'connect_timeout': 5.0, 'timeout': 30.0,
+              'retries': 2, 'backoff': 0.5, 'breaker_errors': 5, 'breaker_pause': 30.0 }
+
+##
+# @brief cache des réponses des requêtes de lecture (activé par -cache)
+#  - durée de validité (s) par méthode 'service:méthode', '*' pour les autres (section [cache] de ~/.sysbusrc)
+#  - nombre maximal de réponses gardées
+REPONSES_CACHE = False
+REPONSES_TTL = { '*': 10, 'deviceinfo:get': 60, 'nemo.intf.lo:getintfs': 300 }
+REPONSES_MAX = 256
+
+##
+# @brief intervalle minimal (s) entre deux collectes de l'exporteur Prometheus
+EXPORTER_INTERVAL = 10
+
+##
+# @brief durée de validité (s) de l'instantané des hosts utilisé par -hosts, 0 (par défaut) pour toujours interroger la Livebox
+HOSTS_TTL = 0
+
+##
+# @brief durée de conservation (jours, 0 pour illimitée) des séries de -tsrecord: brutes, par minute, par heure
+TS_RETENTION = { 'raw': 90, '1m': 400, '1h': 0 }
+
+##
+# @brief nombre d'échantillons par bloc des séries de -tsrecord
+TS_BLOC = 300
+
+##
+# @brief nombre de requêtes les plus lentes affichées par -stats
+STATS_TOP = 10
+
+##
+# @brief durée de validité (en secondes) du cookie et du contextID mémorisés, 0 pour illimitée
+STATE_TTL = 0
+
+##
+# @brief utilise le cache du datamodel (activé par -cachemodel)
+MODEL_CACHE = False
+
+##
+# @brief durée (s) pendant laquelle la version du firmware, clé du cache du datamodel, est réutilisée sans la redemander
+FIRMWARE_TTL = 3600
+
 ##
 # @brief niveau de détail, -v pour l'augmenter
 verbosity = 0
@@ -66,12 +193,22 @@ verbosity = 0
 session = None
 sah_headers = None
 
+##
+# @brief vrai si la session est authentifiée et peut être renouvelée en cas de refus de la Livebox
+reauth = False
+reauth_lock = threading.Lock()
+
+##
+# @brief vrai si les requêtes sont relayées par le démon (-daemon), une connexion par thread
+daemon_actif = False
+daemon_local = threading.local()
+
 
 ##
 # @brief affiche un message de mise au point
 #
 # @param level niveau de détail
-# @param args
+# @param args textes ou objets, convertis seulement si le message est affiché
 #
 # @return 
 def debug(level, *args):
@@ -90,7 +227,7 @@ def debug(level, *args):
         elif level == 2: sys.stderr.write(PURPLE)
         else: sys.stderr.write(RED)
 
-        sys.stderr.write(' '.join(args))
+        sys.stderr.write(' '.join(a if isinstance(a, str) else str(a) for a in args))
         sys.stderr.write(END)
         sys.stderr.write('\n')
 
@@ -105,6 +242,8 @@ def write_conf(args):
     config['main']['URL_LIVEBOX'] = URL_LIVEBOX 
     config['main']['USER_LIVEBOX'] = USER_LIVEBOX 
     config['main']['PASSWORD_LIVEBOX'] = PASSWORD_LIVEBOX 
+    config['main']['STATE_TTL'] = str(STATE_TTL)
+    config['main']['HOSTS_TTL'] = str(HOSTS_TTL)
     config['minecraft'] = {}
     config['minecraft']['port'] = str(MINECRAFT_PORT) 
 
@@ -116,6 +255,7 @@ def write_conf(args):
     print("     url = %s" % (URL_LIVEBOX))
     print("    user = %s" % (USER_LIVEBOX))
     print("password = %s" % (PASSWORD_LIVEBOX))
+    print("     ttl = %s" % (STATE_TTL))
 
 
 ##
@@ -123,7 +263,7 @@ def write_conf(args):
 #
 # @return 
 def load_conf():
-    global USER_LIVEBOX, PASSWORD_LIVEBOX, URL_LIVEBOX
+    global USER_LIVEBOX, PASSWORD_LIVEBOX, URL_LIVEBOX, STATE_TTL, HOSTS_TTL
 
     rc = os.path.expanduser("~") + "/" + ".sysbusrc"
     debug(3, 'rc file', rc)
@@ -134,6 +274,15 @@ def load_conf():
         USER_LIVEBOX = config['main']['USER_LIVEBOX']
         PASSWORD_LIVEBOX = config['main']['PASSWORD_LIVEBOX']
         MINECRAFT_PORT = config['minecraft']['port']
+        STATE_TTL = config['main'].getint('STATE_TTL', fallback=STATE_TTL)
+        HOSTS_TTL = config['main'].getint('HOSTS_TTL', fallback=HOSTS_TTL)
+        for k, v in TRANSPORT.items():
+            TRANSPORT[k] = type(v)(config.get('transport', k, fallback=v))
+        if config.has_section('cache'):
+            for k, v in config.items('cache'):
+                REPONSES_TTL[k.lower()] = float(v)
+        for niveau in TS_RETENTION:
+            TS_RETENTION[niveau] = config.getint('record', niveau, fallback=TS_RETENTION[niveau])
     except:
         return False
 
@@ -161,65 +310,428 @@ def state_file():
     return tempfile.gettempdir() + "/" + "sysbus_state"
 
 
+##
+# @brief crée une session requests dont le pool de connexions est dimensionné pour requete_batch()
+#
+# @return 
+def cree_session():
+    s = requests.Session()
+    adapter = requests.adapters.HTTPAdapter(pool_connections=1, pool_maxsize=TRANSPORT['pool'], pool_block=True)
+    s.mount('http://', adapter)
+    s.mount('https://', adapter)
+    return s
+
+
+##
+# @brief entêtes des requêtes sysbus
+#
+# @param contextID contexte obtenu à l'authentification (None sans authentification)
+#
+# @return 
+def entetes_sah(contextID=None):
+    headers = { 'X-Prototype-Version':'1.7',
+                'Content-Type':'application/x-sah-ws-1-call+json; charset=UTF-8',
+                'Accept':'text/javascript' }
+    if contextID is not None:
+        headers['X-Context'] = contextID
+    return headers
+
+
+##
+# @brief lit le cookie et le contextID mémorisés
+#
+# @return (cookies, contextID) ou None
+def load_state():
+    if not os.path.exists(state_file()):
+        return None
+
+    if STATE_TTL > 0 and time.time() - os.path.getmtime(state_file()) > STATE_TTL:
+        debug(1, 'saved cookies expired')
+        return None
+
+    debug(1, 'loading saved cookies')
+    with open(state_file(), 'rb') as f:
+        cookies = pickle.load(f)
+        contextID = pickle.load(f)
+    return cookies, contextID
+
+
+##
+# @brief sauve le cookie et le contextID
+#
+# @param cookies dictionnaire nom/valeur
+# @param contextID
+#
+# @return 
+def save_state(cookies, contextID):
+    debug(1, 'setting cookies')
+    with open(state_file(), 'wb') as f:
+        pickle.dump(cookies, f, pickle.HIGHEST_PROTOCOL)
+        pickle.dump(contextID, f, pickle.HIGHEST_PROTOCOL)
+
+
 ##
 # @brief authentification 
-#  - essaie avec les données mémorisées (.cookie / .contextID)
-#  - envoie la requête d'authentification
+#  - reprend les données mémorisées (.cookie / .contextID) sans les vérifier:
+#    requete() se réauthentifie si la Livebox refuse le contexte
+#  - sinon envoie la requête d'authentification
 #
 # @return True/False
 def auth(new_session=False):
-    global session, sah_headers
+    global session, sah_headers, reauth
 
     debug(3, 'state file', state_file())
 
-    for i in range(2):
+    if cassette is not None and cassette.rejeu:
+        # rejeu: le contexte enregistré, sans session HTTP (ni chargement de requests)
+        session = None
+        contextID = None
+        try:
+            code, t, e = cassette.lit("POST authenticate")
+            if json.loads(t.decode('utf-8'))['data']['contextID']:
+                # valeur fictive, même si la cassette contient celui de la session enregistrée
+                contextID = cassette_sysbus.CONTEXTE
+        except (ConnectionError, ValueError, KeyError, TypeError):
+            pass
+        sah_headers = entetes_sah(contextID)
+        reauth = False
+        return True
 
-        if not new_session and os.path.exists(state_file()):
-            debug(1, 'loading saved cookies')
+    state = None if new_session else load_state()
 
-            with open(state_file(), 'rb') as f:
-                cookies = requests.utils.cookiejar_from_dict(pickle.load(f))
-                
-                session = requests.Session()
-                session.cookies = cookies
+    if state is not None:
+        session = cree_session()
+        session.cookies = requests.utils.cookiejar_from_dict(state[0])
+        contextID = state[1]
+        contexte_session.verifie = False
+
+    else:
+        debug(1, "new session")
+        session = cree_session()
+
+        auth = { 'username':USER_LIVEBOX, 'password':PASSWORD_LIVEBOX }
+        debug(2, "auth with", auth)
+        if mesures is not None:
+            m = mesures.commence("authenticate:POST")
+        r = session.post(URL_LIVEBOX + 'authenticate', params=auth,
+                         timeout=(TRANSPORT['connect_timeout'], TRANSPORT['timeout']))
+        if mesures is not None:
+            mesures.recoit(m, r.content)
+        # décodée une seule fois, le décodage étant compté dans la mesure
+        reponse = r.json()
+        if mesures is not None:
+            mesures.termine(m)
+
+        if cassette is not None:
+            # ni le mot de passe, passé dans l'url, ni le cookie et le contextID de la session ne sont enregistrés
+            cassette.enregistre("POST authenticate", r.status_code, cassette_sysbus.masque_contexte(r.content),
+                                cookies=sorted(requests.utils.dict_from_cookiejar(session.cookies)))
+
+        if not 'contextID' in reponse['data']:
+            error("auth error", str(r.text))
+            error("authentification impossible")
+            return False
+
+        contextID = reponse['data']['contextID']
+        contexte_session.verifie = True
+
+        # sauve le cookie et le contextID
+        save_state(requests.utils.dict_from_cookiejar(session.cookies), contextID)
+        
+    sah_headers = entetes_sah(contextID)
+    reauth = True
+    return True
 
-                contextID = pickle.load(f)
 
-        else:
-            debug(1, "new session")
-            session = requests.Session()
+##
+# @brief détecte une réponse de refus du contexte d'authentification
+#
+# @param code code HTTP
+# @param t contenu de la réponse
+# @param get requête de datamodel (les erreurs 13 y désignent les objets interdits)
+#
+# @return True/False
+def permission_refusee(code, t, get=False):
+    if code in (401, 403):
+        return True
+    if get or not b'"errors"' in t:
+        return False
+    try:
+        r = json.loads(t.decode('utf-8', errors='replace'))
+        erreurs = r['result']['errors']
+    except (ValueError, KeyError, TypeError):
+        return False
+    return any(e.get('error') == 13 for e in erreurs)
 
-            auth = { 'username':USER_LIVEBOX, 'password':PASSWORD_LIVEBOX }
-            debug(2, "auth with", auth)
-            r = session.post(URL_LIVEBOX + 'authenticate', params=auth) 
 
-            if not 'contextID' in r.json()['data']:
-                error("auth error", str(r.text))
-                break
+##
+# @brief suivi de la validité du contexte d'authentification, pour ne se réauthentifier qu'à bon escient
+#
+# Un refus HTTP (401, 403) signale toujours un contexte expiré. L'erreur 13 est aussi celle d'un
+# appel réellement interdit : elle ne provoque une nouvelle authentification que si le contexte
+# mémorisé n'a encore servi à aucun appel réussi, ou si le même appel a déjà réussi auparavant.
+#
+class suivi_contexte:
 
-            contextID = r.json()['data']['contextID']
+    def __init__(self):
+        self.verifie = False                # un appel a réussi avec le contexte, ou il vient d'être créé
+        self.reussis = set()                # appels (chemin, corps) ayant réussi
 
-            # sauve le cookie et le contextID
-            debug(1, 'setting cookies')
-            with open(state_file(), 'wb') as f:
-                data = requests.utils.dict_from_cookiejar(session.cookies)
-                pickle.dump(data, f, pickle.HIGHEST_PROTOCOL)
-                data = contextID
-                pickle.dump(data, f, pickle.HIGHEST_PROTOCOL)
-            
-        sah_headers = { 'X-Context':contextID,
-                    'X-Prototype-Version':'1.7',
-                    'Content-Type':'application/x-sah-ws-1-call+json; charset=UTF-8',
-                    'Accept':'text/javascript' }
 
-        r = session.post(URL_LIVEBOX + 'sysbus/Time:getTime', headers=sah_headers, data='{"parameters":{}}')
-        if r.json()['result']['status'] == True:
+    ##
+    # @brief analyse une réponse
+    #
+    # @param cle identifiant de l'appel
+    # @param code code HTTP
+    # @param t contenu de la réponse (vide pour une réponse en morceaux)
+    # @param get requête de datamodel
+    #
+    # @return vrai s'il faut se réauthentifier et renvoyer la requête
+    def expire(self, cle, code, t, get=False):
+        if code in (401, 403):
             return True
+        if permission_refusee(code, t, get):
+            return not self.verifie or cle in self.reussis
+        if code == 200 and t:
+            self.verifie = True
+            if not b'"errors"' in t:
+                self.reussis.add(cle)
+        return False
+
+
+contexte_session = suivi_contexte()
+
+
+##
+# @brief renouvelle l'authentification après un refus, une seule fois pour des requêtes simultanées
+#
+# @param headers entêtes utilisés par la requête refusée
+#
+# @return 
+def reauthentifie(headers):
+    with reauth_lock:
+        if headers is sah_headers:
+            debug(1, "contexte refusé, nouvelle authentification")
+            auth(new_session=True)
+
+
+##
+# @brief retourne le chemin de la socket du démon
+#
+# @return 
+def daemon_file():
+    return tempfile.gettempdir() + "/" + "sysbus_daemon"
+
+
+##
+# @brief écrit une trame (longueur + contenu) sur la socket du démon
+#
+# @return 
+def ecrit_trame(sock, b):
+    sock.sendall(struct.pack('>I', len(b)) + b)
+
+
+##
+# @brief lit une trame sur la socket du démon
+#
+# @return 
+def lit_trame(sock):
+
+    def lit(n):
+        b = bytearray()
+        while len(b) < n:
+            t = sock.recv(min(n - len(b), 1 << 20))
+            if not t:
+                raise ConnectionError("connexion au démon fermée")
+            b += t
+        return bytes(b)
+
+    n = struct.unpack('>I', lit(4))[0]
+    return lit(n)
+
+
+##
+# @brief envoie un message au démon et lit l'entête de la réponse
+#
+# La réponse est un entête json suivi du contenu en trames, terminé par une trame vide.
+#
+# @param message dictionnaire
+#
+# @return (entête, générateur du contenu)
+def appel_daemon(message):
+    sock = getattr(daemon_local, 'sock', None)
+    if sock is None:
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.connect(daemon_file())
+        daemon_local.sock = sock
+
+    ecrit_trame(sock, json.dumps(message).encode('utf-8'))
+    entete = json.loads(lit_trame(sock).decode('utf-8'))
+
+    def contenu():
+        complet = False
+        try:
+            while True:
+                b = lit_trame(sock)
+                if not b:
+                    complet = True
+                    return
+                yield b
+        finally:
+            # lecture interrompue: la socket n'est plus synchronisée
+            if not complet:
+                sock.close()
+                daemon_local.sock = None
+
+    return entete, contenu()
+
+
+##
+# @brief relaie une requête HTTP au démon
+#
+# @return (code HTTP, générateur du contenu)
+def envoie_daemon(c, data=None, get=False, entetes=None, timeout=None, lecture=False):
+    debug(1, "requête via le démon:", c)
+    entete, t = appel_daemon({ 'op':'requete', 'c':c, 'data':data, 'get':get, 'entetes':entetes, 'timeout':timeout, 'lecture':lecture })
+    if 'erreur' in entete:
+        b''.join(t)
+        raise ConnectionError(entete['erreur'])
+    return entete['status'], t
+
+
+##
+# @brief se connecte au démon s'il tourne pour la même Livebox
+#
+# @return True/False
+def connecte_daemon():
+    global daemon_actif
+
+    if not hasattr(socket, 'AF_UNIX') or not os.path.exists(daemon_file()):
+        return False
+
+    try:
+        entete, t = appel_daemon({ 'op':'hello' })
+        b''.join(t)
+    except OSError as e:
+        debug(1, "démon injoignable:", str(e))
+        daemon_local.sock = None
+        return False
+
+    if entete['url'] != URL_LIVEBOX:
+        debug(1, "le démon est connecté à", entete['url'])
+        return False
+
+    debug(1, "requêtes relayées par le démon %d" % entete['pid'])
+    daemon_actif = True
+    return True
+
+
+##
+# @brief traite les messages d'un client du démon
+#
+class daemon_handler(socketserver.BaseRequestHandler):
+
+    def handle(self):
+        while True:
+            try:
+                message = json.loads(lit_trame(self.request).decode('utf-8'))
+            except (ConnectionError, ValueError):
+                return
+
+            t = [ ]
+            if message['op'] == 'hello':
+                entete = { 'url':URL_LIVEBOX, 'pid':os.getpid() }
+
+            elif message['op'] == 'stop':
+                entete = { }
+                threading.Thread(target=self.server.shutdown).start()
+
+            elif message['op'] == 'requete':
+                try:
+                    # seuls les GET sont relayés au fil de la réception: les réponses ws sont lues en entier
+                    # pour détecter le refus du contexte (erreur 13) et se réauthentifier
+                    code, t = envoie(message['c'], message['data'], message['get'], stream=message['get'],
+                                     entetes=message.get('entetes'), timeout=message.get('timeout'),
+                                     lecture=message.get('lecture', False))
+                    if not message['get']:
+                        t = [ t ]
+                    entete = { 'status':code }
+                except Exception as e:
+                    entete = { 'erreur':str(e) }
+
+            else:
+                entete = { 'erreur':"opération inconnue: %s" % message['op'] }
+
+            # la réponse de la Livebox est relayée au fil de la réception
+            ecrit_trame(self.request, json.dumps(entete).encode('utf-8'))
+            for b in t:
+                if b:
+                    ecrit_trame(self.request, b)
+            ecrit_trame(self.request, b'')
+
+
+##
+# @brief démon gardant une session authentifiée ouverte derrière une socket Unix
+#
+# @param action 'start' (par défaut), 'stop' ou 'status'
+# @param new_session
+#
+# @return 
+def daemon_cmd(action, new_session=False):
+
+    if action not in ('start', 'stop', 'status'):
+        error("Usage: %s -daemon [ stop | status ]" % sys.argv[0])
+        sys.exit(2)
+
+    if not hasattr(socket, 'AF_UNIX'):
+        error("les sockets Unix ne sont pas disponibles sur ce système")
+        sys.exit(2)
+
+    if action in ('stop', 'status'):
+        if not connecte_daemon():
+            print("démon arrêté")
+            sys.exit(1)
+        if action == 'stop':
+            entete, t = appel_daemon({ 'op':'stop' })
+            b''.join(t)
+            print("arrêt du démon")
         else:
-            os.remove(state_file())
+            entete, t = appel_daemon({ 'op':'hello' })
+            b''.join(t)
+            print("démon %d connecté à %s" % (entete['pid'], entete['url']))
+        return
+
+    if connecte_daemon():
+        error("le démon est déjà lancé")
+        sys.exit(1)
 
-    error("authentification impossible")
-    return False
+    if not auth(new_session):
+        sys.exit(1)
+
+    # modules utilisés par les threads du serveur
+    import requests, pickle
+
+    if os.path.exists(daemon_file()):
+        os.remove(daemon_file())
+
+    # la socket est créée directement en 0600: un chmod après coup laisserait un instant
+    # le démon, et la session authentifiée, accessibles aux autres utilisateurs
+    masque = os.umask(0o077)
+    try:
+        server = socketserver.ThreadingUnixStreamServer(daemon_file(), daemon_handler)
+    finally:
+        os.umask(masque)
+    server.daemon_threads = True
+    print("démon à l'écoute sur %s" % daemon_file())
+    sys.stdout.flush()
+
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        os.remove(daemon_file())
 
 
 ##
@@ -228,23 +740,19 @@ def auth(new_session=False):
 # @return 
 def noauth():
     global session, sah_headers
-    session = requests.Session()
-    sah_headers = { 'X-Prototype-Version':'1.7',
-                    'Content-Type':'application/x-sah-ws-1-call+json; charset=UTF-8',
-                    'Accept':'text/javascript' }
-
-
+    session = None if cassette is not None and cassette.rejeu else cree_session()
+    sah_headers = entetes_sah()
 
 
 ##
-# @brief envoie une requête sysbus à la Livebox
+# @brief construit l'url relative et le corps d'une requête sysbus
 #
 # @param chemin
 # @param args
 # @param get
 #
-# @return 
-def requete(chemin, args=None, get=False, raw=False, silent=False):
+# @return (chemin http, corps json) - le corps est None pour un GET
+def prepare_requete(chemin, args=None, get=False):
 
     # nettoie le chemin de la requête
     c = str.replace(chemin or "sysbus", ".", "/")
@@ -259,60 +767,190 @@ def requete(chemin, args=None, get=False, raw=False, silent=False):
             c += "?_restDepth=-1"
         else:
             c += "?_restDepth="  + str(args)
+        return c, None
 
-        debug(1, "requête: %s" % (c))
-        t = session.get(URL_LIVEBOX + c, headers=sah_headers)
-        t = t.content
-        #t = b'[' + t.replace(b'}{', b'},{')+b']'
+    # complète les paramètres de la requête
+    parameters = { }
+    if not args is None:
+        for i in args:
+            parameters[i] = args[i]
 
-    else:
-        # complète les paramètres de la requête
-        parameters = { }
-        if not args is None:
-            for i in args:
-                parameters[i] = args[i]
+    data = { }
+    data['parameters'] = parameters
 
-        data = { }
-        data['parameters'] = parameters
+    # l'ihm des livebox 4 utilise une autre API, qui fonctionne aussi sur les lb3
+    data['service'] = c.split(':')[0].replace('/', '.')
+    if data['service'][0:7] == "sysbus.":
+        data['service'] = data['service'][7:]
+    #elif data['service'][0:4] == "com.":
+    #    data['service'] = data['service'][4:]
+    data['method'] = c.split(':')[1]
 
-        # l'ihm des livebox 4 utilise une autre API, qui fonctionne aussi sur les lb3
-        data['service'] = c.split(':')[0].replace('/', '.')
-        if data['service'][0:7] == "sysbus.":
-            data['service'] = data['service'][7:]
-        #elif data['service'][0:4] == "com.":
-        #    data['service'] = data['service'][4:]
-        data['method'] = c.split(':')[1]
-        c = 'ws'
+    return 'ws', json.dumps(data)
 
-        # envoie la requête avec les entêtes qui vont bien
-        debug(1, "requête: %s with %s" % (c, str(data)))
-        t = session.post(URL_LIVEBOX + c, headers=sah_headers, data=json.dumps(data))
-        t = t.content
 
-    # il y a un truc bien moisi dans le nom netbios de la Time Capsule
-    # probable reliquat d'un bug dans le firmware de la TC ou de la Livebox
-    t = t.replace(b'\xf0\x44\x6e\x22', b'aaaa')
+##
+# @brief corrige les octets invalides morceau par morceau
+#
+# il y a un truc bien moisi dans le nom netbios de la Time Capsule
+# probable reliquat d'un bug dans le firmware de la TC ou de la Livebox
+#
+# @param morceaux itérable de bytes
+#
+# @return générateur de bytes
+def corrige_morceaux(morceaux):
+    motif = b'\xf0\x44\x6e\x22'
+    reste = b''
+    for b in morceaux:
+        if not b:
+            continue
+        if reste:
+            b = reste + b
+        b = b.replace(motif, b'aaaa')
+
+        # garde pour le morceau suivant une fin qui pourrait être le début du motif
+        n = 0
+        for k in range(len(motif) - 1, 0, -1):
+            if b.endswith(motif[:k]):
+                n = k
+                break
+        if n > 0:
+            reste = b[-n:]
+            b = b[:-n]
+        else:
+            reste = b''
+        yield b
+    if reste:
+        yield reste
 
-    if raw == True:
-        return t
 
-    t = t.decode('utf-8', errors='replace')
-    if get and t.find("}{"):
-        debug(2, "listes json multiples")
-        t = "[" + t.replace("}{", "},{") + "]"
+##
+# @brief décode au fil de l'eau une suite d'objets json concaténés ('{...}{...}')
+#
+# Le décodage n'est tenté que lorsque les accolades et crochets du texte en attente
+# sont équilibrés, c'est-à-dire à la fin d'un objet de premier niveau. Ils sont
+# comptés hors des chaînes, celles-ci pouvant être coupées entre deux morceaux.
+#
+# @param morceaux itérable de bytes
+#
+# @return générateur des objets décodés
+def json_stream(morceaux):
+    decoder = json.JSONDecoder()
+    utf8 = codecs.getincrementaldecoder('utf-8')(errors='replace')
+    blancs = re.compile(r'[ \t\n\r]*')
+    # suite d'une chaîne jusqu'au guillemet fermant, chaînes complètes
+    suite_chaine = re.compile(r'[^"\\]*(?:\\.[^"\\]*)*', re.S)
+    chaines = re.compile(r'"[^"\\]*(?:\\.[^"\\]*)*"', re.S)
+
+    def niveau(s, a, b):
+        return s.count('{', a, b) + s.count('[', a, b) - s.count('}', a, b) - s.count(']', a, b)
+
+    def accolades(s, dans_chaine):
+        """ équilibre des accolades et crochets de s hors des chaînes: (équilibre, dans une chaîne, reste à relire) """
+        if '\\' not in s:
+            # sans échappement, les chaînes sont entre deux guillemets consécutifs
+            parties = s.split('"')
+            hors = ''.join(parties[1 if dans_chaine else 0::2])
+            return niveau(hors, 0, len(hors)), dans_chaine != (len(parties) % 2 == 0), ''
+        if dans_chaine:
+            i = suite_chaine.match(s).end()
+            if i == len(s):
+                return 0, True, ''
+            if s[i] == '\\':
+                # antislash en fin de morceau: le caractère échappé est dans le suivant
+                return 0, True, s[i:]
+            s = s[i + 1:]
+        s = chaines.sub('', s)
+        q = s.find('"')
+        if q < 0:
+            return niveau(s, 0, len(s)), False, ''
+        # chaîne non terminée: la suite est dans le morceau suivant
+        return niveau(s, 0, q), True, s[suite_chaine.match(s, q + 1).end():]
+
+    attente = [ ]
+    equilibre = 0
+    dans_chaine = False
+    reste = ''
+    fin = False
+    morceaux = iter(morceaux)
+    suivant = next(morceaux, None)
+
+    while not fin:
+        if suivant is None:
+            s = utf8.decode(b'', final=True)
+            fin = True
+        else:
+            s = utf8.decode(suivant)
+            suivant = next(morceaux, None)
+
+        # le dernier morceau est décodé sans compter les accolades
+        dernier = suivant is None
+        if s:
+            attente.append(s)
+            if not dernier:
+                n, dans_chaine, reste = accolades(reste + s, dans_chaine)
+                equilibre += n
+        if not dernier and (equilibre != 0 or dans_chaine or not s):
+            continue
+
+        texte = ''.join(attente)
+        pos = 0
+        while True:
+            pos = blancs.match(texte, pos).end()
+            if pos == len(texte):
+                break
+            try:
+                obj, pos = decoder.raw_decode(texte, pos)
+            except json.JSONDecodeError as e:
+                if fin:
+                    raise ValueError("%s: %s" % (e.msg, texte[max(0, e.pos - 40):e.pos + 40]))
+                break
+            yield obj
+
+        texte = texte[pos:]
+        attente = [ texte ] if texte else [ ]
+        equilibre, dans_chaine, reste = accolades(texte, False)
+
+
+##
+# @brief décode la réponse d'une requête sysbus
+#
+# @param t contenu brut de la réponse (bytes ou itérable de bytes)
+# @param get
+# @param raw
+# @param silent
+#
+# @return 
+def decode_reponse(t, get=False, raw=False, silent=False):
+
+    if isinstance(t, bytes):
+        t = [ t ]
+
+    if raw == True:
+        return b''.join(corrige_morceaux(t))
 
     try:
-        r = json.loads(t)
-    except:
+        objets = list(json_stream(corrige_morceaux(t)))
+        if not get and len(objets) != 1:
+            raise ValueError("%d objets json" % len(objets))
+    except ValueError as e:
         if not silent:
             error("erreur:", sys.exc_info()[0])
-            error("mauvais json:", t)
+            error("mauvais json:", e)
         return
 
-    apercu = str(r)
-    if len(apercu) > 50:
-        apercu = apercu[:50] + "..."
-    debug(1, "réponse:", apercu)
+    if get:
+        if len(objets) > 1:
+            debug(2, "listes json multiples")
+        r = objets
+    else:
+        r = objets[0]
+
+    if verbosity >= 1:
+        apercu = str(r)
+        if len(apercu) > 50:
+            apercu = apercu[:50] + "..."
+        debug(1, "réponse:", apercu)
 
     if not get and 'result' in r:
         if not 'errors' in r['result']:
@@ -320,29 +958,1705 @@ def requete(chemin, args=None, get=False, raw=False, silent=False):
             return r['result']
         else:
             if not silent:
-                error("erreur:", t)
+                error("erreur:", json.dumps(r, ensure_ascii=False))
             return None
     
     else:
         debug(1, "-------------------------")
         return r
-    
 
-##
-# @brief envoie une requête sysbus et affiche le résultat
-#
-# @param chemin chemin de la requête
-# @param args paramètres supplementaires
-#
-# @return 
-def requete_print(chemin, args=None, get=False):
-    #print(chemin, args)
-    #return
-    result = requete(chemin, args, get)
-    if result:
-        pprint.pprint(result)
-    return result
 
+##
+# @brief exception levée sans contacter la Livebox quand le disjoncteur est ouvert
+#
+class disjoncteur_ouvert(ConnectionError):
+    pass
+
+
+##
+# @brief disjoncteur: après TRANSPORT['breaker_errors'] échecs consécutifs, les requêtes échouent
+# immédiatement pendant TRANSPORT['breaker_pause'] secondes, puis une requête d'essai est autorisée
+#
+class disjoncteur_transport:
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.echecs = 0
+        self.ouvert_jusqua = 0
+        self.essai = False
+
+
+    def verifie(self):
+        with self.lock:
+            if self.echecs < TRANSPORT['breaker_errors'] or TRANSPORT['breaker_errors'] <= 0:
+                return
+            if time.time() < self.ouvert_jusqua or self.essai:
+                transport_stats['breaker_rejects'] += 1
+                raise disjoncteur_ouvert("Livebox injoignable, nouvel essai dans %.0f s" % max(0, self.ouvert_jusqua - time.time()))
+            # demi-ouvert: laisse passer une seule requête
+            self.essai = True
+
+
+    def succes(self):
+        with self.lock:
+            self.echecs = 0
+            self.essai = False
+
+
+    def echec(self):
+        with self.lock:
+            self.echecs += 1
+            if self.essai or self.echecs == TRANSPORT['breaker_errors']:
+                self.ouvert_jusqua = time.time() + TRANSPORT['breaker_pause']
+                self.essai = False
+                transport_stats['breaker_trips'] += 1
+                debug(1, "disjoncteur ouvert pour %g s" % TRANSPORT['breaker_pause'])
+
+
+##
+# @brief compteurs du transport: requests, bytes, retries, breaker_trips, breaker_rejects
+transport_stats = Counter()
+disjoncteur = disjoncteur_transport()
+
+
+##
+# @brief cassette: enregistre les échanges avec la Livebox (-record) ou y répond sans réseau (-replay)
+#
+# Le répertoire contient index.json, qui associe chaque requête ("POST authenticate", "POST ws {...}",
+# "GET sysbus/...", "GET scripts.js") à la liste de ses réponses successives, et un fichier par réponse.
+# Au rejeu, les réponses d'une même requête sont rendues dans l'ordre, la dernière étant répétée.
+#
+class cassette_sysbus:
+
+    # contextID enregistré et rejoué à la place de celui de la session
+    CONTEXTE = "contexte-cassette"
+
+    def __init__(self, rep, rejeu=False):
+        self.rep = rep
+        self.rejeu = rejeu
+        self.lock = threading.Lock()
+        self.requetes = { }
+        self.url = None
+        self.lues = Counter()
+        self.vues = set()
+
+        try:
+            with open(os.path.join(rep, "index.json")) as f:
+                d = json.load(f)
+            self.requetes = d['requetes']
+            self.url = d.get('url')
+        except (OSError, ValueError, KeyError) as e:
+            if rejeu:
+                raise ValueError("cassette %s illisible: %s" % (rep, e))
+
+        if not rejeu:
+            # une cassette existante est complétée: les requêtes renvoyées remplacent les anciennes réponses
+            os.makedirs(rep, exist_ok=True)
+            atexit.register(self.sauve)
+
+
+    @staticmethod
+    def cle(c, data=None):
+        if data is None:
+            return "GET " + c
+        try:
+            data = json.dumps(json.loads(data), sort_keys=True, ensure_ascii=False)
+        except ValueError:
+            pass
+        return "POST %s %s" % (c, data)
+
+
+    ##
+    # @brief remplace le contextID de la réponse d'authentification
+    #
+    # @param contenu bytes
+    #
+    # @return bytes
+    @staticmethod
+    def masque_contexte(contenu):
+        try:
+            r = json.loads(contenu.decode('utf-8'))
+            if not r['data']['contextID']:
+                return contenu
+        except (ValueError, KeyError, TypeError):
+            return contenu
+        r['data']['contextID'] = cassette_sysbus.CONTEXTE
+        return json.dumps(r).encode('utf-8')
+
+
+    def sauve(self):
+        with self.lock:
+            with open(os.path.join(self.rep, "index.json"), "w") as f:
+                json.dump({ 'url': URL_LIVEBOX, 'requetes': self.requetes }, f, indent=1, sort_keys=True, ensure_ascii=False)
+
+
+    ##
+    # @brief retourne la réponse suivante d'une requête enregistrée
+    #
+    # @param cle
+    # @param repete répète la dernière réponse quand elles ont toutes été lues
+    #
+    # @return (code HTTP, contenu, entrée de l'index)
+    def lit(self, cle, repete=True):
+        with self.lock:
+            reponses = self.requetes.get(cle, [ ])
+            n = self.lues[cle]
+            self.lues[cle] += 1
+        if n >= len(reponses):
+            if not repete or not reponses:
+                raise ConnectionError("absent de la cassette: %s" % cle)
+            n = len(reponses) - 1
+
+        debug(1, "réponse de la cassette:", cle)
+        transport_stats['replayed'] += 1
+        e = reponses[n]
+        with open(os.path.join(self.rep, e['fichier']), "rb") as f:
+            return e['code'], f.read(), e
+
+
+    ##
+    # @brief enregistre une réponse
+    #
+    # @param cle
+    # @param code code HTTP
+    # @param contenu bytes
+    # @param infos données complémentaires gardées dans l'index
+    #
+    # @return
+    def enregistre(self, cle, code, contenu, **infos):
+        ext = ".js" if cle.endswith(".js") else ".json"
+        with self.lock:
+            if cle not in self.vues:
+                self.vues.add(cle)
+                self.requetes[cle] = [ ]
+            nom = "%s-%d%s" % (hashlib.sha1(cle.encode('utf-8')).hexdigest()[:16], len(self.requetes[cle]), ext)
+            self.requetes[cle].append(dict(infos, fichier=nom, code=code))
+        with open(os.path.join(self.rep, nom), "wb") as f:
+            f.write(contenu)
+        transport_stats['recorded'] += 1
+
+
+    ##
+    # @brief enregistre une réponse reçue en morceaux, au fil de sa lecture
+    #
+    # @return générateur de bytes
+    def enregistre_flux(self, cle, code, morceaux):
+        recus = [ ]
+        for b in morceaux:
+            recus.append(b)
+            yield b
+        self.enregistre(cle, code, b''.join(recus))
+
+
+cassette = None
+
+
+##
+# @brief envoie une requête HTTP préparée par prepare_requete(), à la Livebox ou à la cassette
+#
+# @param c chemin http
+# @param data corps json (None pour un GET)
+# @param get
+# @param stream si vrai, le contenu est retourné en morceaux au fil de la réception
+# @param entetes entêtes remplaçant ou complétant sah_headers
+# @param timeout délai maximal de réponse en secondes
+# @param lecture requête de lecture (get*, list*), renvoyée en cas d'erreur
+#
+# @return (code HTTP, contenu en bytes ou itérable de bytes si stream)
+def envoie(c, data=None, get=False, stream=False, entetes=None, timeout=None, lecture=False):
+
+    if instantane is not None:
+        raise ConnectionError("requête impossible avec -from %s: %s" % (instantane.fichier, data or c))
+
+    if cassette is None:
+        return envoie_livebox(c, data, get, stream, entetes, timeout, lecture)
+
+    cle = cassette.cle(c, data)
+    if cassette.rejeu:
+        # le canal d'événements n'est pas répété: il attendrait indéfiniment
+        code, t, _ = cassette.lit(cle, repete=entetes is None)
+        return code, [ t ] if stream else t
+
+    code, t = envoie_livebox(c, data, get, stream, entetes, timeout, lecture)
+    if stream:
+        return code, cassette.enregistre_flux(cle, code, t)
+    cassette.enregistre(cle, code, t)
+    return code, t
+
+
+##
+# @brief envoie une requête HTTP à la Livebox, directement ou via le démon
+#
+# @return (code HTTP, contenu en bytes ou itérable de bytes si stream)
+def envoie_livebox(c, data=None, get=False, stream=False, entetes=None, timeout=None, lecture=False):
+
+    if daemon_actif:
+        code, t = envoie_daemon(c, data, get, entetes, timeout, lecture)
+        t = compte_octets(t)
+        return code, t if stream else b''.join(t)
+
+    # un délai explicite est celui d'une attente longue (canal d'événements): son expiration
+    # n'est pas une panne, elle n'est ni renvoyée ni comptée par le disjoncteur
+    attente = timeout is not None
+    if timeout is None:
+        timeout = (TRANSPORT['connect_timeout'], TRANSPORT['timeout'])
+
+    # seules les lectures sont renvoyées en cas d'erreur réseau ou d'erreur 5xx
+    essais = 1 if attente else 1 + (TRANSPORT['retries'] if lecture or data is None else 0)
+
+    for n in range(essais):
+        disjoncteur.verifie()
+        try:
+            t = envoie_http(c, data, get, stream, entetes, timeout)
+        except (requests.exceptions.ConnectionError, requests.exceptions.Timeout) as e:
+            if attente and isinstance(e, requests.exceptions.ReadTimeout):
+                # la connexion a abouti: la Livebox répond, elle n'avait simplement rien à dire
+                disjoncteur.succes()
+                raise
+            disjoncteur.echec()
+            if n + 1 >= essais:
+                raise
+            debug(1, "erreur %s: %s" % (c, e))
+        else:
+            if t.status_code < 500:
+                disjoncteur.succes()
+                break
+            disjoncteur.echec()
+            if n + 1 >= essais:
+                break
+            debug(1, "erreur %s: HTTP %d" % (c, t.status_code))
+            t.close()
+
+        pause = random.uniform(0, TRANSPORT['backoff'] * 2 ** n)
+        transport_stats['retries'] += 1
+        if mesures is not None:
+            mesures.nouvel_essai()
+        debug(1, "nouvel essai dans %.2f s" % pause)
+        time.sleep(pause)
+
+    if stream:
+        return t.status_code, compte_octets(t.iter_content(CHUNK_SIZE))
+    transport_stats['bytes'] += len(t.content)
+    return t.status_code, t.content
+
+
+##
+# @brief compte les octets reçus de la Livebox au fil de la lecture (transport_stats['bytes'])
+#
+# @return générateur de bytes
+def compte_octets(morceaux):
+    for b in morceaux:
+        transport_stats['bytes'] += len(b)
+        yield b
+
+
+##
+# @brief envoie une requête HTTP sur la session, en se réauthentifiant si la Livebox refuse le contexte
+#
+# @return réponse requests
+def envoie_http(c, data, get, stream, entetes, timeout):
+
+    transport_stats['requests'] += 1
+
+    # le contexte mémorisé est utilisé sans vérification préalable:
+    # en cas de refus, on se réauthentifie et on renvoie la requête une seule fois
+    for essai in range(2):
+        headers = sah_headers
+        h = headers if entetes is None else dict(headers, **entetes)
+
+        if data is None:
+            debug(1, "requête:", c)
+            t = session.get(URL_LIVEBOX + c, headers=h, stream=stream, timeout=timeout)
+        else:
+            # envoie la requête avec les entêtes qui vont bien
+            debug(1, "requête:", c, "with", data)
+            t = session.post(URL_LIVEBOX + c, headers=h, data=data, stream=stream, timeout=timeout)
+
+        if essai == 0 and reauth and contexte_session.expire((c, data), t.status_code, b'' if stream else t.content, get):
+            t.close()
+            reauthentifie(headers)
+            continue
+        break
+
+    return t
+
+
+##
+# @brief cache des réponses des requêtes get* et list*, gardé entre deux appels du script
+#
+# Une requête set*, add* ou delete* invalide les réponses de la même famille de services
+# (NMC, NeMo, DHCPv4...): une écriture sur NeMo.Intf.wl0 peut modifier ce que retourne NeMo.Intf.lo.
+# L'invalidation a lieu même sans -cache, dès que le fichier du cache existe : sinon le prochain
+# appel avec -cache servirait des réponses antérieures à l'écriture.
+#
+class cache_reponses_lru:
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.reponses = None
+        self.modifie = False
+
+
+    def fichier(self):
+        return os.path.join(cache_dir(), "reponses-%s.json" % hashlib.sha1(URL_LIVEBOX.encode('utf-8')).hexdigest()[:16])
+
+
+    def charge(self):
+        if self.reponses is not None:
+            return
+        self.reponses = OrderedDict()
+        try:
+            with open(self.fichier()) as f:
+                maintenant = time.time()
+                for cle, (expire, texte) in json.load(f):
+                    if expire > maintenant:
+                        self.reponses[cle] = (expire, texte)
+        except (OSError, ValueError):
+            pass
+        atexit.register(self.sauve)
+
+
+    def sauve(self):
+        with self.lock:
+            if not self.modifie:
+                return
+            try:
+                tmp = self.fichier() + ".%d" % os.getpid()
+                with open(tmp, "w") as f:
+                    json.dump([ [ cle, list(v) ] for cle, v in self.reponses.items() ], f)
+                os.replace(tmp, self.fichier())
+                self.modifie = False
+            except OSError as e:
+                debug(1, "cache des réponses:", str(e))
+
+
+    @staticmethod
+    def analyse(data):
+        d = json.loads(data)
+        service, methode = d.get('service', ""), d.get('method', "")
+        cle = service + ":" + methode + " " + json.dumps(d.get('parameters'), sort_keys=True)
+        return service, methode, cle
+
+
+    ##
+    # @brief invalide les réponses de la famille de services d'une écriture
+    #
+    # @param data corps json de la requête
+    #
+    # @return vrai si la requête est une écriture
+    def invalide(self, data):
+        service, methode, cle = self.analyse(data)
+        if not re.match(r'(set|add|delete)', methode):
+            return False
+
+        with self.lock:
+            if self.reponses is None and not os.path.exists(self.fichier()):
+                return True
+            self.charge()
+            famille = service.split('.')[0] + "."
+            for k in [ k for k in self.reponses if (k.split(':')[0] + ".").startswith(famille) ]:
+                del self.reponses[k]
+                self.modifie = True
+        return True
+
+
+    ##
+    # @brief cherche la réponse d'une requête de lecture
+    #
+    # @param data corps json de la requête
+    #
+    # @return (trouvé, réponse)
+    def cherche(self, data):
+        service, methode, cle = self.analyse(data)
+
+        with self.lock:
+            self.charge()
+
+            v = self.reponses.get(cle)
+            if v is None or v[0] <= time.time():
+                return False, None
+            self.reponses.move_to_end(cle)
+
+        debug(1, "réponse en cache: %s:%s" % (service, methode))
+        transport_stats['cache_hits'] += 1
+        return True, json.loads(v[1])
+
+
+    ##
+    # @brief mémorise la réponse d'une requête de lecture
+    #
+    # @param data corps json de la requête
+    # @param r réponse décodée
+    #
+    # @return 
+    def range(self, data, r):
+        service, methode, cle = self.analyse(data)
+        if r is None or not re.match(r'(get|list)', methode) or (isinstance(r, dict) and r.get('errors')):
+            return
+
+        ttl = REPONSES_TTL.get((service + ":" + methode).lower(), REPONSES_TTL.get('*', 0))
+        if ttl <= 0:
+            return
+
+        texte = json.dumps(r)
+        with self.lock:
+            self.charge()
+            self.reponses[cle] = (time.time() + ttl, texte)
+            self.reponses.move_to_end(cle)
+            while len(self.reponses) > REPONSES_MAX:
+                self.reponses.popitem(last=False)
+            self.modifie = True
+
+
+cache_reponses = cache_reponses_lru()
+
+
+##
+# @brief mesures des requêtes (-stats, -trace): chemin, méthode, octets reçus, temps réseau, temps de décodage, essais
+#
+# Pour les réponses reçues en morceaux, le temps réseau est celui passé à attendre les morceaux
+# pendant le décodage, qui est compté à part.
+#
+class mesures_requetes:
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.local = threading.local()
+        self.t0 = time.perf_counter()
+        self.appels = [ ]
+
+
+    ##
+    # @brief commence la mesure d'une requête
+    #
+    # @return la mesure, à passer à recoit() et termine()
+    def commence(self, chemin, get=False):
+        if get:
+            methode = "GET"
+        else:
+            chemin, _, methode = chemin.rpartition(':')
+        self.local.essais = 0
+        return { 'chemin': chemin, 'methode': methode, 'debut': time.perf_counter(), 'reseau': 0, 'octets': 0,
+                 'thread': threading.get_ident() }
+
+
+    def nouvel_essai(self):
+        self.local.essais = getattr(self.local, 'essais', 0) + 1
+
+
+    ##
+    # @brief note la réception du contenu
+    #
+    # @param m mesure
+    # @param t contenu (bytes ou itérable de bytes)
+    #
+    # @return le contenu, dont les morceaux sont comptés au fil de la lecture
+    def recoit(self, m, t):
+        if isinstance(t, bytes):
+            m['reseau'] = time.perf_counter() - m['debut']
+            m['octets'] = len(t)
+            return t
+
+        def morceaux():
+            it = iter(t)
+            while True:
+                debut = time.perf_counter()
+                b = next(it, None)
+                m['reseau'] += time.perf_counter() - debut
+                if b is None:
+                    return
+                m['octets'] += len(b)
+                yield b
+
+        m['reseau'] = time.perf_counter() - m['debut']
+        return morceaux()
+
+
+    @staticmethod
+    def nom(m):
+        if m['methode'] in ("GET", "POST"):
+            return m['methode'] + " " + m['chemin']
+        return m['chemin'] + ":" + m['methode']
+
+
+    def termine(self, m):
+        m['duree'] = time.perf_counter() - m['debut']
+        m['decodage'] = max(0, m['duree'] - m['reseau'])
+        m['essais'] = getattr(self.local, 'essais', 0)
+        with self.lock:
+            self.appels.append(m)
+
+
+    ##
+    # @brief affiche l'histogramme des durées et les requêtes les plus lentes
+    #
+    # @param n nombre de requêtes les plus lentes
+    # @param file
+    #
+    # @return
+    def resume(self, n=10, file=sys.stderr):
+        appels = list(self.appels)
+        if len(appels) == 0:
+            print("aucune requête", file=file)
+            return
+
+        durees = sorted(m['duree'] for m in appels)
+        def centile(p):
+            return durees[min(len(durees) - 1, int(p * len(durees)))] * 1000
+
+        print("%d requêtes, %.1f Mo reçus, réseau %.3f s, décodage %.3f s, %d essais supplémentaires" % (
+                len(appels), sum(m['octets'] for m in appels) / 1e6, sum(m['reseau'] for m in appels),
+                sum(m['decodage'] for m in appels), sum(m['essais'] for m in appels)), file=file)
+        print("médiane %.1f ms, 90%% %.1f ms, 99%% %.1f ms, max %.1f ms" % (centile(0.5), centile(0.9), centile(0.99), durees[-1] * 1000), file=file)
+
+        # histogramme par puissances de 2 (en ms)
+        classes = Counter(max(0, math.ceil(math.log2(max(d * 1000, 1e-3)))) for d in durees)
+        maxi = max(classes.values())
+        print(file=file)
+        for k in range(min(classes), max(classes) + 1):
+            bas = 0 if k == 0 else 2 ** (k - 1)
+            print("%6g - %-6g ms %6d %s" % (bas, 2 ** k, classes[k], "#" * math.ceil(40 * classes[k] / maxi)), file=file)
+
+        print(file=file)
+        for m in sorted(appels, key=lambda m: m['duree'], reverse=True)[:n]:
+            print("%9.1f ms  réseau %8.1f ms  décodage %8.1f ms %9d o %s %s" % (
+                    m['duree'] * 1000, m['reseau'] * 1000, m['decodage'] * 1000, m['octets'],
+                    "(%d essais)" % (m['essais'] + 1) if m['essais'] else "", self.nom(m)), file=file)
+
+
+    ##
+    # @brief écrit la chronologie des requêtes au format trace-event de Chrome (chrome://tracing, Perfetto)
+    #
+    # @param fichier
+    #
+    # @return
+    def trace(self, fichier):
+        threads = { }
+        evenements = [ ]
+        for m in self.appels:
+            tid = threads.setdefault(m['thread'], len(threads) + 1)
+            debut = (m['debut'] - self.t0) * 1e6
+            evenements.append({ 'name': self.nom(m), 'cat': "requete", 'ph': "X",
+                                'ts': round(debut, 1), 'dur': round(m['duree'] * 1e6, 1), 'pid': os.getpid(), 'tid': tid,
+                                'args': { 'octets': m['octets'], 'reseau_ms': round(m['reseau'] * 1000, 3),
+                                          'decodage_ms': round(m['decodage'] * 1000, 3), 'essais': m['essais'] } })
+            # le décodage est placé en fin de requête, même s'il alterne avec la réception des morceaux
+            evenements.append({ 'name': "décodage", 'cat': "decodage", 'ph': "X", 'pid': os.getpid(), 'tid': tid,
+                                'ts': round(debut + (m['duree'] - m['decodage']) * 1e6, 1), 'dur': round(m['decodage'] * 1e6, 1) })
+        with open(fichier, "w") as f:
+            json.dump({ 'traceEvents': evenements, 'displayTimeUnit': "ms" }, f)
+
+
+mesures = None
+
+
+##
+# @brief indique si la méthode d'une requête ne fait que lire (get*, list*), et peut donc être renvoyée
+#
+# @param chemin
+#
+# @return 
+def methode_lecture(chemin):
+    return re.match(r'(get|list)', (chemin or "").rsplit(':', 1)[-1]) is not None
+
+
+##
+# @brief envoie une requête sysbus à la Livebox
+#
+# @param chemin
+# @param args
+# @param get
+#
+# @return 
+def requete(chemin, args=None, get=False, raw=False, silent=False):
+
+    c, data = prepare_requete(chemin, args, get)
+
+    if data is not None and cache_reponses.invalide(data):
+        pass
+    elif REPONSES_CACHE and data is not None and not raw:
+        trouve, r = cache_reponses.cherche(data)
+        if trouve:
+            return r
+
+    if mesures is not None:
+        m = mesures.commence(chemin or "sysbus", get)
+
+    code, t = envoie(c, data, get, stream=get, lecture=methode_lecture(chemin))
+    if mesures is not None:
+        t = mesures.recoit(m, t)
+
+    r = decode_reponse(t, get, raw, silent)
+    if mesures is not None:
+        mesures.termine(m)
+
+    if REPONSES_CACHE and data is not None and not raw:
+        cache_reponses.range(data, r)
+    return r
+    
+
+##
+# @brief envoie une requête sysbus et retourne la réponse brute en morceaux
+#
+# @param chemin
+# @param args
+# @param get
+#
+# @return (code HTTP, générateur de bytes)
+def requete_stream(chemin, args=None, get=True):
+    c, data = prepare_requete(chemin, args, get)
+    if mesures is None:
+        code, t = envoie(c, data, get, stream=True, lecture=methode_lecture(chemin))
+        return code, corrige_morceaux(t)
+
+    # le traitement des morceaux par l'appelant est compté comme du décodage
+    m = mesures.commence(chemin or "sysbus", get)
+    code, t = envoie(c, data, get, stream=True, lecture=methode_lecture(chemin))
+
+    # la mesure est terminée même si l'appelant s'arrête avant la fin (erreur, fermeture)
+    def morceaux():
+        try:
+            yield from corrige_morceaux(mesures.recoit(m, t))
+        finally:
+            mesures.termine(m)
+
+    return code, morceaux()
+
+
+##
+# @brief s'abonne aux événements du datamodel et les retourne au fil de l'eau
+#
+# L'interface web reçoit les événements par une requête longue ("long polling") sur /ws :
+# la première requête ouvre un canal (channelid 0), les suivantes attendent les
+# événements de ce canal.
+#
+# @param chemins objets à surveiller ('Hosts', 'NMC', 'NeMo.Intf.data'...)
+# @param timeout délai d'attente maximal d'une requête, en secondes
+#
+# @return générateur des événements (dictionnaires)
+def evenements(chemins, timeout=EVENTS_TIMEOUT):
+
+    handlers = [ ]
+    for i in chemins:
+        i = str.replace(i, "/", ".").strip(".")
+        handlers.append(i if i.startswith("sysbus.") else "sysbus." + i)
+
+    entetes = { 'Content-Type':'application/x-sah-event-4-call+json; charset=UTF-8' }
+    channel = 0
+
+    while True:
+        data = json.dumps({ 'events':handlers, 'channelid':channel })
+        try:
+            code, t = envoie('ws', data, entetes=entetes, timeout=timeout)
+        except requests.exceptions.Timeout:
+            debug(2, "aucun événement depuis %d s" % timeout)
+            continue
+        except (requests.exceptions.ConnectionError, ConnectionError) as e:
+            # Livebox injoignable, ou erreur relayée par le démon: on réessaie
+            debug(1, "canal d'événements interrompu:", str(e))
+            time.sleep(1)
+            continue
+
+        try:
+            r = json.loads(t.decode('utf-8', errors='replace'))
+        except ValueError:
+            error("mauvais json:", t)
+            time.sleep(1)
+            continue
+
+        if 'errors' in r or 'channelid' not in r:
+            # canal expiré ou refusé: on en ouvre un nouveau
+            debug(1, "réouverture du canal d'événements", str(r.get('errors')))
+            channel = 0
+            time.sleep(1)
+            continue
+
+        if r['channelid'] != channel:
+            debug(1, "canal d'événements %s" % r['channelid'])
+            channel = r['channelid']
+
+        for e in r.get('events', []):
+            yield e.get('data', e)
+
+
+##
+# @brief envoie plusieurs requêtes sysbus simultanément sur la session partagée
+#
+# @param appels liste de tuples (chemin, args) ou (chemin, args, get)
+# @param silent
+# @param workers nombre maximal de requêtes simultanées (BATCH_WORKERS par défaut)
+#
+# @return liste de tuples (résultat, exception) dans l'ordre des appels
+def requete_batch(appels, silent=False, workers=None):
+
+    appels = list(appels)
+    if len(appels) == 0:
+        return []
+
+    def un_appel(appel):
+        try:
+            return requete(*appel, silent=silent), None
+        except Exception as e:
+            if not silent:
+                error("erreur:", appel[0], e)
+            return None, e
+
+    workers = min(workers or BATCH_WORKERS, len(appels))
+    debug(2, "batch de %d requêtes, %d simultanées" % (len(appels), workers))
+
+    # modules de l'envoi à la Livebox (session, réauthentification) utilisés par les threads
+    if instantane is None and (cassette is None or not cassette.rejeu) and not daemon_actif:
+        import requests, pickle
+    import concurrent.futures
+    with concurrent.futures.ThreadPoolExecutor(max_workers=workers) as executor:
+        return list(executor.map(un_appel, appels))
+
+
+##
+# @brief client sysbus asyncio, sans librairie HTTP tierce
+#
+# Reprend la logique de auth()/requete() (mêmes entêtes, même fichier d'état) sur des
+# connexions HTTP/1.1 persistantes gérées par asyncio. La connexion et chaque échange sont
+# limités par les délais de TRANSPORT (connect_timeout, timeout), ou par timeout. Exemple :
+#
+#     lb = sysbus_async()
+#     await lb.auth()
+#     r = await lb.requete("NMC:getWANStatus")
+#     await lb.close()
+#
+class sysbus_async:
+
+    def __init__(self, url=None, user=None, password=None, connexions=None, timeout=None):
+        self.url = url or URL_LIVEBOX
+        if self.url[-1] != "/": self.url += "/"
+        self.user = user or USER_LIVEBOX
+        self.password = password or PASSWORD_LIVEBOX
+
+        u = urllib.parse.urlsplit(self.url)
+        self.ssl = (u.scheme == "https")
+        self.host = u.hostname
+        self.port = u.port or (443 if self.ssl else 80)
+        self.base = u.path
+        self.connect_timeout = TRANSPORT['connect_timeout']
+        self.timeout = timeout or TRANSPORT['timeout']
+
+        self.cookies = { }
+        self.sah_headers = entetes_sah()
+        self.reauth = False
+        self._reauth_lock = asyncio.Lock()
+        self._contexte = suivi_contexte()
+
+        # connexions ouvertes disponibles, et nombre maximal de requêtes simultanées
+        self._libres = [ ]
+        self._semaphore = asyncio.Semaphore(connexions or BATCH_WORKERS)
+
+
+    ##
+    # @brief authentification, comme auth()
+    #
+    # @return True/False
+    async def auth(self, new_session=False):
+
+        state = None if new_session else load_state()
+
+        if state is not None:
+            self.cookies = dict(state[0])
+            contextID = state[1]
+            self._contexte.verifie = False
+
+        else:
+            debug(1, "new async session")
+            self.cookies = { }
+
+            params = urllib.parse.urlencode({ 'username':self.user, 'password':self.password })
+            status, t = await self._http('POST', 'authenticate?' + params, b'')
+            r = json.loads(t.decode('utf-8', errors='replace'))
+
+            if not 'contextID' in r['data']:
+                error("auth error", str(t))
+                error("authentification impossible")
+                return False
+
+            contextID = r['data']['contextID']
+            self._contexte.verifie = True
+            save_state(self.cookies, contextID)
+
+        self.sah_headers = entetes_sah(contextID)
+        self.reauth = True
+        return True
+
+
+    ##
+    # @brief requêtes sans authentification
+    #
+    # @return 
+    def noauth(self):
+        self.cookies = { }
+        self.sah_headers = entetes_sah()
+        self.reauth = False
+
+
+    ##
+    # @brief envoie une requête sysbus, comme requete()
+    #
+    # @return 
+    async def requete(self, chemin, args=None, get=False, raw=False, silent=False):
+
+        c, data = prepare_requete(chemin, args, get)
+
+        for essai in range(2):
+            headers = self.sah_headers
+
+            if data is None:
+                debug(1, "requête async:", c)
+                status, t = await self._http('GET', c)
+            else:
+                debug(1, "requête async:", c, "with", data)
+                status, t = await self._http('POST', c, data.encode('utf-8'))
+
+            if essai == 0 and self.reauth and self._contexte.expire((c, data), status, t, get):
+                async with self._reauth_lock:
+                    if headers is self.sah_headers:
+                        debug(1, "contexte refusé, nouvelle authentification")
+                        await self.auth(new_session=True)
+                continue
+            break
+
+        return decode_reponse(t, get, raw, silent)
+
+
+    ##
+    # @brief envoie plusieurs requêtes simultanément, comme requete_batch()
+    #
+    # @return liste de tuples (résultat, exception) dans l'ordre des appels
+    async def requete_batch(self, appels, silent=False):
+
+        async def un_appel(appel):
+            try:
+                return await self.requete(*appel, silent=silent), None
+            except Exception as e:
+                if not silent:
+                    error("erreur:", appel[0], e)
+                return None, e
+
+        return list(await asyncio.gather(*[ un_appel(appel) for appel in appels ]))
+
+
+    ##
+    # @brief ferme les connexions inutilisées
+    #
+    # @return 
+    async def close(self):
+        while self._libres:
+            reader, writer = self._libres.pop()
+            writer.close()
+            try:
+                await writer.wait_closed()
+            except OSError:
+                pass
+
+
+    ##
+    # @brief envoie une requête HTTP sur une connexion persistante
+    #
+    # @param methode GET ou POST
+    # @param chemin chemin relatif à l'url de la Livebox
+    # @param corps
+    #
+    # @return (code HTTP, contenu)
+    async def _http(self, methode, chemin, corps=None):
+
+        async with self._semaphore:
+
+            # une connexion réutilisée a pu être fermée par la Livebox: on réessaie une fois
+            for essai in range(2):
+                reutilisee = len(self._libres) > 0
+                if reutilisee:
+                    reader, writer = self._libres.pop()
+                else:
+                    reader, writer = await asyncio.wait_for(asyncio.open_connection(self.host, self.port, ssl=self.ssl or None),
+                                                            self.connect_timeout)
+
+                try:
+                    status, garder, t = await asyncio.wait_for(self._echange(reader, writer, methode, chemin, corps), self.timeout)
+
+                except BaseException as e:
+                    # toute erreur (délai dépassé, réponse illisible, annulation) ferme la connexion,
+                    # qui n'est pas rendue aux connexions libres
+                    writer.close()
+                    if reutilisee and essai == 0 and isinstance(e, (ConnectionError, asyncio.IncompleteReadError)):
+                        continue
+                    raise
+
+                if garder:
+                    self._libres.append((reader, writer))
+                else:
+                    writer.close()
+                return status, t
+
+
+    async def _echange(self, reader, writer, methode, chemin, corps):
+        writer.write(self._entetes(methode, chemin, corps))
+        if corps:
+            writer.write(corps)
+        await writer.drain()
+        return await self._lit_reponse(reader)
+
+
+    def _entetes(self, methode, chemin, corps):
+        lignes = [ "%s %s%s HTTP/1.1" % (methode, self.base, chemin),
+                   "Host: %s:%d" % (self.host, self.port),
+                   "Connection: keep-alive" ]
+        for k, v in self.sah_headers.items():
+            lignes.append("%s: %s" % (k, v))
+        if self.cookies:
+            lignes.append("Cookie: " + "; ".join("%s=%s" % (k, v) for k, v in self.cookies.items()))
+        if corps is not None:
+            lignes.append("Content-Length: %d" % len(corps))
+        return ("\r\n".join(lignes) + "\r\n\r\n").encode('latin-1')
+
+
+    async def _lit_reponse(self, reader):
+
+        ligne = await reader.readline()
+        if not ligne:
+            raise ConnectionError("connexion fermée")
+        status = int(ligne.split()[1])
+
+        entetes = { }
+        while True:
+            ligne = await reader.readline()
+            if ligne in (b'\r\n', b'\n', b''):
+                break
+            k, v = ligne.decode('latin-1').split(':', 1)
+            k = k.strip().lower()
+            v = v.strip()
+            if k == 'set-cookie':
+                nom, _, valeur = v.split(';', 1)[0].partition('=')
+                self.cookies[nom.strip()] = valeur.strip()
+            entetes[k] = v
+
+        garder = entetes.get('connection', '').lower() != 'close'
+
+        if entetes.get('transfer-encoding', '').lower() == 'chunked':
+            morceaux = [ ]
+            while True:
+                taille = int((await reader.readline()).split(b';')[0], 16)
+                if taille == 0:
+                    # fin du contenu et trailers éventuels
+                    while (await reader.readline()) not in (b'\r\n', b'\n', b''):
+                        pass
+                    break
+                morceaux.append(await reader.readexactly(taille))
+                await reader.readexactly(2)
+            t = b''.join(morceaux)
+
+        elif 'content-length' in entetes:
+            t = await reader.readexactly(int(entetes['content-length']))
+
+        else:
+            t = await reader.read()
+            garder = False
+
+        return status, garder, t
+
+
+##
+# @brief envoie une requête sysbus et affiche le résultat
+#
+# @param chemin chemin de la requête
+# @param args paramètres supplementaires
+#
+# @return 
+def requete_print(chemin, args=None, get=False):
+    #print(chemin, args)
+    #return
+    result = requete(chemin, args, get)
+    if result:
+        pprint.pprint(result)
+    return result
+
+
+
+##
+# @brief répertoire des caches persistants (datamodel, ...)
+#
+# @return 
+def cache_dir():
+    d = os.path.join(os.path.expanduser("~"), ".cache", "sysbus")
+    if not os.path.isdir(d):
+        os.makedirs(d)
+    return d
+
+
+##
+# @brief retourne le chemin d'un objet du datamodel, 'NMC.Wifi' par exemple ('' pour la racine)
+#
+# @param node
+#
+# @return 
+def node_path(node):
+    o = node['objectInfo']
+    path = o['keyPath'] + "." + o['key']
+    if path[0] == ".": path = path[1:]
+    return path
+
+
+##
+# @brief parcourt le datamodel: objets, sous-objets et instances
+#
+# @param nodes noeuds racines (liste ou générateur, parcourus l'un après l'autre)
+# @param instances si faux, les instances (et leurs sous-objets) sont ignorées
+#
+# @return générateur de tuples (noeud, vrai si instance)
+def model_walk(nodes, instances=True):
+    for racine in nodes:
+        pile = [ (racine, False) ]
+        while pile:
+            node, instance = pile.pop()
+            yield node, instance
+            if instances:
+                pile.extend((i, True) for i in reversed(node.get('instances', [])))
+            pile.extend((c, False) for c in reversed(node.get('children', [])))
+
+
+##
+# @brief liste des arguments d'une fonction du datamodel: 'opt x, out y'
+#
+# @param f
+#
+# @return 
+def signature_fonction(f):
+    aa = ""
+    for a in f.get('arguments', []):
+        flag = ""
+        if 'attributes' in a and 'mandatory' in a['attributes'] and a['attributes']['mandatory']:
+            pass
+        else:
+            flag = "opt "
+        if 'attributes' in a and 'out' in a['attributes'] and a['attributes']['out']:
+            flag = "out "
+        aa += ", " + flag + a['name']
+    return aa[2:]
+
+
+##
+# @brief version du firmware de la Livebox, clé du cache du datamodel
+#
+# La version est gardée FIRMWARE_TTL secondes dans le répertoire du cache, pour ne pas
+# payer un DeviceInfo:get à chaque lancement.
+#
+# @return la version ou None
+@functools.lru_cache(maxsize=None)
+def firmware_version():
+    fichier = os.path.join(cache_dir(), "firmware-%s" % hashlib.sha1(URL_LIVEBOX.encode('utf-8')).hexdigest()[:16])
+    try:
+        if time.time() - os.path.getmtime(fichier) < FIRMWARE_TTL:
+            with open(fichier) as f:
+                version = f.read().strip()
+            if version:
+                return version
+    except OSError:
+        pass
+
+    r = requete("DeviceInfo:get", silent=True)
+    if r is None or not 'status' in r:
+        return None
+    version = r['status']['SoftwareVersion']
+    with open(fichier, "w") as f:
+        f.write(version)
+    return version
+
+
+##
+# @brief retourne le fichier de cache du datamodel complet de la Livebox courante
+#
+# @return le chemin ou None si la version du firmware est inconnue
+def model_cache_file():
+    version = firmware_version()
+    if version is None:
+        return None
+    cle = hashlib.sha1((URL_LIVEBOX + "\n" + version).encode('utf-8')).hexdigest()[:16]
+    return os.path.join(cache_dir(), "model-%s.json" % cle)
+
+
+##
+# @brief vrai si le début d'une réponse brute est un message d'erreur de la Livebox
+#        plutôt que des données ({"errors": ...}, {"error": ...} ou {"result": {"errors": ...}})
+#
+# @param debut premiers octets de la réponse
+#
+# @return 
+def reponse_en_erreur(debut):
+    return re.match(rb'\s*\[?\s*\{\s*"(errors?|result)"', debut) is not None
+
+
+##
+# @brief retourne le datamodel complet brut en morceaux, depuis le cache ou la Livebox
+#        (le téléchargement est écrit dans le cache au fil de la réception)
+#
+# Seule une réponse HTTP 200 qui n'est pas un message d'erreur est mise en cache ; le fichier
+# temporaire est supprimé si le téléchargement échoue ou n'est pas lu jusqu'au bout.
+#
+# @return générateur de bytes
+def model_complet_morceaux():
+    fichier = model_cache_file()
+
+    if fichier and os.path.exists(fichier):
+        debug(1, "datamodel lu dans le cache", fichier)
+        with open(fichier, "rb") as f:
+            while True:
+                b = f.read(CHUNK_SIZE)
+                if not b: break
+                yield b
+        return
+
+    code, morceaux = requete_stream("sysbus", None)
+    if not fichier or code != 200:
+        if fichier:
+            debug(1, "datamodel non mis en cache: HTTP %d" % code)
+        yield from morceaux
+        return
+
+    tmp = "%s.%d.tmp" % (fichier, os.getpid())
+    debut = b''
+    try:
+        with open(tmp, "wb") as f:
+            for b in morceaux:
+                if len(debut) < 64:
+                    debut += b[:64]
+                f.write(b)
+                yield b
+        if debut and not reponse_en_erreur(debut):
+            debug(1, "datamodel mis en cache", fichier)
+            os.replace(tmp, fichier)
+        else:
+            debug(1, "datamodel non mis en cache: réponse en erreur")
+    finally:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+
+
+##
+# @brief limite la profondeur d'un noeud du datamodel, comme le paramètre _restDepth
+#
+# @param node
+# @param prof profondeur (-1: illimitée)
+#
+# @return 
+def tronque_node(node, prof):
+    if prof < 0:
+        return node
+
+    n = dict(node)
+    if prof > 0:
+        n['children'] = [ tronque_node(c, prof - 1) for c in node.get('children', []) ]
+        if 'instances' in node:
+            n['instances'] = [ tronque_node(i, prof - 1) for i in node['instances'] ]
+    else:
+        n['children'] = [ ]
+        if 'instances' in node:
+            n['instances'] = [ dict(i, children=[]) for i in node['instances'] ]
+    return n
+
+
+##
+# @brief cherche un objet dans le datamodel
+#
+# @param node racine de la recherche
+# @param path chemin de l'objet ('NMC.Wifi')
+#
+# @return le noeud ou None
+def cherche_node(node, path):
+    p = node_path(node)
+    if p == path:
+        return node
+    if p != "" and not path.startswith(p + "."):
+        return None
+    for c in node.get('children', []) + node.get('instances', []):
+        n = cherche_node(c, path)
+        if n is not None:
+            return n
+    return None
+
+
+##
+# @brief chemin d'un objet dans le datamodel, tel que retourné par node_path() ("" pour la racine)
+#
+# @param chemin chemin de la requête (sysbus, sysbus.Devices, Devices/Device...)
+#
+# @return
+def chemin_modele(chemin):
+    path = str.replace(chemin or "sysbus", "/", ".").strip(".")
+    if path == "sysbus":
+        path = ""
+    elif path.startswith("sysbus."):
+        path = path[7:]
+    return path
+
+
+##
+# @brief instantané (-from): réponse enregistrée (model.json, getMIBs, topologie...) lue à la place de la Livebox
+#
+# Le fichier est projeté en mémoire (mmap) et n'est décodé qu'à sa première utilisation, objet par
+# objet: les objets d'un datamodel en plusieurs parties sont affichés au fil du décodage. Les
+# fichiers .gz et .xz sont lus au fil de la décompression. La sortie de pprint (mibs_all, .dict
+# et .mib de -MIBs dump) est également acceptée.
+#
+class instantane_sysbus:
+
+    def __init__(self, fichier):
+        self.fichier = fichier
+        # vérifie tout de suite que le fichier est lisible
+        with open(fichier, "rb"):
+            pass
+
+
+    ##
+    # @brief contenu du fichier en morceaux
+    #
+    # @return générateur de bytes
+    def morceaux(self):
+        import mmap
+
+        if self.fichier.endswith(".gz") or self.fichier.endswith(".xz"):
+            with (gzip.open if self.fichier.endswith(".gz") else lzma.open)(self.fichier, "rb") as f:
+                while True:
+                    b = f.read(CHUNK_SIZE)
+                    if not b:
+                        return
+                    yield b
+
+        with open(self.fichier, "rb") as f:
+            if os.fstat(f.fileno()).st_size == 0:
+                return
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as m:
+                for i in range(0, len(m), CHUNK_SIZE):
+                    yield m[i:i + CHUNK_SIZE]
+
+
+    ##
+    # @brief décode les objets du fichier, un par un
+    #
+    # @return générateur des objets, interrompu par une erreur de décodage
+    def objets(self):
+        n = 0
+        try:
+            for obj in json_stream(corrige_morceaux(self.morceaux())):
+                n += 1
+                yield obj
+        except ValueError as e:
+            if n > 0:
+                error("%s: mauvais json: %s" % (self.fichier, e))
+                return
+
+            # sortie de pprint: dictionnaires et listes Python
+            import ast
+            try:
+                obj = ast.literal_eval(b''.join(self.morceaux()).decode('utf-8', errors='replace'))
+            except (ValueError, SyntaxError) as e:
+                error("%s: ni json ni pprint: %s" % (self.fichier, e))
+                return
+            yield obj
+            return
+
+        if n == 0:
+            error("%s: vide" % self.fichier)
+
+
+    ##
+    # @brief la réponse d'une requête, comme retournée par requete()
+    #        la réponse est un seul objet, décodé entièrement en mémoire (getMIBs, topologie)
+    #
+    # @return { 'status': ... } ou None
+    def reponse(self):
+        objets = self.objets()
+        r = next(objets, None)
+        if r is None:
+            return None
+        if next(objets, None) is not None:
+            error("%s: plusieurs objets json, une seule réponse attendue" % self.fichier)
+            return None
+
+        if isinstance(r, dict) and 'result' in r:
+            if 'errors' in r['result']:
+                error("erreur:", json.dumps(r, ensure_ascii=False))
+                return None
+            r = r['result']
+        # le contenu de 'status' seul
+        if not isinstance(r, dict) or not 'status' in r:
+            r = { 'status': r }
+        return r
+
+
+    ##
+    # @brief le datamodel, à partir d'un noeud ou depuis la racine
+    #
+    # @param chemin
+    # @param prof
+    # @param raw
+    #
+    # @return comme requete(chemin, prof, get=True, raw=raw), les noeuds de la racine étant décodés au fil de l'itération
+    def modele(self, chemin, prof=None, raw=False):
+        path = chemin_modele(chemin)
+
+        if path == "" and prof is None:
+            if raw:
+                return b''.join(corrige_morceaux(self.morceaux()))
+            return self.objets()
+
+        node = None
+        for i in self.objets():
+            node = cherche_node(i, path)
+            if node is not None:
+                break
+        if node is None:
+            error("%s absent de %s" % (path or "sysbus", self.fichier))
+            return None
+
+        node = tronque_node(node, -1 if prof is None else int(prof))
+        if raw:
+            return json.dumps(node).encode('utf-8')
+        return [ node ]
+
+
+instantane = None
+
+
+##
+# @brief interroge le datamodel en passant par le cache, qui contient le modèle complet
+#        pour chaque url et version de firmware
+#
+# Le cache n'est utilisé qu'avec -cachemodel : il garde les valeurs des paramètres du moment du
+# téléchargement, que -model et -object affichent figées jusqu'au prochain -modelcache refresh.
+# Sans modèle en cache, un sous-arbre est demandé directement à la Livebox.
+#
+# @param chemin
+# @param prof
+# @param raw
+#
+# @return comme requete(chemin, prof, get=True, raw=raw)
+def model_get(chemin, prof=None, raw=False):
+
+    if instantane is not None:
+        return instantane.modele(chemin, prof, raw)
+
+    if not MODEL_CACHE:
+        return requete(chemin, prof, get=True, raw=raw)
+
+    path = chemin_modele(chemin)
+    prof = -1 if prof is None else int(prof)
+
+    if path == "" and prof == -1 and raw:
+        return b''.join(model_complet_morceaux())
+
+    if path != "" or prof != -1:
+        fichier = model_cache_file()
+        if not fichier or not os.path.exists(fichier):
+            return requete(chemin, None if prof == -1 else prof, get=True, raw=raw)
+
+    r = decode_reponse(model_complet_morceaux(), get=True)
+    node = None
+    for i in r or []:
+        node = cherche_node(i, path)
+        if node is not None:
+            break
+
+    # objet absent du modèle complet (accès interdit depuis la racine par exemple)
+    if node is None:
+        debug(1, "%s absent du datamodel en cache" % (path))
+        return requete(chemin, None if prof == -1 else prof, get=True, raw=raw)
+
+    node = tronque_node(node, prof)
+    if raw:
+        return json.dumps(node).encode('utf-8')
+    return [ node ]
+
+
+##
+# @brief fichier de l'index SQLite du datamodel
+#
+# @return 
+def model_index_file():
+    return os.path.join(cache_dir(), "model.db")
+
+
+##
+# @brief crée l'index SQLite du datamodel (objets, fonctions, arguments, paramètres, objets interdits)
+#        avec une table de recherche plein texte
+#
+# @param nodes racines du datamodel, telles que retournées par model_get()
+# @param fichier base SQLite, recréée
+#
+# @return nombre d'objets indexés
+def model_index(nodes, fichier):
+
+    if os.path.exists(fichier):
+        os.remove(fichier)
+
+    db = sqlite3.connect(fichier)
+    db.executescript("""
+        CREATE TABLE info (key TEXT PRIMARY KEY, value TEXT);
+        CREATE TABLE objects (id INTEGER PRIMARY KEY, path TEXT, keyPath TEXT, key TEXT, name TEXT, instance INTEGER);
+        CREATE TABLE functions (id INTEGER PRIMARY KEY, object INTEGER, name TEXT, type TEXT, attributes TEXT);
+        CREATE TABLE arguments (function INTEGER, name TEXT, type TEXT, mandatory INTEGER, out INTEGER, attributes TEXT);
+        CREATE TABLE parameters (object INTEGER, name TEXT, type TEXT, value TEXT, attributes TEXT);
+        CREATE TABLE forbidden (object INTEGER, name TEXT, path TEXT);
+        CREATE INDEX objects_path ON objects (path);
+        CREATE INDEX functions_name ON functions (name);
+        CREATE INDEX parameters_name ON parameters (name);
+        """)
+
+    # recherche plein texte si SQLite le permet
+    fts = None
+    for module in ("fts5", "fts4"):
+        try:
+            db.execute("CREATE VIRTUAL TABLE recherche USING %s (kind, path, name, detail)" % module)
+            fts = module
+            break
+        except sqlite3.OperationalError:
+            pass
+    if fts is None:
+        db.execute("CREATE TABLE recherche (kind TEXT, path TEXT, name TEXT, detail TEXT)")
+    debug(2, "recherche plein texte: %s" % fts)
+
+    db.executemany("INSERT INTO info VALUES (?, ?)", [ ("url", URL_LIVEBOX),
+                                                      ("firmware", str(firmware_version())),
+                                                      ("date", datetime.datetime.now().isoformat()) ])
+
+    n = 0
+    parametres = [ ]
+    interdits = [ ]
+    recherche = [ ]
+
+    for node, instance in model_walk(nodes):
+        o = node['objectInfo']
+        path = node_path(node)
+        n += 1
+        object_id = db.execute("INSERT INTO objects (path, keyPath, key, name, instance) VALUES (?, ?, ?, ?, ?)",
+                               (path, o['keyPath'], o['key'], o['name'], instance)).lastrowid
+        recherche.append(("object", path, o['name'], ""))
+
+        for f in node.get('functions', []):
+            function_id = db.execute("INSERT INTO functions (object, name, type, attributes) VALUES (?, ?, ?, ?)",
+                                     (object_id, f['name'], f.get('type'), json.dumps(f.get('attributes', {})))).lastrowid
+            arguments = [ ]
+            for a in f.get('arguments', []):
+                attributes = a.get('attributes', {})
+                arguments.append((function_id, a['name'], a.get('type'),
+                                  bool(attributes.get('mandatory')), bool(attributes.get('out')), json.dumps(attributes)))
+            db.executemany("INSERT INTO arguments VALUES (?, ?, ?, ?, ?, ?)", arguments)
+            recherche.append(("function", path, f['name'], signature_fonction(f)))
+
+        for p in node.get('parameters', []):
+            parametres.append((object_id, p['name'], p.get('type'), str(p.get('value')), json.dumps(p.get('attributes', {}))))
+            recherche.append(("parameter", path, p['name'], "%s = %s" % (p.get('type'), p.get('value'))))
+
+        for e in node.get('errors', []):
+            if e['error'] == 13:
+                nom = e['info']
+                interdits.append((object_id, nom, (path + "." + nom).strip(".")))
+                recherche.append(("forbidden", (path + "." + nom).strip("."), nom, e.get('description', "")))
+
+    db.executemany("INSERT INTO parameters VALUES (?, ?, ?, ?, ?)", parametres)
+    db.executemany("INSERT INTO forbidden VALUES (?, ?, ?)", interdits)
+    db.executemany("INSERT INTO recherche VALUES (?, ?, ?, ?)", recherche)
+    db.commit()
+    db.close()
+    return n
+
+
+##
+# @brief cherche dans l'index du datamodel (cf. -modelindex)
+#        -find function NOM | parameter NOM | object NOM | texte...
+#        les noms acceptent les jokers * et ?
+#
+# @param args
+#
+# @return 
+def find_model(args):
+
+    if len(args) == 0:
+        error("Usage: -find [ function | parameter | object ] nom | -find texte...")
+        return
+
+    fichier = model_index_file()
+    if not os.path.exists(fichier):
+        error("index absent, utilisez d'abord -modelindex")
+        return
+
+    db = sqlite3.connect(fichier)
+
+    if args[0] in ("function", "parameter", "object") and len(args) >= 2:
+        nom = args[1]
+
+        if args[0] == "function":
+            for path, name, function_id in db.execute(
+                    "SELECT objects.path, functions.name, functions.id FROM functions JOIN objects ON objects.id = functions.object"
+                    " WHERE functions.name GLOB ? ORDER BY objects.path", (nom,)):
+                arguments = [ ]
+                for a, mandatory, out in db.execute("SELECT name, mandatory, out FROM arguments WHERE function = ?", (function_id,)):
+                    arguments.append(("out " if out else "" if mandatory else "opt ") + a)
+                print("%s: %s(%s)" % (path, name, ", ".join(arguments)))
+
+        elif args[0] == "parameter":
+            for path, name, type, value in db.execute(
+                    "SELECT objects.path, parameters.name, parameters.type, parameters.value FROM parameters"
+                    " JOIN objects ON objects.id = parameters.object WHERE parameters.name GLOB ? ORDER BY objects.path", (nom,)):
+                print("%s: %-20s : %-10s = '%s'" % (path, name, type, value))
+
+        else:
+            for path, in db.execute("SELECT path FROM objects WHERE key GLOB ? OR path GLOB ? ORDER BY path", (nom, nom)):
+                print(path)
+            for path, in db.execute("SELECT path FROM forbidden WHERE name GLOB ? OR path GLOB ? ORDER BY path", (nom, nom)):
+                print(path, "(accès interdit)")
+
+    else:
+        texte = " ".join(args)
+        try:
+            lignes = db.execute("SELECT kind, path, name, detail FROM recherche WHERE recherche MATCH ?", (texte,)).fetchall()
+        except sqlite3.OperationalError:
+            # pas de recherche plein texte, ou requête invalide
+            motif = "%" + texte + "%"
+            lignes = db.execute("SELECT kind, path, name, detail FROM recherche WHERE path LIKE ? OR name LIKE ? OR detail LIKE ?",
+                                (motif, motif, motif)).fetchall()
+        for kind, path, name, detail in lignes:
+            print("%-10s %s: %s %s" % (kind, path, name, detail))
+
+    db.close()
+
+
+##
+# @brief ouvre un fichier d'entrée binaire, décompressé selon son extension (.gz ou .xz)
+#
+# @param nom
+#
+# @return 
+def ouvre_entree(nom):
+    if nom.endswith(".gz"):
+        return gzip.open(nom, "rb")
+    elif nom.endswith(".xz"):
+        return lzma.open(nom, "rb")
+    else:
+        return open(nom, "rb")
+
+
+##
+# @brief lit un datamodel sauvegardé par -modelraw
+#        les noeuds racines sont décodés au fil de la lecture, un seul à la fois est en mémoire
+#
+# @param nom
+#
+# @return générateur des noeuds racines (ValueError si le fichier n'est pas du json)
+def lit_model(nom):
+    def morceaux():
+        with ouvre_entree(nom) as f:
+            while True:
+                b = f.read(CHUNK_SIZE)
+                if not b: break
+                yield b
+    return json_stream(corrige_morceaux(morceaux()))
+
+
+##
+# @brief résumé d'un objet du datamodel pour la comparaison: fonctions, paramètres et sous-objets interdits
+#
+# @param node
+#
+# @return 
+def resume_node(node):
+
+    # les dictionnaires d'attributs sont gardés tels quels: leur comparaison ne dépend pas de l'ordre
+    fonctions = { }
+    for f in node.get('functions', []):
+        arguments = tuple((a['name'], a.get('type'), a.get('attributes')) for a in f.get('arguments', []))
+        fonctions[f['name']] = (f.get('type'), arguments, f.get('attributes'))
+
+    parametres = { }
+    for p in node.get('parameters', []):
+        parametres[p['name']] = (p.get('type'), p.get('attributes'))
+
+    interdits = frozenset(e['info'] for e in node.get('errors', []) if e['error'] == 13)
+
+    return fonctions, parametres, interdits
+
+
+##
+# @brief compare deux datamodels sauvegardés par -modelraw: -modeldiff A.json B.json
+#        les objets sont appariés par leur chemin (keyPath.key), les instances sont ignorées
+#
+# @param args
+#
+# @return 
+def model_diff(args):
+
+    if len(args) != 2:
+        error("Usage: -modeldiff A.json B.json")
+        return
+
+    # seul le résumé de A est gardé en mémoire pendant la lecture de B,
+    # chaque noeud racine est résumé dès qu'il est décodé
+    avant = { }
+    try:
+        for node, _ in model_walk(lit_model(args[0]), instances=False):
+            avant[node_path(node)] = resume_node(node)
+    except ValueError as e:
+        error("%s: mauvais json: %s" % (args[0], e))
+        return
+
+    ajouts = suppressions = modifications = 0
+
+    def compare(nom, a, b, affiche):
+        lignes = [ ]
+        for k in sorted(set(a) | set(b)):
+            if k not in a:
+                lignes.append("    + %s: %s" % (nom, affiche(k, b[k])))
+            elif k not in b:
+                lignes.append("    - %s: %s" % (nom, affiche(k, a[k])))
+            elif a[k] != b[k]:
+                lignes.append("    ~ %s: %s -> %s" % (nom, affiche(k, a[k]), affiche(k, b[k])))
+        return lignes
+
+    def fonction(k, v):
+        arguments = [ { 'name':a[0], 'type':a[1], 'attributes':a[2] or {} } for a in v[1] ]
+        s = "%s(%s)" % (k, signature_fonction({ 'arguments':arguments }))
+        if v[0]: s += " : " + str(v[0])
+        if v[2]: s += " " + str(v[2])
+        return s
+
+    def parametre(k, v):
+        s = "%s : %s" % (k, v[0])
+        if v[1]: s += " " + str(v[1])
+        return s
+
+    try:
+        for node, _ in model_walk(lit_model(args[1]), instances=False):
+            path = node_path(node)
+            b = resume_node(node)
+            a = avant.pop(path, None)
+
+            if a is None:
+                ajouts += 1
+                print("+ %s" % (path or "sysbus"))
+                continue
+
+            lignes = compare("function", a[0], b[0], fonction)
+            lignes += compare("parameter", a[1], b[1], parametre)
+            lignes += compare("forbidden", dict.fromkeys(a[2], ()), dict.fromkeys(b[2], ()), lambda k, v: k)
+            if lignes:
+                modifications += 1
+                print("~ %s" % (path or "sysbus"))
+                for i in lignes:
+                    print(i)
+    except ValueError as e:
+        error("%s: mauvais json: %s" % (args[1], e))
+        return
+
+    for path in sorted(avant):
+        suppressions += 1
+        print("- %s" % (path or "sysbus"))
+
+    print("objets: %d ajoutés, %d supprimés, %d modifiés" % (ajouts, suppressions, modifications))
 
 
 ##
@@ -350,40 +2664,31 @@ def requete_print(chemin, args=None, get=False):
 #
 # @param node
 # @param level
+# @param file fichier de sortie (sys.stdout par défaut)
 #
 # @return 
-def model(node, level=0):
+def model(node, level=0, file=None):
 
     def print_functions(node, indent=''):
         for f in node["functions"]:
-            aa = ""
-            for a in f['arguments']:
-                flag = ""
-                if 'attributes' in a and 'mandatory' in a['attributes'] and a['attributes']['mandatory']:
-                    pass
-                else:
-                    flag = "opt "
-                if 'attributes' in a and 'out' in a['attributes'] and a['attributes']['out']:
-                    flag = "out "
-                aa += ", " + flag + a['name']
-            print(indent + "function:", f['name'], "(" + aa[2:] + ")")
+            print(indent + "function:", f['name'], "(" + signature_fonction(f) + ")", file=file)
 
     def print_parameters(node, indent=''):
         if 'parameters' in node:
             for p in node['parameters']:
-                print(indent + "parameter:  %-20s : %-10s = '%s'" % (p['name'], p['type'], p['value']))
+                print(indent + "parameter:  %-20s : %-10s = '%s'" % (p['name'], p['type'], p['value']), file=file)
 
 
     # si ce n'est pas un datamodel, on sort
     if not 'objectInfo' in node:
-        pprint.pprint(node)
+        pprint.pprint(node, stream=file)
         return
 
     o = node['objectInfo']
 
-    print("")
-    print("=========================================== level", level)
-    print("OBJECT NAME: '%s.%s'  (name: %s)" % (o['keyPath'], o['key'], o['name'] ))
+    print("", file=file)
+    print("=========================================== level", level, file=file)
+    print("OBJECT NAME: '%s.%s'  (name: %s)" % (o['keyPath'], o['key'], o['name'] ), file=file)
 
     print_functions(node)
     print_parameters(node)
@@ -406,9 +2711,9 @@ def model(node, level=0):
 
         elif i == "errors":
             for e in node["errors"]:
-                print(e["error"],  e["info"], e["description"])
+                print(e["error"],  e["info"], e["description"], file=file)
         elif i == "instances":
-            print("-->", i, len(node[i]))
+            print("-->", i, len(node[i]), file=file)
             if i == "instances" and len(node[i])>0:
                 k = 0
                 for j in node[i]:
@@ -419,19 +2724,46 @@ def model(node, level=0):
                     #print(j)
                     #model(j, 99)
 
-                    print("instance %d: '%s.%s' (name: %s)" % (k, j['objectInfo']['keyPath'], j['objectInfo']['key'], j['objectInfo']['name']))
+                    print("instance %d: '%s.%s' (name: %s)" % (k, j['objectInfo']['keyPath'], j['objectInfo']['key'], j['objectInfo']['name']), file=file)
                     #print("j=",j)
                     #print("oi=", j['objectInfo'])
                     print_functions(j, indent="    ")
                     print_parameters(j, indent="    ")
                     pass
         else:
-            print("-->", i, len(node[i]))
+            print("-->", i, len(node[i]), file=file)
 
     for c in node['children']:
-        model(c, level + 1)
+        model(c, level + 1, file)
+
+
+
+
+##
+# @brief lit un fichier de l'interface web de la Livebox (ou de la cassette)
+#
+# @param nom scripts.js, version.txt...
+#
+# @return le contenu en bytes
+def lit_fichier_web(nom):
+    if cassette is not None and cassette.rejeu:
+        return cassette.lit("GET " + nom)[1]
+
+    session = requests.Session()
+    rep = session.get(URL_LIVEBOX + nom, timeout=(TRANSPORT['connect_timeout'], TRANSPORT['timeout']))
+    session.close()
+    transport_stats['bytes'] += len(rep.content)
+    if cassette is not None:
+        cassette.enregistre("GET " + nom, rep.status_code, rep.content)
+    return rep.content
 
 
+##
+# @brief lit scripts.js sur la Livebox (ou dans la cassette)
+#
+# @return le texte du fichier
+def lit_scripts_js():
+    return lit_fichier_web("scripts.js").decode('utf-8', errors='replace')
 
 
 ##
@@ -455,10 +2787,7 @@ def scan_sysbus(args):
             debug(1, "lecture de %s" % "scripts.js")
         else:
             # lecture scripts.js sur la Livebox
-            session = requests.Session()
-            rep = session.get(URL_LIVEBOX + "scripts.js")
-            s = rep.text
-            session.close()
+            s = lit_scripts_js()
             debug(1, "lecture de %s" % (URL_LIVEBOX + "scripts.js"))
 
     e = re.findall(r'"/?(sysbus[./].*)"', s)
@@ -498,10 +2827,7 @@ def extract_files(args):
             js = f.read()
             f.close()
     else:
-        session = requests.Session()
-        rep = session.get(URL_LIVEBOX + "scripts.js")
-        js = rep.text
-        session.close()
+        js = lit_scripts_js()
 
     t = []
     for i in re.finditer(r'\/\*jsdep.*\*\/', js):
@@ -540,19 +2866,42 @@ def extract_files(args):
 #   http://graphviz.readthedocs.org/
 #
 # @return 
-def load_graphviz():
+def load_graphviz(obligatoire=True):
     try:
         from graphviz import Digraph as dg
     except ImportError as e:
         error("erreur:", e)
         error("Installez https://github.com/xflr6/graphviz : pip3 install graphviz")
+        if not obligatoire:
+            return None
         sys.exit(2)
     return dg
 
 
 
+##
+# @brief ouvre un fichier de sortie binaire, compressé selon son extension (.gz ou .xz)
+#
+# @param nom
+# @param fichier fichier réellement écrit (temporaire), nom par défaut
+#
+# @return 
+def ouvre_sortie(nom, fichier=None):
+    fichier = fichier or nom
+    if nom.endswith(".gz"):
+        return gzip.open(fichier, "wb")
+    elif nom.endswith(".xz"):
+        return lzma.open(fichier, "wb")
+    else:
+        return open(fichier, "wb")
+
+
 ##
 # @brief dumpe dans un fichier le datamodel, à partir d'un noeud ou depuis la racine
+#        le modèle est écrit au fil de la réception, compressé si le fichier se termine par .gz ou .xz
+#        le modèle est écrit dans un fichier temporaire, qui ne remplace le fichier de sortie que si
+#        le téléchargement a réussi: un échec ou une interruption laisse intact l'instantané précédent
+#        le modèle est toujours demandé à la Livebox, sans passer par le cache: les valeurs sont celles du moment
 #
 # @param chemin
 # @param prof
@@ -561,18 +2910,43 @@ def load_graphviz():
 # @return 
 def model_raw_cmd(chemin, prof=None, out=None):
 
-    r = requete(chemin, prof, get=True, raw=True)
+    out = out or "model.json"
+    n = 0
+    affiche = 0
+    debut = b''
+    ok = False
 
-    if not r is None:
-        with open(out or "model.json", "wb") as f:
-            f.write(r)
-            f.close()
-        debug(1, "modèle écrit dans", out or "model.json")
+    tmp = out + ".tmp"
+    code, morceaux = requete_stream(chemin, prof)
+    try:
+        with ouvre_sortie(out, tmp) as f:
+            for b in morceaux:
+                if len(debut) < 64:
+                    debut += b[:64]
+                f.write(b)
+                n += len(b)
+
+                if time.time() - affiche > 0.2:
+                    affiche = time.time()
+                    sys.stderr.write("\rmodèle: %d octets reçus" % n)
+                    sys.stderr.flush()
+        ok = n > 0 and code == 200 and not reponse_en_erreur(debut)
+        if ok:
+            os.replace(tmp, out)
+    finally:
+        if os.path.exists(tmp):
+            os.remove(tmp)
+
+    if ok:
+        sys.stderr.write("\rmodèle: %d octets reçus\n" % n)
+        debug(1, "modèle écrit dans", out)
+    elif n > 0:
+        sys.stderr.write("\n")
+        error("modèle non accessible: HTTP %d, %s" % (code, debut.decode('utf-8', errors='replace')))
     else:
         error("modèle non accessible")
 
 
-
 ##
 # @brief crée un diagramme de classe UML avec plantuml
 #
@@ -712,13 +3086,10 @@ def open_file_in_os(filename):
 # @return 
 def model_uml_cmd(chemin, prof=None, out=None):
 
-    model = requete(chemin, prof, get=True, raw=True)
-    if not model:
+    model = next(iter(model_get(chemin, prof) or [ ]), None)
+    if model is None:
         return
 
-    model = model.decode('utf-8', errors='replace')
-    model = json.loads(model)
-
     plants = []
 
     fmt = os.path.splitext(out)[1][1:] if out else "svg"
@@ -729,7 +3100,7 @@ def model_uml_cmd(chemin, prof=None, out=None):
     if model['objectInfo']['keyPath'] == "" and model['objectInfo']['key'] == "":
 
         if not os.path.isdir("models"):
-            debug(2, "créatoin répertoire: " % "models")
+            debug(2, "création répertoire:", "models")
             os.makedirs("models")
 
         # on crée des diagrammes par top-level objects, sinon c'est trop gros
@@ -777,13 +3148,38 @@ def model_uml_cmd(chemin, prof=None, out=None):
 #
 # @return 
 def MIBs_table_cmd(output_html=False):
-    intf = set()
-    mibs = set()
-
-    r = requete("NeMo.Intf.lo:getMIBs", { "traverse": "all" })
+    if instantane is not None:
+        r = instantane.reponse()
+    else:
+        r = requete("NeMo.Intf.lo:getMIBs", { "traverse": "all" })
     if r is None or not 'status' in r: return
 
-    r = r['status']
+    details = None
+    if output_html:
+        intf = sorted(set(i for m in r['status'].values() for i in m))
+        if instantane is not None:
+            # hors ligne: les paramètres d'une interface sont ceux de toutes ses MIBs
+            details = { i: { 'status': { k: v for m in r['status'].values() if i in m for k, v in m[i].items() } } for i in intf }
+        else:
+            # les détails de toutes les interfaces en une seule passe
+            details = requete_batch([ ("NeMo.Intf.%s:get" % i, None) for i in intf ], silent=True)
+            details = { i: rr for i, (rr, _) in zip(intf, details) }
+
+    MIBs_table(r['status'], output_html, details)
+
+
+##
+# @brief affiche la table des MIBs par interface
+#
+# @param r résultat de getMIBs traverse=all: { mib: { interface: valeurs } }
+# @param output_html table HTML (sinon markdown)
+# @param details résultat de NeMo.Intf.<intf>:get par interface, pour la table HTML
+# @param file
+#
+# @return
+def MIBs_table(r, output_html=False, details=None, file=None):
+    intf = set()
+    mibs = set()
 
     for m in r:
         mibs.add(m)
@@ -866,34 +3262,33 @@ function fenetre_close() {
 </head>
 <body>
 
-''')
+''', file=file)
 
-        print('<table id="t01">')
+        print('<table id="t01">', file=file)
 
         # la ligne d'entête
-        print('  <tr>')
-        print('    <th>%s</th>' % 'Intf')
+        print('  <tr>', file=file)
+        print('    <th>%s</th>' % 'Intf', file=file)
         for m in mibs:
-            print('    <th>%s</th>' % m)
-        print('  </tr>')
+            print('    <th>%s</th>' % m, file=file)
+        print('  </tr>', file=file)
 
         for i in intf:
-            print('  <tr>')
+            rr = (details or { }).get(i)
+            print('  <tr>', file=file)
 
             # la première colonne: le nom de l'interface
-            rr = requete("NeMo.Intf.%s:get" % i, silent=True)
             action = 'fenetre_close()'
             if not rr or 'status' not in rr:
                 x = '<div style="color:red;">' + i + '</div>'
             else:
                 # cellule cliquable pour afficher les détails
-                details = html.escape(pprint.pformat(rr['status']))
                 x = '\n<div id="%s" class="details" onclick="fenetre_close()">' % (i)
-                x += details
+                x += html.escape(pprint.pformat(rr['status']))
                 x += '</div>\n'
                 x += '<div style="color:darkblue;">' + i + '</div>'
                 action = 'fenetre(\'%s\')' % (i)
-            print('    <td onclick="%s">%s</td>' % (action, x))
+            print('    <td onclick="%s">%s</td>' % (action, x), file=file)
 
             # les autres colonnes: les MIBs
             for m in mibs:
@@ -913,13 +3308,13 @@ function fenetre_close() {
                 else:
                     # MIB absente pour l'interface
                     x = ""
-                print('    <td onclick="%s">%s</td>' % (action, x))
+                print('    <td onclick="%s">%s</td>' % (action, x), file=file)
             
-            print('  </tr>')
-        print('  </table>')
+            print('  </tr>', file=file)
+        print('  </table>', file=file)
 
-        print('</body>')
-        print('</html>')
+        print('</body>', file=file)
+        print('</html>', file=file)
 
     else:
         # affichage en markdown/texte
@@ -933,14 +3328,14 @@ function fenetre_close() {
             len_m = len(m)
             if len_m < 3: len_m = 3
             s += '{:^{len}}|'.format(m, len=len_m)
-        print(s)
+        print(s, file=file)
 
         s = "|:%s|" % ("-" * (len_intf - 1))
         for m in mibs:
             len_m = len(m)
             if len_m < 3: len_m = 3
             s += ":%s:|" % ("-" * (len_m - 2))
-        print(s)
+        print(s, file=file)
 
         for i in intf:
             s = "|{:{len}}|".format(i, len=len_intf)
@@ -958,78 +3353,927 @@ function fenetre_close() {
                     # MIB absente pour l'interface
                     x = ""
                 s += "{:^{len}}|".format(x, len=len_m)
-            print(s)
+            print(s, file=file)
+
+        pass
+
+
+##
+# @brief dumpe toutes les MIBs dans un sous-répertoire mibs au format pretty print Python et décodé
+#
+# @return 
+def MIBs_save_cmd():
+    # liste toutes les interfaces
+    intf = set()
+    r = requete("NeMo.Intf.lo:getIntfs", { "traverse": "all" })
+    if not r is None:
+        for i in r['status']:
+            intf.add(i)
+
+    # les datamodels et les MIBs de chaque interface sont demandés en parallèle
+    intf = sorted(intf)
+    resultats = requete_batch([ ('sysbus.NeMo.Intf.' + i, None, True) for i in intf ] +
+                              [ ('sysbus.NeMo.Intf.' + i + ':getMIBs', { "traverse": "this" }) for i in intf ])
+    modeles = [ r for r, _ in resultats[:len(intf)] ]
+    mibs = [ r for r, _ in resultats[len(intf):] ]
+
+    MIBs_save(intf, modeles, mibs)
+
+
+##
+# @brief écrit le datamodel (.dict, .model) et les MIBs (.mib) de chaque interface
+#
+# @param intf liste des interfaces
+# @param modeles datamodel de chaque interface (liste de noeuds)
+# @param mibs MIBs de chaque interface
+# @param rep répertoire
+#
+# @return
+def MIBs_save(intf, modeles, mibs, rep="mibs"):
+    if not os.path.isdir(rep):
+        os.makedirs(rep)
+
+    # dump les datamodels de chaque interface
+    for i, r in zip(intf, modeles):
+        if r is None: continue
+
+        # le modèle en json
+        with open(os.path.join(rep, i + ".dict"), "w") as f:
+            pprint.pprint(r, stream=f)
+            #json.dump(r, f, indent=4, separators=(',', ': '))
+            f.close()
+
+        # le modèle décodé
+        with open(os.path.join(rep, i + ".model"), "w") as f:
+            for j in r:
+                print("---------------------------------------------------------", file=f)
+                model(j, file=f)
+            f.close()
+
+    # dump le contenu des MIBs par interface
+    for i, r in zip(intf, mibs):
+        if r is None: continue
+        with open(os.path.join(rep, i + ".mib"), "w") as f:
+            pprint.pprint(r, stream=f)
+            f.close()
+
+
+def livebox_info():
+    (info, _), (wan, _), (trunks, _) = requete_batch([ ("DeviceInfo:get", None),
+                                                       ("NMC:getWANStatus", None),
+                                                       ("sysbus.VoiceService.VoiceApplication:listTrunks", None) ])
+    affiche_info(info, wan, trunks)
+
+
+##
+# @brief affiche les informations principales de la Livebox
+#
+# @param info résultat de DeviceInfo:get
+# @param wan résultat de NMC:getWANStatus
+# @param trunks résultat de VoiceService.VoiceApplication:listTrunks
+# @param file
+#
+# @return
+def affiche_info(info, wan, trunks, file=None):
+    result = info
+    print("%20s : %s" % ("SoftwareVersion", result['status']['SoftwareVersion']), file=file)
+    #print("%20s : %s" % ("UpTime", str(datetime.timedelta(seconds=int(result['status']['UpTime'])))))
+    print("%20s : %s  (NumberOfReboots: %s)" % ("UpTime", str(datetime.timedelta(seconds=int(result['status']['UpTime']))), result['status']['NumberOfReboots']), file=file)
+    print("%20s : %s" % ("ExternalIPAddress", result['status']['ExternalIPAddress']), file=file)
+
+    #result = requete("Devices.Device.lan:getFirstParameter", { "parameter": "IPAddress" })
+    #print("%20s : %s" % ("IPv4Address", result['status']))
+
+    #result = requete("NMC.IPv6:get") 
+    #print("%20s : %s" % ("IPv6Address", result['data']['IPv6Address']))
+
+    result = wan
+    print("%20s : %s" % ("IPv6DelegatedPrefix", result['data']['IPv6DelegatedPrefix'] if 'IPv6DelegatedPrefix' in result['data'] else 'n/a'), file=file)
+    print("%20s : %s" % ("IPv6Address", result['data']['IPv6Address']), file=file)
+
+    #result = requete("sysbus.Time:getTime")
+    #print("%20s : %s" % ("Time", result['data']['time']))
+
+    result = trunks
+    for i in result['status']:
+        for j in i['trunk_lines']:
+            if j['enable'] == "Enabled":
+                print("%20s : %s" % ("directoryNumber", j['directoryNumber']), file=file)
+
+
+##
+# @brief dernière collecte des métriques: (date, texte)
+exporter_cache = (0, None)
+exporter_lock = threading.Lock()
+exporter_intfs = None
+
+
+##
+# @brief formate des métriques au format texte de Prometheus
+#
+# @param metriques liste de tuples (nom, type, aide, labels, valeur)
+#
+# @return 
+def format_prometheus(metriques):
+
+    def label(v):
+        return str(v).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+    lignes = [ ]
+    vus = set()
+    for nom, type, aide, labels, valeur in sorted(metriques, key=lambda m: m[0]):
+        if nom not in vus:
+            vus.add(nom)
+            lignes.append("# HELP %s %s" % (nom, aide))
+            lignes.append("# TYPE %s %s" % (nom, type))
+        if labels:
+            l = ",".join('%s="%s"' % (k, label(v)) for k, v in sorted(labels.items()))
+            lignes.append("%s{%s} %s" % (nom, l, valeur))
+        else:
+            lignes.append("%s %s" % (nom, valeur))
+    return "\n".join(lignes) + "\n"
+
+
+##
+# @brief interroge la Livebox (requêtes simultanées) et retourne les métriques
+#
+# @return texte au format Prometheus
+def collecte_metriques():
+    global exporter_intfs
+
+    debut = time.time()
+
+    appels = [ ("NMC:getWANStatus", None),
+               ("NMC.Wifi:getStats", None),
+               ("Hosts:getDevices", None),
+               ("DeviceInfo:get", None) ]
+
+    # la liste des interfaces réseau n'est demandée qu'une fois
+    if exporter_intfs is None:
+        r = requete("NeMo.Intf.lo:getMIBs", { "traverse":"all", "mibs":"netdev" }, silent=True)
+        if r is not None and 'status' in r and 'netdev' in r['status']:
+            exporter_intfs = sorted(r['status']['netdev'])
+    intfs = exporter_intfs or [ ]
+    appels += [ ("NeMo.Intf.%s:getNetDevStats" % i, None) for i in intfs ]
+
+    resultats = requete_batch(appels, silent=True)
+    (wan, _), (wifi, _), (hosts, _), (info, _) = resultats[:4]
+
+    m = [ ]
+    ok = all(r is not None for r, _ in resultats[:4])
+    m.append(("livebox_up", "gauge", "toutes les requêtes ont abouti", None, 1 if ok else 0))
+
+    if wan and 'data' in wan:
+        d = wan['data']
+        m.append(("livebox_wan_up", "gauge", "lien WAN actif", None, 1 if d.get('LinkState') == "up" else 0))
+        m.append(("livebox_wan_info", "gauge", "état de la connexion WAN", {
+                    'link_type':d.get('LinkType', ""), 'link_state':d.get('LinkState', ""),
+                    'connection_state':d.get('ConnectionState', ""), 'protocol':d.get('Protocol', ""),
+                    'ip_address':d.get('IPAddress', "") }, 1))
+
+    if wifi and 'data' in wifi:
+        for k in ('RxBytes', 'TxBytes'):
+            if k in wifi['data']:
+                m.append(("livebox_wifi_%s_bytes_total" % k[:2].lower(), "counter", "octets Wi-Fi (NMC.Wifi:getStats)", None, wifi['data'][k]))
+
+    if hosts and 'status' in hosts:
+        actifs = sum(1 for h in hosts['status'] if h.get('active'))
+        m.append(("livebox_hosts", "gauge", "périphériques connus (Hosts:getDevices)", { 'active':"true" }, actifs))
+        m.append(("livebox_hosts", "gauge", "périphériques connus (Hosts:getDevices)", { 'active':"false" }, len(hosts['status']) - actifs))
+
+    if info and 'status' in info:
+        s = info['status']
+        m.append(("livebox_uptime_seconds", "gauge", "durée depuis le démarrage", None, s.get('UpTime', 0)))
+        m.append(("livebox_reboots_total", "counter", "nombre de redémarrages", None, s.get('NumberOfReboots', 0)))
+        m.append(("livebox_info", "gauge", "version de la Livebox", { 'software_version':s.get('SoftwareVersion', "") }, 1))
+
+    # compteurs des interfaces: RxBytes -> livebox_netdev_rx_bytes_total
+    for i, (r, _) in zip(intfs, resultats[4:]):
+        if r is None or not isinstance(r.get('status'), dict):
+            continue
+        for k, v in r['status'].items():
+            if isinstance(v, (int, float)) and not isinstance(v, bool):
+                nom = "livebox_netdev_" + re.sub(r'(?<!^)(?=[A-Z])', '_', k).lower() + "_total"
+                m.append((nom, "counter", "compteur %s de NeMo.Intf.<intf>:getNetDevStats" % k, { 'interface':i }, v))
+
+    for k in ('requests', 'bytes', 'retries', 'breaker_trips', 'breaker_rejects'):
+        m.append(("sysbus_transport_%s_total" % k, "counter", "compteur %s du transport" % k, None, transport_stats[k]))
+
+    m.append(("livebox_scrape_duration_seconds", "gauge", "durée de la collecte", None, "%.3f" % (time.time() - debut)))
+    return format_prometheus(m)
+
+
+##
+# @brief retourne les métriques, collectées au plus une fois par intervalle quel que soit le nombre de clients
+#
+# @param intervalle secondes
+#
+# @return 
+def metriques(intervalle):
+    global exporter_cache
+
+    with exporter_lock:
+        date, texte = exporter_cache
+        if texte is None or time.time() - date >= intervalle:
+            texte = collecte_metriques()
+            exporter_cache = (time.time(), texte)
+        else:
+            debug(2, "métriques en cache")
+        return texte
+
+
+##
+# @brief crée le serveur HTTP de l'exporteur Prometheus (/metrics)
+#
+# @param port
+# @param intervalle durée de validité des métriques collectées
+#
+# @return le serveur
+def exporter_server(port, intervalle=EXPORTER_INTERVAL):
+    import http.server
+    # modules utilisés par les threads du serveur
+    import requests, pickle
+
+    class exporter_handler(http.server.BaseHTTPRequestHandler):
+
+        def do_GET(self):
+            if self.path.split('?')[0] != "/metrics":
+                self.send_error(404)
+                return
+            try:
+                b = metriques(intervalle).encode('utf-8')
+            except Exception as e:
+                error("erreur:", e)
+                self.send_error(503, str(e))
+                return
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+            self.send_header("Content-Length", str(len(b)))
+            self.end_headers()
+            self.wfile.write(b)
+
+        def log_message(self, format, *args):
+            debug(1, "exporter:", format % args)
+
+    return http.server.ThreadingHTTPServer(('', port), exporter_handler)
+
+
+##
+# @brief répertoire des séries temporelles de la Livebox (une base par URL)
+#
+# @return 
+def ts_dir():
+    d = os.path.join(cache_dir(), "ts", hashlib.sha1(URL_LIVEBOX.encode('utf-8')).hexdigest()[:16])
+    if not os.path.isdir(d):
+        os.makedirs(d)
+    return d
+
+
+##
+# @brief encode une colonne d'entiers: delta du delta, zigzag puis varint
+#
+# @param valeurs
+#
+# @return bytes
+def ts_encode(valeurs):
+    b = bytearray()
+    v0 = d0 = 0
+    for v in valeurs:
+        d = v - v0
+        x = d - d0
+        v0, d0 = v, d
+        x = x << 1 if x >= 0 else (-x << 1) - 1
+        while x >= 0x80:
+            b.append((x & 0x7f) | 0x80)
+            x >>= 7
+        b.append(x)
+    return bytes(b)
+
+
+##
+# @brief décode une colonne encodée par ts_encode()
+#
+# @param b
+#
+# @return array d'entiers
+def ts_decode(b):
+    r = array.array('q')
+    v = d = 0
+    x = s = 0
+    for c in b:
+        x |= (c & 0x7f) << s
+        if c & 0x80:
+            s += 7
+            continue
+        d += x >> 1 if not x & 1 else -((x + 1) >> 1)
+        v += d
+        r.append(v)
+        x = s = 0
+    return r
+
+
+def ts_varint(x, b):
+    while x >= 0x80:
+        b.append((x & 0x7f) | 0x80)
+        x >>= 7
+    b.append(x)
+
+
+def ts_lit_varint(b, i):
+    x = s = 0
+    while True:
+        c = b[i]
+        i += 1
+        x |= (c & 0x7f) << s
+        if not c & 0x80:
+            return x, i
+        s += 7
+
+
+##
+# @brief ajoute un bloc à un fichier de séries
+#
+# bloc: taille, premier et dernier instant, nombre d'échantillons, identifiants des colonnes,
+# puis la colonne des instants et chaque colonne de valeurs (taille + ts_encode compressé)
+#
+# @param f fichier ouvert en ajout
+# @param temps array des instants (secondes)
+# @param colonnes { identifiant: array des valeurs }
+#
+# @return 
+def ts_ecrit_bloc(f, temps, colonnes):
+    corps = bytearray()
+    ts_varint(temps[0], corps)
+    ts_varint(temps[-1] - temps[0], corps)
+    ts_varint(len(temps), corps)
+    ts_varint(len(colonnes), corps)
+    for i in colonnes:
+        ts_varint(i, corps)
+    for c in [ temps ] + list(colonnes.values()):
+        z = zlib.compress(ts_encode(c))
+        ts_varint(len(z), corps)
+        corps += z
+
+    b = bytearray()
+    ts_varint(len(corps), b)
+    f.write(b + corps)
+
+
+##
+# @brief lit un fichier de séries
+#
+# seules les colonnes demandées sont décompressées, et les blocs hors de l'intervalle sont sautés
+#
+# @param fichier
+# @param ids identifiants des séries à lire (None pour toutes)
+# @param debut
+# @param fin
+#
+# @return { identifiant: (array des instants, array des valeurs) }
+def ts_lit(fichier, ids=None, debut=0, fin=float('inf')):
+    r = { }
+    with open(fichier, "rb") as f:
+        b = f.read()
+
+    i = 0
+    while i < len(b):
+        try:
+            taille, i = ts_lit_varint(b, i)
+        except IndexError:
+            break
+        if i + taille > len(b):
+            debug(1, "%s: bloc incomplet ignoré" % fichier)
+            break
+        suivant = i + taille
+
+        t0, i = ts_lit_varint(b, i)
+        dt, i = ts_lit_varint(b, i)
+        if t0 + dt < debut or t0 > fin:
+            i = suivant
+            continue
+        n, i = ts_lit_varint(b, i)
+        ncol, i = ts_lit_varint(b, i)
+        cols = [ ]
+        for _ in range(ncol):
+            c, i = ts_lit_varint(b, i)
+            cols.append(c)
+        if ids is not None and not any(c in ids for c in cols):
+            i = suivant
+            continue
+
+        lg, i = ts_lit_varint(b, i)
+        temps = ts_decode(zlib.decompress(b[i:i + lg]))
+        i += lg
+        a = bisect.bisect_left(temps, debut)
+        z = bisect.bisect_right(temps, fin)
+
+        for c in cols:
+            lg, i = ts_lit_varint(b, i)
+            if ids is None or c in ids:
+                v = ts_decode(zlib.decompress(b[i:i + lg]))
+                t_c, v_c = r.setdefault(c, (array.array('q'), array.array('q')))
+                t_c.extend(temps[a:z])
+                v_c.extend(v[a:z])
+            i += lg
+
+        i = suivant
+
+    return r
+
+
+##
+# @brief noms des séries enregistrées, l'indice dans la liste est l'identifiant utilisé dans les fichiers
+#
+# @param rep
+#
+# @return 
+def ts_series(rep):
+    try:
+        with open(os.path.join(rep, "series.json")) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return [ ]
+
+
+def ts_ecrit_series(rep, noms):
+    tmp = os.path.join(rep, "series.json.%d" % os.getpid())
+    with open(tmp, "w") as f:
+        json.dump(noms, f, indent=1)
+    os.replace(tmp, os.path.join(rep, "series.json"))
+
+
+##
+# @brief nom du fichier d'une journée (UTC) pour une résolution
+#
+# @param rep
+# @param t instant (s)
+# @param niveau 'raw', '1m' ou '1h'
+#
+# @return 
+def ts_fichier(rep, t, niveau):
+    return os.path.join(rep, time.strftime("%Y%m%d", time.gmtime(t)) + "." + niveau)
+
+
+##
+# @brief calcule les agrégats (dernière valeur par minute et par heure) des journées terminées,
+# et supprime les fichiers au-delà de leur durée de conservation
+#
+# @param rep
+#
+# @return 
+def ts_maintenance(rep):
+    aujourdhui = time.strftime("%Y%m%d", time.gmtime())
+
+    for nom in sorted(os.listdir(rep)):
+        jour, _, niveau = nom.partition(".")
+        if niveau != "raw" or jour >= aujourdhui:
+            continue
+        brut = os.path.join(rep, nom)
+        for n, pas in (('1m', 60), ('1h', 3600)):
+            agrege = os.path.join(rep, jour + "." + n)
+            if os.path.exists(agrege):
+                continue
+            debug(1, "agrégation %s -> %s" % (nom, jour + "." + n))
+            tmp = agrege + ".%d" % os.getpid()
+            with open(tmp, "wb") as f:
+                for c, (temps, valeurs) in sorted(ts_lit(brut).items()):
+                    t_a, v_a = array.array('q'), array.array('q')
+                    for t, v in zip(temps, valeurs):
+                        t = t - t % pas
+                        if len(t_a) > 0 and t_a[-1] == t:
+                            v_a[-1] = v
+                        else:
+                            t_a.append(t)
+                            v_a.append(v)
+                    if len(t_a) > 0:
+                        ts_ecrit_bloc(f, t_a, { c: v_a })
+            os.replace(tmp, agrege)
+
+    maintenant = time.time()
+    for nom in os.listdir(rep):
+        jour, _, niveau = nom.partition(".")
+        jours = TS_RETENTION.get(niveau, 0)
+        if jours <= 0:
+            continue
+        try:
+            t = calendar.timegm(time.strptime(jour, "%Y%m%d"))
+        except ValueError:
+            continue
+        if maintenant - t > (jours + 1) * 86400:
+            debug(1, "suppression de %s" % nom)
+            os.remove(os.path.join(rep, nom))
+
+
+##
+# @brief échantillonne périodiquement des champs numériques et les enregistre
+#
+# @param appels liste de (chemin, paramètres, regexp des champs ou None)
+# @param intervalle secondes
+# @param rep répertoire de la base
+#
+# @return 
+def ts_enregistre(appels, intervalle, rep):
+    noms = ts_series(rep)
+    ids = { n: i for i, n in enumerate(noms) }
+
+    temps = array.array('q')
+    colonnes = { }
+    jour = None
+
+    def vide():
+        if len(temps) == 0:
+            return
+        debug(2, "%d échantillons de %d séries" % (len(temps), len(colonnes)))
+        with open(ts_fichier(rep, temps[0], "raw"), "ab") as f:
+            ts_ecrit_bloc(f, temps, colonnes)
+        del temps[:]
+        colonnes.clear()
+
+    ts_maintenance(rep)
+    prochain = time.time()
+
+    # arrêt par kill ou systemd: les échantillons en attente sont écrits comme après un Ctrl-C
+    import signal
+    def arret(signum, frame):
+        raise KeyboardInterrupt
+    ancien = signal.signal(signal.SIGTERM, arret)
+
+    try:
+        while True:
+            resultats = requete_batch([ (c, p) for c, p, _ in appels ], silent=True)
+            t = int(time.time())
+
+            echantillon = { }
+            for (c, _, champs), (r, _) in zip(appels, resultats):
+                if r is None:
+                    continue
+                for k, v in aplatit(r).items():
+                    if type(v) is not int:
+                        continue
+                    k = re.sub(r'^(status|data)\.', '', k)
+                    if champs and not champs.search(k):
+                        continue
+                    echantillon[c + "#" + k] = v
+
+            nouveaux = [ n for n in echantillon if n not in ids ]
+            if nouveaux:
+                for n in nouveaux:
+                    ids[n] = len(noms)
+                    noms.append(n)
+                ts_ecrit_series(rep, noms)
+            echantillon = { ids[n]: v for n, v in echantillon.items() }
+
+            # un bloc par journée et par ensemble de séries
+            j = time.strftime("%Y%m%d", time.gmtime(t))
+            if j != jour or echantillon.keys() != colonnes.keys() or len(temps) >= TS_BLOC:
+                vide()
+                if jour is not None and j != jour:
+                    ts_maintenance(rep)
+                jour = j
+                colonnes.update((i, array.array('q')) for i in echantillon)
+
+            temps.append(t)
+            for i, v in echantillon.items():
+                colonnes[i].append(v)
+
+            prochain += intervalle
+            attente = prochain - time.time()
+            if attente < 0:
+                # en retard: on saute les échantillons manqués
+                prochain = time.time()
+                attente = 0
+            time.sleep(attente)
+
+    except KeyboardInterrupt:
+        pass
+
+    finally:
+        signal.signal(signal.SIGTERM, ancien)
+        vide()
+
+
+##
+# @brief interprète une durée: 90, 90s, 15m, 2h, 7d, 1w
+#
+# @param s
+#
+# @return secondes, None si ce n'est pas une durée
+def ts_duree(s):
+    m = re.match(r'^(\d+(?:\.\d+)?)([smhdw]?)$', s)
+    if m:
+        return float(m.group(1)) * { '':1, 's':1, 'm':60, 'h':3600, 'd':86400, 'w':604800 }[m.group(2)]
+    return None
+
+
+##
+# @brief interprète une date: durée écoulée (15m, 2h, 7d), date ISO ou secondes depuis l'epoch
+#
+# @param s
+#
+# @return secondes depuis l'epoch
+def ts_date(s):
+    if s == "now":
+        return time.time()
+    if re.match(r'^\d{9,}$', s):
+        return float(s)
+    d = ts_duree(s)
+    if d is not None:
+        return time.time() - d
+    return datetime.datetime.fromisoformat(s).timestamp()
+
+
+##
+# @brief calcule le débit (variation par seconde) des séries enregistrées par -tsrecord
+#
+# -tsquery motif [ depuis [ jusqu'à [ pas ] ] ]
+#
+# @param args
+#
+# @return 
+def ts_query(args):
+    if len(args) < 1:
+        error("Usage: -tsquery motif [ depuis [ jusqu'à [ pas ] ] ]")
+        return
+
+    motif = re.compile(args[0])
+    debut = ts_date(args[1]) if len(args) >= 2 else time.time() - 3600
+    fin = ts_date(args[2]) if len(args) >= 3 else time.time()
+    pas = ts_duree(args[3]) if len(args) >= 4 else None
+
+    rep = ts_dir()
+    noms = ts_series(rep)
+    ids = { i for i, n in enumerate(noms) if motif.search(n) }
+    if not ids:
+        error("aucune série ne correspond à", args[0])
+        return
+
+    # résolution selon le pas ou la durée demandée, la plus proche disponible pour chaque jour
+    duree = pas or (fin - debut)
+    if duree >= 3600 * (1 if pas else 24 * 7):
+        niveaux = ('1h', '1m', 'raw')
+    elif duree >= 60 * (1 if pas else 60 * 6):
+        niveaux = ('1m', 'raw', '1h')
+    else:
+        niveaux = ('raw', '1m', '1h')
+
+    donnees = { }
+    t = debut - debut % 86400
+    while t <= fin:
+        for n in niveaux:
+            fichier = ts_fichier(rep, t, n)
+            if os.path.exists(fichier):
+                debug(2, "lecture de", fichier)
+                for c, (temps, valeurs) in ts_lit(fichier, ids, debut, fin).items():
+                    t_c, v_c = donnees.setdefault(c, (array.array('q'), array.array('q')))
+                    t_c.extend(temps)
+                    v_c.extend(valeurs)
+                break
+        t += 86400
+
+    def increment(v0, v1):
+        # un compteur qui diminue a été remis à zéro
+        return v1 - v0 if v1 >= v0 else v1
+
+    for c in sorted(donnees, key=lambda c: noms[c]):
+        temps, valeurs = donnees[c]
+        if len(temps) < 2:
+            continue
+
+        if pas is None:
+            total = sum(increment(valeurs[k - 1], valeurs[k]) for k in range(1, len(temps)))
+            print("{:<60} {:>8} éch. {:>16.3f} /s".format(noms[c], len(temps), total / (temps[-1] - temps[0])))
+            continue
+
+        # débit par tranche de 'pas' secondes
+        total = 0
+        tranche = temps[0] - temps[0] % pas
+        t0 = temps[0]
+        for k in range(1, len(temps)):
+            if temps[k] >= tranche + pas:
+                if temps[k - 1] > t0:
+                    print("{} {} {:.3f}".format(datetime.datetime.fromtimestamp(tranche).strftime("%Y-%m-%d %H:%M:%S"),
+                                               noms[c], total / (temps[k - 1] - t0)))
+                tranche = temps[k] - temps[k] % pas
+                t0 = temps[k - 1]
+                total = 0
+            total += increment(valeurs[k - 1], valeurs[k])
+        if temps[-1] > t0:
+            print("{} {} {:.3f}".format(datetime.datetime.fromtimestamp(tranche).strftime("%Y-%m-%d %H:%M:%S"),
+                                       noms[c], total / (temps[-1] - t0)))
+
+
+##
+# @brief instantané de Hosts:getDevices mémorisé dans le cache, indexé par MAC, clientID, IP et nom
+#
+# Les recherches retournent les hosts dans l'ordre de la Livebox.
+#
+class hosts_index:
+
+    def __init__(self, ttl=None):
+        self.ttl = HOSTS_TTL if ttl is None else ttl
+        self.fichier = os.path.join(cache_dir(), "hosts-%s.json" % hashlib.sha1(URL_LIVEBOX.encode('utf-8')).hexdigest()[:16])
+        self.date = 0
+        self.hosts = { }
+        self.rang = { }                     # clé -> position dans la liste de la Livebox
+        self.index = { 'physAddress': { }, 'clientID': { }, 'ipAddress': { }, 'hostName': { } }
+
+        if self.ttl <= 0:
+            return
+        try:
+            with open(self.fichier) as f:
+                d = json.load(f)
+            self.date = d['date']
+            for k, h in d['hosts'].items():
+                self.ajoute(k, h)
+        except (OSError, ValueError, KeyError):
+            pass
+        self.rang = { k: i for i, k in enumerate(self.hosts) }
+
+
+    @staticmethod
+    def cle(v):
+        return str(v).lower()
+
+
+    def ajoute(self, k, h):
+        self.hosts[k] = h
+        for champ, index in self.index.items():
+            if h.get(champ):
+                index.setdefault(self.cle(h[champ]), set()).add(k)
+
+
+    def retire(self, k):
+        h = self.hosts.pop(k)
+        for champ, index in self.index.items():
+            if h.get(champ):
+                s = index.get(self.cle(h[champ]))
+                if s is not None:
+                    s.discard(k)
+                    if not s:
+                        del index[self.cle(h[champ])]
 
-        pass
 
+    ##
+    # @brief met à jour l'instantané s'il est plus vieux que le TTL
+    #
+    # La liste complète est toujours téléchargée (la Livebox n'a pas d'appel incrémental) :
+    # seule la réindexation locale se limite aux hosts modifiés. L'ordre de la Livebox est conservé.
+    #
+    # @param force ignore le TTL
+    #
+    # @return False si la requête a échoué
+    def rafraichit(self, force=False):
+        if not force and self.ttl > 0 and time.time() - self.date < self.ttl:
+            debug(2, "hosts en cache (%d)" % len(self.hosts))
+            return True
 
-##
-# @brief dumpe toutes les MIBs dans un sous-répertoire mibs au format pretty print Python et décodé
-#
-# @return 
-def MIBs_save_cmd():
-    # liste toutes les interfaces
-    intf = set()
-    r = requete("NeMo.Intf.lo:getIntfs", { "traverse": "all" })
-    if not r is None:
-        for i in r['status']:
-            intf.add(i)
+        r = requete("sysbus/Hosts:getDevices")
+        if r is None or not isinstance(r.get('status'), list):
+            return False
+
+        ordre = [ ]
+        changes = 0
+        for h in r['status']:
+            k = self.cle(h.get('physAddress') or h.get('Key') or h.get('clientID'))
+            ordre.append(k)
+            if self.hosts.get(k) != h:
+                if k in self.hosts:
+                    self.retire(k)
+                self.ajoute(k, h)
+                changes += 1
+        for k in set(self.hosts) - set(ordre):
+            self.retire(k)
+            changes += 1
+        self.hosts = { k: self.hosts[k] for k in ordre }
+        self.rang = { k: i for i, k in enumerate(ordre) }
+        debug(1, "hosts: %d réindexés sur %d" % (changes, len(self.hosts)))
+
+        self.date = time.time()
+        if self.ttl <= 0:
+            return True
+        try:
+            tmp = self.fichier + ".%d" % os.getpid()
+            with open(tmp, "w") as f:
+                json.dump({ 'date': self.date, 'hosts': self.hosts }, f)
+            os.replace(tmp, self.fichier)
+        except OSError as e:
+            debug(1, "cache des hosts:", str(e))
+        return True
 
-    if not os.path.isdir("mibs"):
-        os.makedirs("mibs")
 
-    # dump les datamodels de chaque interface
-    for i in intf:
-        r = requete('sysbus.NeMo.Intf.' + i, get=True)
-        if r is None: continue
+    ##
+    # @brief cherche les hosts par adresse MAC, clientID, adresse IP ou nom
+    #
+    # @param v
+    #
+    # @return liste des hosts, dans l'ordre de la Livebox
+    def cherche(self, v):
+        v = self.cle(v)
+        cles = set()
+        for index in self.index.values():
+            cles.update(index.get(v, ()))
+        return [ self.hosts[k] for k in sorted(cles, key=self.rang.get) ]
 
-        # le modèle en json
-        with open("mibs/" + i + ".dict", "w") as f:
-            pprint.pprint(r, stream=f)
-            #json.dump(r, f, indent=4, separators=(',', ': '))
-            f.close()
 
-        # le modèle décodé
-        with open("mibs/" + i + ".model", "w") as f:
-            for j in r:
-                print("---------------------------------------------------------", file=f)
-                model(j, file=f)
-            f.close()
+    def liste(self):
+        return list(self.hosts.values())
 
-    # dump le contenu des MIBs par interface
-    for i in intf:
-        r = requete('sysbus.NeMo.Intf.' + i + ':getMIBs', { "traverse": "this" })
-        if r is None: continue
-        with open("mibs/" + i + ".mib", "w") as f:
-            pprint.pprint(r, stream=f)
-            f.close()
 
+##
+# @brief lit une table déclarative (-dhcpsync, -fwsync) en CSV ou en JSON
+#
+# CSV: la première ligne donne les noms des colonnes, sinon elles sont prises dans l'ordre de 'colonnes'.
+# JSON: liste d'objets, ou objet { clé: valeur } / { clé: { ... } } dont la clé est la première colonne.
+# Les noms sont ramenés à ceux de 'colonnes' (sans tenir compte de la casse) ou de 'alias'.
+#
+# @param fichier
+# @param colonnes noms des colonnes
+# @param alias { nom en minuscules: nom de colonne }
+#
+# @return liste de dictionnaires
+def lit_table(fichier, colonnes, alias={ }):
+    noms = { c.lower(): c for c in colonnes }
+    noms.update(alias)
+
+    with open(fichier, encoding='utf-8') as f:
+        texte = f.read()
+
+    if texte.lstrip()[:1] in ('[', '{'):
+        d = json.loads(texte)
+        if isinstance(d, dict):
+            d = [ dict(v, **{ colonnes[0]: k }) if isinstance(v, dict) else { colonnes[0]: k, colonnes[1]: v } for k, v in d.items() ]
+        lignes = [ ]
+        for i in d:
+            lignes.append({ noms.get(k.lower(), k): v for k, v in i.items() })
+        return lignes
+
+    lignes = [ l for l in csv.reader(io.StringIO(texte)) if l and not l[0].lstrip().startswith('#') ]
+    if len(lignes) == 0:
+        return [ ]
+    if any(c.strip().lower() in noms for c in lignes[0]):
+        entete = [ noms.get(c.strip().lower(), c.strip()) for c in lignes.pop(0) ]
+    else:
+        entete = colonnes
+    return [ { k: v.strip() for k, v in zip(entete, l) } for l in lignes ]
 
-def livebox_info():
-    result = requete("DeviceInfo:get")
-    print("%20s : %s" % ("SoftwareVersion", result['status']['SoftwareVersion']))
-    #print("%20s : %s" % ("UpTime", str(datetime.timedelta(seconds=int(result['status']['UpTime'])))))
-    print("%20s : %s  (NumberOfReboots: %s)" % ("UpTime", str(datetime.timedelta(seconds=int(result['status']['UpTime']))), result['status']['NumberOfReboots']))
-    print("%20s : %s" % ("ExternalIPAddress", result['status']['ExternalIPAddress']))
 
-    #result = requete("Devices.Device.lan:getFirstParameter", { "parameter": "IPAddress" })
-    #print("%20s : %s" % ("IPv4Address", result['status']))
+##
+# @brief envoie des modifications simultanément et affiche le résultat de chacune
+#
+# @param modifs liste de tuples (libellé, chemin, paramètres)
+# @param dryrun affiche les modifications sans les envoyer
+#
+# @return liste des indices des modifications en échec
+def applique_modifs(modifs, dryrun=False):
+    if dryrun:
+        for libelle, _, _ in modifs:
+            print("(dryrun)", libelle)
+        return [ ]
+
+    echecs = [ ]
+    resultats = requete_batch([ (chemin, p) for _, chemin, p in modifs ], silent=True)
+    for i, ((libelle, _, _), (r, e)) in enumerate(zip(modifs, resultats)):
+        if e is None and r is not None and not r.get('errors') and r.get('status') is not False:
+            print(libelle)
+        else:
+            echecs.append(i)
+            error("échec:", libelle, e or (r or { }).get('errors'))
+    return echecs
 
-    #result = requete("NMC.IPv6:get") 
-    #print("%20s : %s" % ("IPv6Address", result['data']['IPv6Address']))
 
-    result = requete("NMC:getWANStatus")
-    print("%20s : %s" % ("IPv6DelegatedPrefix", result['data']['IPv6DelegatedPrefix'] if 'IPv6DelegatedPrefix' in result['data'] else 'n/a'))
-    print("%20s : %s" % ("IPv6Address", result['data']['IPv6Address']))
+##
+# @brief construit le libellé d'un device du graphe de topologie (-topo)
+#
+# @param node device retourné par Devices.Device.HGW:topology
+# @param simple seulement le nom
+#
+# @return 
+def topo_label(node, simple=False):
+
+    if simple:
+        return node['Name']
 
-    #result = requete("sysbus.Time:getTime")
-    #print("%20s : %s" % ("Time", result['data']['time']))
+    # éléments communs à tous les devices:
+    communs = set([ 'Tags', 'DiscoverySource', 'Key', 'Alternative', 'Active', 'Index', 'LastConnection',
+                    'Name', 'LastChanged', 'Names', 'DeviceType', 'Master', 'DeviceTypes' ])
 
-    result = requete("sysbus.VoiceService.VoiceApplication:listTrunks")
-    for i in result['status']:
-        for j in i['trunk_lines']:
-            if j['enable'] == "Enabled":
-                print("%20s : %s" % ("directoryNumber", j['directoryNumber']))
+    label = ""
+    for nom in ['Name', 'Index', 'DeviceType', 'LastConnection']:
+        if nom in node:
+            s = str(node[nom])
+            if s != "":
+                label += r"%s: %s\n" % (nom, s)
+    label += r"\n"
+
+    ignores = set(['ClientID', 'Ageing', 'IPAddressSource', 'VendorClassID' ])
+    for i, v in node.items():
+        if i in communs: continue
+        if i in ignores: continue
+        if type(v) is list or str(v) == "":
+            continue
+        label += r"%s: %s\n" % (i, str(v))
+
+    return label
 
 
 ##
@@ -1059,6 +4303,303 @@ def add_singles(parser):
         parser.add_argument('-' + i[0], help=i[1], dest='req_auth', action='store_const', const=i[2])
 
         
+##
+# @brief affiche la liste des hosts, un par ligne
+#
+# @param hosts liste des hosts (Hosts:getDevices)
+# @param file
+#
+# @return
+def affiche_hosts(hosts, file=None):
+    for host in hosts:
+        actif = " " if host['active'] else "*"
+        print("%-18s %-5s %c %-30s %s" % (host['physAddress'], host['layer2Interface'], actif, host['ipAddress'], host['hostName']), file=file)
+
+
+##
+# @brief affiche les noms des MIBs et des interfaces
+#
+# @return
+def affiche_mibs_intf(mibs, intf, file=None):
+    print(file=file)
+    print("MIBs (%d): %s" % (len(mibs), str(sorted(mibs))), file=file)
+    print(file=file)
+    print("Intf (%d): %s" % (len(intf), str(sorted(intf))), file=file)
+
+
+##
+# @brief dessine le graphe fonctionnel des interfaces (nemo_intf.gv)
+#
+# @param Digraph classe de graphviz
+# @param base MIB base de toutes les interfaces
+# @param view ouvre le graphe
+# @param directory répertoire de sortie
+#
+# @return
+def graphe_intf(Digraph, base, view=True, directory=None):
+    r = base
+
+    dot = Digraph(name='NeMo.Intf', format='svg', engine='dot')
+
+    dot.attr('node', fontname='Helvetica')
+    #dot.attr('node', fontname='Times-Roman')
+
+    for i, node in r.items():
+        #dot.attr('node', tooltip=v['Flags'] if 'Flags' in v else '')
+        if 'Enable' in node:
+            if node['Enable'] == True:
+                dot.node(i, shape='box')
+            else:
+                dot.node(i, shape='ellipse', color='lightgrey')
+        else:
+            dot.node(i, shape='box', color='lightgrey')
+
+    for i, v in r.items():
+        for j in v['LLIntf']:
+            dot.edge(i, j)
+
+    dot.render(filename="nemo_intf.gv", directory=directory, view=view)
+
+
+##
+# @brief dessine la topologie du réseau (devices.gv ou devices-simple.gv)
+#
+# @param Digraph classe de graphviz
+# @param r résultat de Devices.Device.HGW:topology
+# @param simpleTopo sans les détails
+# @param view ouvre le graphe
+# @param directory répertoire de sortie
+#
+# @return
+def graphe_topo(Digraph, r, simpleTopo=False, view=True, directory=None):
+
+    dot = Digraph(name='Devices', format='svg', engine='dot')
+
+    # oriente le graphe de gauche à droite
+    # plutôt que de haut en bas
+    dot.attr('graph', rankdir="LR")
+
+    ##
+    # @brief fonction récursive de création du graphe de topologie
+    #
+    # @param node
+    #
+    # @return
+    def traverse(node):
+        key = node['Key'].replace(':', '_')
+
+        dot.attr('node', shape="box")
+
+        dot.node(key, label=topo_label(node, simpleTopo), color="black" if node['Active'] else "lightgrey")
+
+        if 'Children' in node:
+            for j in node['Children']:
+                dot.edge(key, j['Key'].replace(':', '_'))
+                traverse(j)
+
+    for i in r:
+        traverse(i)
+
+    if simpleTopo:
+        dot.render(filename="devices-simple.gv", directory=directory, view=view)
+    else:
+        dot.render(filename="devices.gv", directory=directory, view=view)
+
+
+##
+# @brief affiche la progression de -dump sur stderr: étapes terminées et octets reçus ou écrits
+#
+class progression_dump:
+
+    def __init__(self, etapes):
+        self.lock = threading.Lock()
+        self.etapes = etapes
+        self.faites = 0
+        self.ecrits = 0
+        self.phase = "téléchargement"
+        self.affiche_date = 0
+
+
+    def affiche(self, fin=False):
+        if not fin and time.time() - self.affiche_date < 0.1:
+            return
+        self.affiche_date = time.time()
+        pct = 100 * self.faites // max(self.etapes, 1)
+        barre = "*" * (pct * 40 // 100)
+        sys.stderr.write("\rProgress : [%-40s] %3d%%  %s, %.1f Mo reçus, %.1f Mo écrits " % (
+                         barre.ljust(40, '-'), pct, self.phase, transport_stats['bytes'] / 1e6, self.ecrits / 1e6))
+        if fin:
+            sys.stderr.write("\n")
+        sys.stderr.flush()
+
+
+    def termine(self, ecrits=0):
+        with self.lock:
+            self.faites += 1
+            self.ecrits += ecrits
+        self.affiche()
+
+
+##
+# @brief exécute des fonctions en parallèle en affichant la progression
+#
+# @param taches dictionnaire nom: (fonction, arguments...)
+# @param progression
+# @param ecriture les fonctions retournent le nombre d'octets écrits, ajouté à la progression
+#
+# @return dictionnaire nom: résultat (None en cas d'erreur)
+def dump_parallele(taches, progression, ecriture=False):
+    import concurrent.futures
+
+    resultats = { }
+    with concurrent.futures.ThreadPoolExecutor(max_workers=BATCH_WORKERS) as executor:
+        futures = { executor.submit(f, *a): nom for nom, (f, *a) in taches.items() }
+        en_cours = set(futures)
+        while en_cours:
+            faits, en_cours = concurrent.futures.wait(en_cours, timeout=0.2)
+            for fu in faits:
+                nom = futures[fu]
+                try:
+                    resultats[nom] = fu.result()
+                except Exception as e:
+                    error("\nerreur %s: %s" % (nom, e))
+                    resultats[nom] = None
+                progression.termine((resultats[nom] or 0) if ecriture else 0)
+            progression.affiche()
+    return resultats
+
+
+##
+# @brief écrit un fichier de -dump avec une fonction d'affichage
+#
+# @param rep répertoire
+# @param nom nom du fichier
+# @param fonction appelée avec les arguments suivis de file=
+#
+# @return taille du fichier
+def dump_fichier(rep, nom, fonction, *args):
+    fichier = os.path.join(rep, nom)
+    with open(fichier, "w") as f:
+        fonction(*args, file=f)
+    return os.path.getsize(fichier)
+
+
+##
+# @brief télécharge en une fois les données de la Livebox et en produit tous les fichiers de dump-sysbus.sh
+#
+# Les données sont demandées simultanément sur la session (datamodel complet, getMIBs traverse=all,
+# getIntfs, topologie, hosts...), puis les fichiers sont écrits en parallèle à partir des mêmes
+# résultats en mémoire.
+#
+# @param rep répertoire de sortie
+#
+# @return
+def dump_livebox(rep):
+    if not os.path.isdir(rep):
+        os.makedirs(rep)
+
+    # modules utilisés par les threads de téléchargement et d'écriture
+    import requests, pickle, pprint, html, datetime
+    Digraph = load_graphviz(obligatoire=False)
+
+    # 1. téléchargement, une seule fois par donnée
+    # le datamodel est toujours demandé à la Livebox (le cache fige les valeurs des paramètres)
+    taches = { 'model': (requete, None, None, True, True),
+               'mibs': (requete, "NeMo.Intf.lo:getMIBs", { "traverse": "all" }),
+               'mibs_lo': (requete, "NeMo.Intf.lo:getMIBs", { "traverse": "this" }),
+               'intfs': (requete, "NeMo.Intf.lo:getIntfs", { "traverse": "all" }),
+               'topology': (requete, "Devices.Device.HGW:topology"),
+               'hosts': (requete, "Hosts:getDevices"),
+               'info': (requete, "DeviceInfo:get"),
+               'wan': (requete, "NMC:getWANStatus"),
+               'trunks': (requete, "VoiceService.VoiceApplication:listTrunks"),
+               'scripts.js': (lit_fichier_web, "scripts.js"),
+               'version.txt': (lit_fichier_web, "version.txt") }
+    progression = progression_dump(len(taches) + 1)
+    d = dump_parallele(taches, progression)
+
+    nodes = decode_reponse(d['model'], get=True) if d['model'] else None
+    mibs = d['mibs']['status'] if d['mibs'] and 'status' in d['mibs'] else { }
+    # les interfaces des MIBs (table HTML, comme -MIBs table) et celles de getIntfs (fichiers de mibs/)
+    intf_mibs = sorted(set(i for m in mibs.values() for i in m))
+    intf = sorted(d['intfs']['status']) if d['intfs'] and 'status' in d['intfs'] else intf_mibs
+
+    # datamodel de chaque interface: pris dans le modèle complet, demandé s'il en est absent (accès interdit depuis la racine)
+    modeles = { }
+    for i in intf:
+        for n in nodes or [ ]:
+            node = cherche_node(n, "NeMo.Intf." + i)
+            if node is not None:
+                modeles[i] = [ node ]
+                break
+    absents = [ i for i in intf if i not in modeles ]
+
+    # détails des interfaces (table HTML) et datamodels manquants, en une passe
+    resultats = requete_batch([ ("NeMo.Intf.%s:get" % i, None) for i in intf_mibs ] +
+                              [ ("sysbus.NeMo.Intf." + i, None, True) for i in absents ], silent=True)
+    details = { i: r for i, (r, _) in zip(intf_mibs, resultats) }
+    modeles.update((i, r) for i, (r, _) in zip(absents, resultats[len(intf_mibs):]))
+    progression.termine()
+
+    # les MIBs de chaque interface sont extraites de getMIBs traverse=all
+    mibs_intf = [ { 'status': { m: { i: v[i] } for m, v in mibs.items() if i in v } } for i in intf ]
+
+    # 2. écriture des fichiers en parallèle
+    def ecrit_brut(nom, contenu):
+        with open(os.path.join(rep, nom), "wb") as f:
+            f.write(contenu)
+        return len(contenu)
+
+    def ecrit_pprint(r, file):
+        pprint.pprint(r, stream=file)
+
+    def ecrit_model(nodes, file):
+        for i in nodes:
+            model(i, file=file)
+
+    def ecrit_mibs_save():
+        MIBs_save(intf, [ modeles.get(i) for i in intf ], mibs_intf, os.path.join(rep, "mibs"))
+        return sum(e.stat().st_size for e in os.scandir(os.path.join(rep, "mibs")) if e.is_file())
+
+    def graphes():
+        if 'base' in mibs:
+            graphe_intf(Digraph, mibs['base'], False, rep)
+        if d['topology'] and 'status' in d['topology']:
+            graphe_topo(Digraph, d['topology']['status'], True, False, rep)
+            graphe_topo(Digraph, d['topology']['status'], False, False, rep)
+        return 0
+
+    taches = { }
+    for nom in ('scripts.js', 'version.txt'):
+        if d[nom] is not None:
+            taches[nom] = (ecrit_brut, nom, d[nom])
+    if d['info']:
+        taches['status.txt'] = (dump_fichier, rep, "status.txt", ecrit_pprint, d['info'])
+        if d['wan'] and d['trunks']:
+            taches['info.txt'] = (dump_fichier, rep, "info.txt", affiche_info, d['info'], d['wan'], d['trunks'])
+    if d['hosts'] and 'status' in d['hosts']:
+        taches['hosts.txt'] = (dump_fichier, rep, "hosts.txt", affiche_hosts, d['hosts']['status'])
+    if nodes:
+        taches['model.txt'] = (dump_fichier, rep, "model.txt", ecrit_model, nodes)
+        taches['model.json'] = (ecrit_brut, "model.json", d['model'])
+    if d['mibs']:
+        taches['mibs_all'] = (dump_fichier, rep, "mibs_all", ecrit_pprint, d['mibs'])
+        # comme -MIBs show: les MIBs de lo seule
+        mibs_lo = d['mibs_lo']['status'].keys() if d['mibs_lo'] and 'status' in d['mibs_lo'] else mibs.keys()
+        taches['mibs.txt'] = (dump_fichier, rep, "mibs.txt", affiche_mibs_intf, mibs_lo, intf)
+        taches['mibs-table.md'] = (dump_fichier, rep, "mibs-table.md", MIBs_table, mibs, False)
+        taches['mibs-table.html'] = (dump_fichier, rep, "mibs-table.html", MIBs_table, mibs, True, details)
+        taches['mibs'] = (ecrit_mibs_save, )
+    if Digraph is not None:
+        taches['graphes'] = (graphes, )
+
+    progression.etapes += len(taches)
+    progression.phase = "écriture"
+    dump_parallele(taches, progression, ecriture=True)
+    progression.phase = "terminé"
+    progression.affiche(fin=True)
+
+
 ##
 # @brief mes commandes
 #
@@ -1089,11 +4630,10 @@ def add_commands(parser):
 
     def time_cmd(args):
         """ affiche l'heure de la Livebox """
-        result = requete("Time:getTime")
+        (result, _), (zone, _) = requete_batch([ ("Time:getTime", None), ("Time:getLocalTimeZoneName", None) ])
         if result:
             t = result['data']['time']
-            result = requete("Time:getLocalTimeZoneName")
-            tz = result['data']['timezone']
+            tz = zone['data']['timezone']
             print("Livebox time: {} ({})".format(t, tz))
 
     #
@@ -1150,36 +4690,68 @@ def add_commands(parser):
         if len(args) >= 1:
             if args[0] == "all":
                 leases = requete('sysbus.DHCPv4.Server.Pool.default:getStaticLeases')
-                for lease in leases['status']:
-                    mac = lease['MACAddress']
-                    requete_print('sysbus/DHCPv4/Server/Pool/default:deleteStaticLease', {"MACAddress": mac})
-
+                macs = [ lease['MACAddress'] for lease in leases['status'] ]
             else:
-                for i in args:
-                    mac = str.upper(i)
-                    print("del dhcp", mac)
-                    requete_print('sysbus/DHCPv4/Server/Pool/default:deleteStaticLease', {"MACAddress": mac})
+                macs = [ str.upper(i) for i in args ]
+            applique_modifs([ ("del dhcp %s" % mac, 'sysbus/DHCPv4/Server/Pool/default:deleteStaticLease', {"MACAddress": mac})
+                              for mac in macs ])
         else:
             error("Usage: %s -deldchp MACAddress..." % sys.argv[0])
+
+    #
+    def dhcpsync_cmd(args):
+        """ synchronise les DHCP statiques avec un fichier CSV ou JSON: -dhcpsync fichier [ dryrun ] """
+        if len(args) < 1:
+            error("Usage: %s -dhcpsync fichier [ dryrun ]" % sys.argv[0])
+            return
+        dryrun = len(args) >= 2 and args[1] == "dryrun"
+
+        voulus = OrderedDict()
+        for l in lit_table(args[0], [ 'MACAddress', 'IPAddress' ], { 'mac': 'MACAddress', 'ip': 'IPAddress' }):
+            voulus[l['MACAddress'].upper()] = l['IPAddress']
+
+        leases = requete('sysbus.DHCPv4.Server.Pool.default:getStaticLeases')
+        if leases is None:
+            return
+        actuels = { l['MACAddress'].upper(): l['IPAddress'] for l in leases['status'] }
+
+        # un bail modifié est supprimé puis ajouté: les suppressions passent d'abord,
+        # une adresse IP pouvant passer d'une MAC à une autre
+        supprimes = [ mac for mac in actuels if mac not in voulus ]
+        modifies = [ mac for mac in actuels if mac in voulus and voulus[mac] != actuels[mac] ]
+        ajoutes = [ mac for mac in voulus if mac not in actuels ]
+
+        a_supprimer = supprimes + modifies
+        echecs = applique_modifs([ ("- %-18s %s" % (mac, actuels[mac]), 'sysbus/DHCPv4/Server/Pool/default:deleteStaticLease', {"MACAddress": mac})
+                                   for mac in a_supprimer ], dryrun)
+
+        # un bail modifié dont la suppression a échoué est laissé tel quel
+        garde = set(a_supprimer[i] for i in echecs)
+        a_ajouter = [ mac for mac in modifies if mac not in garde ] + ajoutes
+        echecs_ajout = applique_modifs([ ("+ %-18s %s" % (mac, voulus[mac]), 'sysbus/DHCPv4/Server/Pool/default:addStaticLease', {"MACAddress": mac, "IPAddress": voulus[mac]})
+                                         for mac in a_ajouter ], dryrun)
+
+        # un bail modifié supprimé mais pas ajouté de nouveau n'existe plus sur la Livebox
+        perdus = [ a_ajouter[i] for i in echecs_ajout if a_ajouter[i] in actuels ]
+        for mac in perdus:
+            error("bail perdu: %s (%s supprimé, %s non ajouté)" % (mac, actuels[mac], voulus[mac]))
+
+        print("%d ajoutés, %d modifiés, %d supprimés, %d inchangés, %d échecs, %d perdus" % (
+              len(ajoutes), len(modifies), len(supprimes), len(voulus) - len(ajoutes) - len(modifies),
+              len(echecs) + len(echecs_ajout), len(perdus)))
         
     #
     def hosts_cmd(args):
-        """ affiche la liste des hosts """
-        r = requete("sysbus/Hosts:getDevices")
+        """ affiche la liste des hosts: -hosts [ MAC | clientID | IP | nom ... ] """
+        hosts = hosts_index()
+        if not hosts.rafraichit():
+            return
         if len(args) > 0:
-            for i in range(0, len(args)):
-                for host in r['status']:
-                    if host['physAddress'].lower() == args[i].lower():
-                        pprint.pprint(host)
-                    elif host['clientID'].lower() == args[i].lower():
-                        pprint.pprint(host)
-                    elif host['ipAddress'] == args[i]:
-                        pprint.pprint(host)
+            for i in args:
+                for host in hosts.cherche(i):
+                    pprint.pprint(host)
         else:
-            #pprint.pprint(r['status'])
-            for host in r['status']:
-                actif = " " if host['active'] else "*"
-                print("%-18s %-5s %c %-30s %s" % (host['physAddress'], host['layer2Interface'], actif, host['ipAddress'], host['hostName']))
+            affiche_hosts(hosts.liste())
 
     #
     def ipv6_cmd(args):
@@ -1213,7 +4785,7 @@ def add_commands(parser):
         if len(args) >= 2:
             prof = args[1]
 
-        r = requete(chemin, prof, get=True)
+        r = model_get(chemin, prof)
 
         #pprint.pprint(r)
         #print(json.dumps(r))
@@ -1223,6 +4795,97 @@ def add_commands(parser):
                 model(i)
 
 
+    def modelcache_cmd(args):
+        """ gère le cache du datamodel: -modelcache [ info | clear | refresh ] """
+
+        action = args[0] if len(args) > 0 else "info"
+
+        if action == "clear" or action == "refresh":
+            for i in os.listdir(cache_dir()):
+                if (i.startswith("model-") and i.endswith(".json")) or i.startswith("firmware-"):
+                    debug(1, "suppression de", i)
+                    os.remove(os.path.join(cache_dir(), i))
+
+        if action == "refresh":
+            for b in model_complet_morceaux():
+                pass
+
+        if action in ("info", "refresh"):
+            fichier = model_cache_file()
+            print("firmware: %s" % firmware_version())
+            if fichier and os.path.exists(fichier):
+                print("cache: %s (%d octets)" % (fichier, os.path.getsize(fichier)))
+            else:
+                print("cache: vide")
+
+
+    def modelindex_cmd(args):
+        """ indexe le datamodel dans une base SQLite pour -find: -modelindex [ path ] """
+        chemin = 'sysbus'
+        if len(args) >= 1:
+            chemin = args[0] if args[0].startswith("sysbus") else chemin + '.' + args[0]
+
+        r = model_get(chemin)
+        if r is None:
+            error("modèle non accessible")
+            return
+
+        n = model_index(r, model_index_file())
+        print("%d objets indexés dans %s" % (n, model_index_file()))
+
+
+    def events_cmd(args):
+        """ affiche les événements des objets en lignes json: -events Hosts NMC NeMo.Intf.data ... """
+        if len(args) == 0:
+            error("Usage: -events objet...")
+            return
+        try:
+            for e in evenements(args):
+                print(json.dumps(e, ensure_ascii=False))
+                sys.stdout.flush()
+        except KeyboardInterrupt:
+            pass
+
+
+    def exporter_cmd(args):
+        """ exporteur Prometheus sur http://:PORT/metrics: -exporter PORT [ intervalle ] """
+        if len(args) < 1:
+            error("Usage: -exporter PORT [ intervalle ]")
+            return
+        server = exporter_server(int(args[0]), float(args[1]) if len(args) >= 2 else EXPORTER_INTERVAL)
+        print("exporteur Prometheus sur http://%s:%d/metrics" % (socket.getfqdn(), server.server_port))
+        sys.stdout.flush()
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            server.server_close()
+
+
+    def tsrecord_cmd(args):
+        """ enregistre des compteurs: -tsrecord [ intervalle ] [ requête[#champs] ... ] """
+        intervalle = 1
+        if len(args) > 0 and ts_duree(args[0]) is not None:
+            intervalle = ts_duree(args.pop(0))
+
+        if len(args) == 0:
+            args = [ "NMC.Wifi:getStats",
+                     'NeMo.Intf.lo.getMIBs(traverse="all",mibs="netdev")#Bytes|Packets|Errors|Dropped',
+                     "DeviceInfo:get#UpTime|NumberOfReboots" ]
+
+        appels = [ ]
+        for a in args:
+            a, _, champs = a.partition("#")
+            chemin, parameters = analyse_requete(a, [ ])
+            appels.append((chemin, parameters or None, re.compile(champs) if champs else None))
+
+        rep = ts_dir()
+        print("enregistrement dans %s toutes les %g s" % (rep, intervalle))
+        sys.stdout.flush()
+        ts_enregistre(appels, intervalle, rep)
+
+
     def object_cmd(args):
         """ affiche l'objet sans descendre dans le datamodel """
         if len(args) >= 1:
@@ -1283,10 +4946,7 @@ def add_commands(parser):
                     for i in r['status']:
                         mibs.add(i)
 
-                print()
-                print("MIBs (%d): %s" % (len(mibs), str(sorted(mibs))))
-                print()
-                print("Intf (%d): %s" % (len(intf), str(sorted(intf))))
+                affiche_mibs_intf(mibs, intf)
 
             elif args[0] == "table":
                 html = (len(args) >= 2 and args[1] == "html")
@@ -1390,6 +5050,71 @@ def add_commands(parser):
                     print("Erreur...")
                     print(r)
 
+    def fwsync_cmd(args):
+        """ synchronise les redirections de ports avec un fichier CSV ou JSON: -fwsync fichier [ dryrun ] """
+        if len(args) < 1:
+            error("Usage: %s -fwsync fichier [ dryrun ]" % sys.argv[0])
+            return
+        dryrun = len(args) >= 2 and args[1] == "dryrun"
+
+        # noms des paramètres de setPortForwarding, getPortForwarding les retourne avec une majuscule
+        colonnes = [ 'id', 'destinationIPAddress', 'externalPort', 'internalPort', 'protocol', 'origin',
+                     'description', 'sourceInterface', 'sourcePrefix', 'enable', 'persistent' ]
+        protocoles = { 'tcp': "6", 'udp': "17", 'tcp,udp': "6,17", 'both': "6,17" }
+
+        voulues = OrderedDict()
+        for l in lit_table(args[0], colonnes, { 'ip': 'destinationIPAddress', 'port': 'externalPort' }):
+            regle = { 'origin': "webui", 'sourceInterface': "data", 'sourcePrefix': "", 'enable': True, 'persistent': True }
+            regle.update((k, v) for k, v in l.items() if v != "" or k == 'sourcePrefix')
+            if 'id' not in regle:
+                regle['id'] = regle.get('description')
+            regle.setdefault('description', regle['id'])
+            regle.setdefault('internalPort', regle.get('externalPort'))
+            if regle['id'] is None or not regle.get('destinationIPAddress') or not regle.get('externalPort'):
+                error("règle incomplète:", l)
+                return
+            for k in ('enable', 'persistent'):
+                if isinstance(regle[k], str):
+                    regle[k] = regle[k].lower() in ('1', 'true', 'yes', 'oui')
+            regle['protocol'] = protocoles.get(str(regle.get('protocol', "6")).lower().replace(' ', ''), str(regle.get('protocol', "6")))
+            for k in ('externalPort', 'internalPort'):
+                regle[k] = str(regle[k])
+            voulues[(regle['origin'], regle['id'])] = regle
+
+        r = requete('sysbus.Firewall:getPortForwarding')
+        if r is None:
+            return
+        actuelles = { }
+        for cle, v in r['status'].items():
+            regle = { k[0].lower() + k[1:]: v for k, v in v.items() }
+            # la Livebox préfixe l'identifiant par l'origine: webui_ssh pour la règle ssh
+            origine = regle.get('origin') or cle.split('_', 1)[0]
+            regle['origin'] = origine
+            regle['id'] = cle[len(origine) + 1:] if cle.startswith(origine + "_") else cle
+            actuelles[(origine, regle['id'])] = regle
+
+        # seules les règles des origines présentes dans le fichier sont gérées (pas celles d'UPnP par exemple)
+        # seuls les champs retournés par getPortForwarding sont comparés (pas persistent)
+        origines = set(o for o, _ in voulues)
+        supprimees = [ k for k in actuelles if k[0] in origines and k not in voulues ]
+        modifiees = [ k for k in voulues if k in actuelles
+                      and any(c in actuelles[k] and str(actuelles[k][c]).lower() != str(v).lower() for c, v in voulues[k].items()) ]
+        ajoutees = [ k for k in voulues if k not in actuelles ]
+
+        def libelle(signe, regle):
+            return "%s %s/%-16s %s:%s -> %s:%s" % (signe, regle.get('origin'), regle.get('id'), regle.get('protocol'),
+                                                 regle.get('externalPort'), regle.get('destinationIPAddress'), regle.get('internalPort'))
+
+        modifs = [ (libelle("-", actuelles[k]), 'sysbus.Firewall:deletePortForwarding',
+                    { "id": k[1], "origin": k[0], "destinationIPAddress": actuelles[k].get('destinationIPAddress') })
+                   for k in supprimees ]
+        modifs += [ (libelle("~" if k in actuelles else "+", voulues[k]), 'sysbus.Firewall:setPortForwarding', voulues[k])
+                    for k in modifiees + ajoutees ]
+        echecs = applique_modifs(modifs, dryrun)
+
+        print("%d ajoutées, %d modifiées, %d supprimées, %d inchangées, %d échecs" % (
+              len(ajoutees), len(modifiees), len(supprimees), len(voulues) - len(ajoutees) - len(modifiees), len(echecs)))
+
     def graph_cmd(args):
         """ affiche le graphe fonctionnel des interfaces """
 
@@ -1403,7 +5128,9 @@ def add_commands(parser):
                 args.remove(i)
                 break
 
-        if len(args) > 0:
+        if instantane is not None:
+            r = instantane.reponse()
+        elif len(args) > 0:
             if len(args) >= 2:
                 r = requete('NeMo.Intf.%s:getMIBs' % args[0], { "traverse":args[1], "mibs":"base" })
             else:
@@ -1412,28 +5139,7 @@ def add_commands(parser):
             r = requete('NeMo.Intf.lo:getMIBs', { "traverse":"all", "mibs":"base" })
         if r is None: return
         if not 'status' in r or not 'base' in r['status']: return
-        r = r['status']['base']
-
-        dot = Digraph(name='NeMo.Intf', format='svg', engine='dot')
-
-        dot.attr('node', fontname='Helvetica')
-        #dot.attr('node', fontname='Times-Roman')
-
-        for i, node in r.items():
-            #dot.attr('node', tooltip=v['Flags'] if 'Flags' in v else '')
-            if 'Enable' in node:
-                if node['Enable'] == True:
-                    dot.node(i, shape='box')
-                else:
-                    dot.node(i, shape='ellipse', color='lightgrey')
-            else:
-                dot.node(i, shape='box', color='lightgrey')
-
-        for i, v in r.items():
-            for j in v['LLIntf']:
-                dot.edge(i, j)
-
-        dot.render(filename="nemo_intf.gv", view=view)
+        graphe_intf(Digraph, r['status']['base'], view)
 
 
     ##
@@ -1454,67 +5160,25 @@ def add_commands(parser):
                 args.remove(i)
                 break
 
-        r = requete("Devices.Device.HGW:topology")
+        if instantane is not None:
+            r = instantane.reponse()
+        else:
+            r = requete("Devices.Device.HGW:topology")
         if r is None or not 'status' in r: return
-        r = r['status']
 
         simpleTopo = args[0] == "simple" if len(args) > 0 else False
-        
-        dot = Digraph(name='Devices', format='svg', engine='dot')
-
-        # oriente le graphe de gauche à droite
-        # plutôt que de haut en bas
-        dot.attr('graph', rankdir="LR")
-
-        ##
-        # @brief fonction récursive de création du graphe de topologie
-        #
-        # @param node
-        #
-        # @return 
-        def traverse(node):
-            key = node['Key'].replace(':', '_')
-
-            dot.attr('node', shape="box")
-
-            # éléments communs à tous les devices:
-            communs = set([ 'Tags', 'DiscoverySource', 'Key', 'Alternative', 'Active', 'Index', 'LastConnection',
-                            'Name', 'LastChanged', 'Names', 'DeviceType', 'Master', 'DeviceTypes' ])
-
-            if simpleTopo:
-                label = node['Name']
-            else:
-
-                label = ""
-                for nom in ['Name', 'Index', 'DeviceType', 'LastConnection']:
-                    if nom in node:
-                        s = str(node[nom])
-                        if s != "":
-                            label += r"%s: %s\n" % (nom, s)
-                label += r"\n"
-
-                ignores = set(['ClientID', 'Ageing', 'IPAddressSource', 'VendorClassID' ])
-                for i, v in node.items():
-                    if i in communs: continue
-                    if i in ignores: continue
-                    if type(v) is list or str(v) == "":
-                        continue
-                    label += r"%s: %s\n" % (i, str(v))
-
-            dot.node(key, label=label, color="black" if node['Active'] else "lightgrey")
+        graphe_topo(Digraph, r['status'], simpleTopo, view)
 
-            if 'Children' in node:
-                for j in node['Children']:
-                    dot.edge(key, j['Key'].replace(':', '_'))
-                    traverse(j)
 
-        for i in r:
-            traverse(i)
-
-        if simpleTopo:
-            dot.render(filename="devices-simple.gv", view=view)
-        else:
-            dot.render(filename="devices.gv", view=view)
+    ##
+    # @brief télécharge toutes les données de la Livebox en une passe et écrit les fichiers de dump-sysbus.sh
+    #
+    # @param args répertoire de sortie (dump par défaut)
+    #
+    # @return 
+    def dump_cmd(args):
+        """ télécharge les données de la Livebox et en écrit tous les fichiers: -dump [ répertoire ] """
+        dump_livebox(args[0] if len(args) > 0 else "dump")
 
 
     ##
@@ -1556,6 +5220,42 @@ def add_commands(parser):
             parser.add_argument('-' + cmd[:-4], help=str.strip(func.__doc__ or ""), dest='run_auth', action='store_const', const=func)
 
 
+##
+# @brief analyse une requête passée sur la ligne de commandes
+#
+# @param sysbus chemin de la requête
+# @param args paramètres nom=valeur
+#
+# @return (chemin, paramètres)
+def analyse_requete(sysbus, args):
+    parameters = OrderedDict()
+    for i in args:
+        a = i.split("=", 1)
+        parameters[a[0]] = a[1]
+
+    # analyse une requête formulée comme les queries sur les NeMo.Intf.xxx :
+    # 'NeMo.Intf.wl1.getParameters(name="NetDevIndex", flag="", traverse="down")'
+    p = sysbus.find('(')
+    if p >= 0 and sysbus[-1] == ')' and sysbus.find('.') > 0:
+        i = sysbus.find(':')
+        if i == -1 or i > p:
+            # sépare le chemin des paramètres entre parenthèses
+            t = sysbus[p + 1:-1]
+            sysbus = sysbus[:p]
+
+            # remplace le dernier . par : (séparation du chemin du nom de la fonction)
+            p = sysbus.rfind('.')
+            sysbus = sysbus[0:p] + ':' + sysbus[p+1:]
+
+            # ajoute les arguments passés entre parenthèses
+            for i in t.split(','):
+                if i.find('=') > 0:
+                    a = i.strip().split('=', 1)
+                    parameters[a[0]] = a[1].strip('"')
+
+    return sysbus, parameters
+
+
 ##
 # @brief requête sybus avec paramètres optionnels
 #
@@ -1574,30 +5274,7 @@ def par_defaut(sysbus, args, raw=False):
         #    print("Livebox time: ", result['data']['time'])
 
     else:
-        parameters = OrderedDict()
-        for i in args:
-            a = i.split("=", 1)
-            parameters[a[0]] = a[1]
-
-        # analyse une requête formulée comme les queries sur les NeMo.Intf.xxx :
-        # 'NeMo.Intf.wl1.getParameters(name="NetDevIndex", flag="", traverse="down")'
-        p = sysbus.find('(')
-        if p >= 0 and sysbus[-1] == ')' and sysbus.find('.') > 0:
-            i = sysbus.find(':')
-            if i == -1 or i > p:
-                # sépare le chemin des paramètres entre parenthèses
-                t = sysbus[p + 1:-1]
-                sysbus = sysbus[:p]
-
-                # remplace le dernier . par : (séparation du chemin du nom de la fonction)
-                p = sysbus.rfind('.')
-                sysbus = sysbus[0:p] + ':' + sysbus[p+1:]
-
-                # ajoute les arguments passés entre parenthèses
-                for i in t.split(','):
-                    if i.find('=') > 0:
-                        a = i.strip().split('=', 1)
-                        parameters[a[0]] = a[1].strip('"')
+        sysbus, parameters = analyse_requete(sysbus, args)
 
         # envoie la requête
         if raw:
@@ -1608,13 +5285,137 @@ def par_defaut(sysbus, args, raw=False):
             requete_print(sysbus, parameters)
 
 
+##
+# @brief aplatit un résultat en dictionnaire chemin -> valeur ('data.LinkState': 'up')
+#        les éléments de listes sont repérés par leur clé (Key, physAddress...) si elle existe
+#        un texte est découpé en lignes
+#
+# @param r
+# @param prefixe
+# @param plat dictionnaire complété
+#
+# @return 
+def aplatit(r, prefixe="", plat=None):
+    if plat is None:
+        plat = { }
+
+    if isinstance(r, str) and prefixe == "":
+        for ligne in r.splitlines():
+            plat[ligne] = ""
+
+    elif isinstance(r, dict):
+        for k, v in r.items():
+            aplatit(v, prefixe + str(k) + ".", plat)
+
+    elif isinstance(r, list):
+        for n, v in enumerate(r):
+            cle = n
+            if isinstance(v, dict):
+                for i in ('Key', 'physAddress', 'PhysAddress', 'MACAddress', 'Id', 'id', 'Name', 'name'):
+                    if i in v and isinstance(v[i], str):
+                        cle = v[i]
+                        break
+            aplatit(v, prefixe + str(cle) + ".", plat)
+
+    else:
+        plat[prefixe[:-1]] = r
+
+    return plat
+
+
+##
+# @brief capture la sortie d'une commande pour la surveiller avec surveille()
+#
+# @param commande fonction sans argument qui affiche son résultat
+#
+# @return fonction retournant le texte affiché
+def sortie_de(commande):
+    def appel():
+        f = io.StringIO()
+        with contextlib.redirect_stdout(f):
+            commande()
+        return f.getvalue()
+    return appel
+
+
+##
+# commandes qui ne font que lire la Livebox, seules acceptées avec -watch
+COMMANDES_LECTURE = ( "info", "time", "wifi", "getdev", "dhcp", "hosts", "ipv6", "model", "object", "calls" )
+
+
+##
+# @brief répète un appel et n'affiche que ce qui a changé depuis l'échantillon précédent
+#        l'intervalle raccourcit tant que les valeurs changent et s'allonge quand elles sont stables
+#        une erreur réseau (coupure, redémarrage de la Livebox) est affichée et la surveillance continue
+#
+# @param appel fonction sans argument retournant un résultat (dictionnaire, liste ou texte)
+# @param intervalle intervalle nominal en secondes
+#
+# @return 
+def surveille(appel, intervalle):
+    mini = max(intervalle / 4, 0.5)
+    maxi = intervalle * 4
+    pas = intervalle
+    avant = None
+
+    try:
+        while True:
+            debut = time.monotonic()
+            date = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+            try:
+                r = appel()
+            except (requests.exceptions.RequestException, ConnectionError) as e:
+                # Livebox injoignable, délai dépassé ou disjoncteur ouvert: on réessaie à l'intervalle nominal
+                error("%s ! %s" % (date, e))
+                pas = intervalle
+                time.sleep(max(0, pas - (time.monotonic() - debut)))
+                continue
+            plat = aplatit(r) if r is not None else { }
+
+            if avant is None:
+                # premier échantillon: affichage complet
+                if isinstance(r, str):
+                    sys.stdout.write(r)
+                else:
+                    pprint.pprint(r)
+                changements = 0
+
+            else:
+                changements = 0
+                for k in plat:
+                    if k not in avant:
+                        print("%s + %s" % (date, k) if isinstance(r, str) else "%s + %s: %r" % (date, k, plat[k]))
+                        changements += 1
+                    elif avant[k] != plat[k]:
+                        print("%s ~ %s: %r -> %r" % (date, k, avant[k], plat[k]))
+                        changements += 1
+                for k in avant:
+                    if k not in plat:
+                        print("%s - %s" % (date, k) if isinstance(r, str) else "%s - %s: %r" % (date, k, avant[k]))
+                        changements += 1
+
+            sys.stdout.flush()
+            avant = plat
+
+            if changements > 0:
+                pas = max(mini, pas / 2)
+            else:
+                pas = min(maxi, pas * 1.5)
+            debug(2, "prochain échantillon dans %.1f s" % pas)
+
+            time.sleep(max(0, pas - (time.monotonic() - debut)))
+
+    except KeyboardInterrupt:
+        pass
+
+
 ##
 # @brief fonction principale
 #
 # @return 
 def main():
-    global USER_LIVEBOX, PASSWORD_LIVEBOX, URL_LIVEBOX
-    global verbosity
+    global USER_LIVEBOX, PASSWORD_LIVEBOX, URL_LIVEBOX, STATE_TTL
+    global verbosity, MODEL_CACHE, REPONSES_CACHE, HOSTS_TTL, cassette, mesures, instantane
 
     parser = argparse.ArgumentParser(description='requêtes sysbus pour Livebox')
 
@@ -1629,10 +5430,23 @@ def main():
             dest='run', action='store_const',
             const=extract_files)
 
+    parser.add_argument('-modeldiff', help="compare deux datamodels sauvegardés par -modelraw: -modeldiff A.json B.json",
+            dest='run', action='store_const',
+            const=model_diff)
+
+    parser.add_argument('-find', help="cherche dans l'index du datamodel: -find [ function | parameter | object ] nom | texte",
+            dest='run', action='store_const',
+            const=find_model)
+
+    parser.add_argument('-tsquery', help="débit des séries enregistrées par -tsrecord: -tsquery motif [ depuis [ jusqu'à [ pas ] ] ]",
+            dest='run', action='store_const',
+            const=ts_query)
+
     # gestion de l'authentification
     parser.add_argument('-url', help="url de la Livebox")
     parser.add_argument('-user', help="user de la Livebox")
     parser.add_argument('-password', help="password de la Livebox")
+    parser.add_argument('-ttl', help="durée de validité en secondes de la session mémorisée (0: illimitée)", type=int)
 
     # mémorise et affiche la conf
     parser.add_argument('-config', help="écrit la configuration dans ~/.sysbusrc",
@@ -1640,10 +5454,20 @@ def main():
             const=write_conf)
 
     parser.add_argument('-noauth', help="ne s'authentifie pas avant les requêtes", action='store_true', default=False)
+    parser.add_argument('-daemon', help="garde une session ouverte pour les appels suivants: -daemon [ stop | status ]", action='store_true', default=False)
 
     # modifications du comportement des commandes
     parser.add_argument('-raw', help="", action='store_true', default=False)
     parser.add_argument('-out', help="fichier de sortie")
+    parser.add_argument('-watch', help="répète la requête toutes les N secondes et affiche les changements", type=float, metavar='N')
+    parser.add_argument('-cachemodel', help="lit le datamodel dans le cache (valeurs des paramètres figées au téléchargement)", action='store_true', default=False)
+    parser.add_argument('-cache', help="garde en cache les réponses des requêtes get* et list*", action='store_true', default=False)
+    parser.add_argument('-record', help="enregistre les requêtes et les réponses dans une cassette", metavar='REP')
+    parser.add_argument('-replay', help="répond aux requêtes depuis une cassette, sans contacter la Livebox", metavar='REP')
+    parser.add_argument('-from', help="lit les données de -model, -modeluml, -MIBs table, -graph et -topo dans un fichier enregistré, sans contacter la Livebox",
+            dest='depuis', metavar='FICHIER')
+    parser.add_argument('-stats', help="affiche à la fin l'histogramme des durées des requêtes et les plus lentes", action='store_true', default=False)
+    parser.add_argument('-trace', help="écrit la chronologie des requêtes au format trace-event de Chrome", metavar='FICHIER')
 
     # les commandes "requêtes"
     add_singles(parser)
@@ -1659,6 +5483,8 @@ def main():
     args = parser.parse_args()
 
     verbosity = args.verbose
+    MODEL_CACHE = args.cachemodel
+    REPONSES_CACHE = args.cache
     load_conf()
 
     new_session = False
@@ -1671,6 +5497,40 @@ def main():
     if args.password:
         PASSWORD_LIVEBOX = args.password
         new_session = True          # ne charge pas le fichier des cookies
+    if args.ttl is not None:
+        STATE_TTL = args.ttl
+
+    if args.stats or args.trace:
+        mesures = mesures_requetes()
+        if args.stats:
+            atexit.register(mesures.resume, STATS_TOP)
+        if args.trace:
+            atexit.register(mesures.trace, args.trace)
+
+    if args.record or args.replay:
+        try:
+            cassette = cassette_sysbus(args.replay or args.record, rejeu=args.replay is not None)
+        except ValueError as e:
+            error(str(e))
+            sys.exit(2)
+        if cassette.rejeu and cassette.url and not args.url:
+            URL_LIVEBOX = cassette.url
+        # toutes les requêtes passent par la cassette: pas de cache, ni de session mémorisée à l'enregistrement
+        MODEL_CACHE = False
+        REPONSES_CACHE = False
+        HOSTS_TTL = 0
+        new_session = new_session or not cassette.rejeu
+
+    # -watch doit afficher l'état courant à chaque passage
+    if args.watch:
+        HOSTS_TTL = 0
+
+    if args.depuis:
+        try:
+            instantane = instantane_sysbus(args.depuis)
+        except OSError as e:
+            error(str(e))
+            sys.exit(2)
 
 
     if args.run:
@@ -1679,9 +5539,16 @@ def main():
             a.insert(0, args.sysbus)
         args.run(a)
 
+    elif args.daemon:
+        daemon_cmd(args.sysbus or 'start', new_session)
+
     else:
-        if args.noauth: 
+        if instantane is not None:
+            pass                            # les données viennent du fichier
+        elif args.noauth: 
             noauth()                        # initialise la session requests
+        elif not new_session and cassette is None and connecte_daemon():
+            pass                            # les requêtes passent par le démon
         else:
             if not auth(new_session):       # initialise la session requests avec authentification
                 sys.exit(1)
@@ -1700,8 +5567,33 @@ def main():
                 debug(2, "redirect to", args.out)
                 sys.stdout = open(args.out, "w")
 
+            # surveillance d'une requête ou d'une commande
+            if args.watch:
+                if args.run_auth:
+                    if args.run_auth.__name__[:-4] not in COMMANDES_LECTURE:
+                        error("-watch: -%s n'est pas une commande de lecture" % args.run_auth.__name__[:-4])
+                        sys.exit(2)
+                    a = ([ args.sysbus ] if not args.sysbus is None else [ ]) + args.parameters
+                    appel = sortie_de(lambda: args.run_auth(list(a)))
+                elif args.req_auth:
+                    req = [ args.req_auth ] if type(args.req_auth) is str else args.req_auth
+                    if not methode_lecture(req[0]):
+                        error("-watch: %s n'est pas une méthode de lecture" % req[0])
+                        sys.exit(2)
+                    appel = lambda: requete(*req)
+                elif args.sysbus:
+                    chemin, parameters = analyse_requete(args.sysbus, args.parameters)
+                    if ':' in chemin and not methode_lecture(chemin):
+                        error("-watch: %s n'est pas une méthode de lecture" % chemin)
+                        sys.exit(2)
+                    appel = lambda: requete(chemin, parameters)
+                else:
+                    appel = sortie_de(livebox_info)
+
+                surveille(appel, args.watch)
+
             # commande complexe
-            if args.run_auth:
+            elif args.run_auth:
                 a = args.parameters
                 if not args.sysbus is None:
                     a.insert(0, args.sysbus)
@@ -1720,6 +5612,21 @@ def main():
             else:
                 par_defaut(args.sysbus, args.parameters, args.raw)
 
+        debug(1, "transport: " + ", ".join("%s=%d" % i for i in sorted(transport_stats.items())))
+
+
+##
+# @brief point d'entrée du script: main(), les erreurs de connexion étant affichées sur une ligne
+#
+# @return 
+def lance():
+    try:
+        main()
+    except ConnectionError as e:
+        # requête impossible avec -from ou absente de la cassette -replay, démon ou disjoncteur
+        error(str(e))
+        sys.exit(2)
+
 
 if __name__ == '__main__':
-    main()
+    lance()